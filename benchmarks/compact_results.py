@@ -0,0 +1,142 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Benchmarks of the compact result modes of the wrapper functions.
+
+Compares the time of formatting large responses, and the memory held by the
+results, with the default sorted lists of values and lists of tuples against
+unsorted values and compact triple lists. Responses are generated locally, so
+only the formatting in the client is measured. Memory is measured in a
+separate run, since tracing allocations slows them down.
+
+Run it with the package installed, or from the root of the repository:
+
+.. code-block:: bash
+
+  PYTHONPATH=. python benchmarks/compact_results.py --edges 1000000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import time
+
+try:
+  from unittest.mock import patch
+except ImportError:
+  from mock import patch
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+import datacommons as dc
+import datacommons.utils as utils
+
+
+def property_values_payload(nodes, edges):
+  """ Returns a get_property_values payload of :code:`edges` values spread
+  over :code:`nodes` nodes, with values repeated across nodes.
+  """
+  per_node = edges // nodes
+  return dict(
+    ('geoId/{}'.format(n), {'out': [
+      {'dcid': 'dc/{:07d}'.format((n * 7919 + i) % (edges // 4))}
+      for i in range(per_node)]})
+    for n in range(nodes))
+
+
+def triples_payload(nodes, edges):
+  """ Returns a get_triples payload of :code:`edges` triples spread over
+  :code:`nodes` nodes.
+  """
+  per_node = edges // nodes
+  return dict(
+    ('geoId/{}'.format(n), [
+      {'subjectId': 'geoId/{}{:07d}'.format(n, i),
+       'predicate': 'containedInPlace', 'objectId': 'geoId/{}'.format(n)}
+      for i in range(per_node)])
+    for n in range(nodes))
+
+
+def measure(name, fn):
+  """ Runs :code:`fn` and prints its time and the memory held by its result.
+  """
+  gc.collect()
+  start = time.time()
+  result = fn()
+  elapsed = time.time() - start
+  held = float('nan')
+  if tracemalloc is not None:
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+  print('{:<36} {:>8.2f}s {:>10.1f}MB'.format(name, elapsed, held / 2**20))
+  return result
+
+
+def compare_property_values(dcids, edges):
+  """ Compares sorted and unsorted values of :code:`edges` values. """
+  # Responses are parsed on every call, so that results hold their own strings
+  # as they would when fetched.
+  payload = json.dumps(property_values_payload(len(dcids), edges))
+  with patch('datacommons.utils._send_request',
+             side_effect=lambda *args, **kwargs: json.loads(payload)):
+    sorted_values = measure(
+      'get_property_values', lambda: dc.get_property_values(
+        dcids, 'containedInPlace', limit=edges + 1))
+    unsorted_values = measure(
+      'get_property_values(sort=False)', lambda: dc.get_property_values(
+        dcids, 'containedInPlace', limit=edges + 1, sort=False))
+  assert all(sorted(unsorted_values[dcid]) == sorted_values[dcid]
+             for dcid in dcids)
+
+
+def compare_triples(dcids, edges):
+  """ Compares lists of tuples and compact lists of :code:`edges` triples. """
+  payload = json.dumps(triples_payload(len(dcids), edges))
+  with patch('datacommons.utils._send_request',
+             side_effect=lambda *args, **kwargs: json.loads(payload)):
+    tuples = measure('get_triples', lambda: dc.get_triples(dcids))
+    compact = measure('get_triples(compact=True)',
+                      lambda: dc.get_triples(dcids, compact=True))
+  assert all(compact[dcid] == tuples[dcid] for dcid in dcids)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--nodes', type=int, default=100,
+                      help='the number of nodes in a response')
+  parser.add_argument('--edges', type=int, default=10**6,
+                      help='the number of values or triples in a response')
+  args = parser.parse_args(argv)
+  print('{:<36} {:>9} {:>12}'.format('', 'time', 'result'))
+  dcids = ['geoId/{}'.format(n) for n in range(args.nodes)]
+  # Results are formatted from one request for all nodes.
+  utils._QUERY_BATCH_SIZE = args.nodes
+  # Each comparison frees its payload and results when it returns.
+  compare_property_values(dcids, args.edges)
+  compare_triples(dcids, args.edges)
+
+
+if __name__ == '__main__':
+  main()
@@ -16,10 +16,16 @@
 from datacommons.query import query
 
 # Data Commons Python API
-from datacommons.core import get_property_labels, get_property_values, get_triples
-from datacommons.places import get_places_in, get_related_places, get_stats
+from datacommons.core import get_property_labels, get_property_values, iter_property_values, get_properties, get_triples, iter_triples
+from datacommons.places import get_places_in, get_related_places, get_stats, iter_stats, refresh_stats
 from datacommons.populations import get_populations, get_observations, get_pop_obs, get_place_obs
 from datacommons.stat_vars import get_stat_value, get_stat_series, get_stat_all
+from datacommons.traversal import traverse
 
 # Other utilities
-from .utils import set_api_key
+from .utils import set_api_key, set_rate_limit
+from .batch import set_adaptive_batching
+from .cache import DiskCache, MemoryCache, set_cache, negative_hits, invalidate
+from .prefetch import prefetch
+from .cassette import use_cassette
+from .graph import TripleStore
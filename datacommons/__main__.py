@@ -0,0 +1,47 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API command line.
+
+Runs the command named by the first argument, e.g.
+
+.. code-block:: bash
+
+  python -m datacommons prefetch manifest.json --cache /tmp/datacommons.db
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import importlib
+import sys
+
+# The modules implementing each command in a main(argv) function.
+_COMMANDS = {
+  'prefetch': 'datacommons.prefetch',
+  'proxy': 'datacommons.proxy',
+}
+
+
+def main(argv=None):
+  argv = sys.argv[1:] if argv is None else argv
+  if not argv or argv[0] not in _COMMANDS:
+    sys.stderr.write('usage: python -m datacommons {{{}}} ...\n'.format(
+      ','.join(sorted(_COMMANDS))))
+    return 2
+  return importlib.import_module(_COMMANDS[argv[0]]).main(argv[1:])
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,475 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Batch Module.
+
+Internal helpers used by wrapper functions that split a long list of dcids into
+several requests. Batches are planned once and issued concurrently from a small
+pool of threads.
+
+Batch sizes are fixed at :code:`_QUERY_BATCH_SIZE` unless adaptive batching is
+enabled with :any:`set_adaptive_batching`, in which case they are learned per
+endpoint and stat var from the latency and size of previous responses.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import sys
+import threading
+import time
+
+import six
+import six.moves.queue
+
+import datacommons.cache as cache_lib
+import datacommons.journal as journal_lib
+import datacommons.utils as utils
+
+
+# The adaptive batch sizer shared by all wrappers, if enabled.
+_adaptive_sizer = None
+
+# Per-thread request counters, set while a batch is fetched for a call with a
+# progress callback.
+_local = threading.local()
+
+
+def set_adaptive_batching(enabled=True,
+                          min_size=10,
+                          max_size=5000,
+                          target_latency=5.0,
+                          target_bytes=4 * 1024 * 1024):
+  """ Enables or disables adaptive batch sizing for batched wrapper functions.
+
+  When enabled, the number of dcids sent per request is learned separately for
+  each endpoint and statistical variable. Batches grow while responses come
+  back faster and smaller than the targets, and shrink when they do not.
+  Learned sizes are kept for the rest of the session.
+
+  Args:
+    enabled (:obj:`bool`, optional): Whether adaptive batching is used.
+      Disabling it discards all learned sizes.
+    min_size (:obj:`int`, optional): The smallest batch size to use.
+    max_size (:obj:`int`, optional): The largest batch size to use.
+    target_latency (:obj:`float`, optional): The desired response time of a
+      single request, in seconds.
+    target_bytes (:obj:`int`, optional): The desired size of a single
+      response, in bytes.
+  """
+  global _adaptive_sizer
+  if not enabled:
+    _adaptive_sizer = None
+    return
+  if min_size < 1 or max_size < min_size:
+    raise ValueError(
+      'Invalid batch size bounds: [{}, {}]'.format(min_size, max_size))
+  _adaptive_sizer = _AdaptiveBatchSizer(
+    min_size, max_size, target_latency, target_bytes)
+
+
+class _AdaptiveBatchSizer(object):
+  """ Learns batch sizes per (endpoint, key) from observed responses. """
+
+  def __init__(self, min_size, max_size, target_latency, target_bytes):
+    self.min_size = min_size
+    self.max_size = max_size
+    self.target_latency = target_latency
+    self.target_bytes = target_bytes
+    self._sizes = {}
+    self._lock = threading.Lock()
+
+  def size(self, endpoint, key):
+    """ Returns the current batch size for :code:`(endpoint, key)`. """
+    with self._lock:
+      size = self._sizes.get((endpoint, key), utils._QUERY_BATCH_SIZE)
+    return int(self._clamp(size))
+
+  def observe(self, endpoint, key, count, latency, num_bytes):
+    """ Updates the batch size from a response to a batch of :code:`count`. """
+    if count <= 0:
+      return
+    target = self.max_size
+    if latency > 0:
+      target = min(target, self.target_latency * count / latency)
+    if num_bytes > 0:
+      target = min(target, self.target_bytes * count / num_bytes)
+    with self._lock:
+      current = self._sizes.get((endpoint, key), utils._QUERY_BATCH_SIZE)
+      # Move towards the target, at most doubling or halving per response.
+      size = max(current / 2, min(current * 2, target))
+      self._sizes[(endpoint, key)] = self._clamp(size)
+
+  def _clamp(self, size):
+    return max(self.min_size, min(self.max_size, size))
+
+
+def _plan(endpoint, dcids, keys):
+  """ Yields :code:`(key, dcids_batch)` covering every dcid for every key.
+
+  Without adaptive batching the dcids are chunked once and each chunk is paired
+  with every key. Otherwise each key is chunked separately, taking turns so the
+  size of every chunk reflects the responses received so far.
+  """
+  sizer = _adaptive_sizer
+  if sizer is None:
+    for chunk in _chunks(dcids, utils._QUERY_BATCH_SIZE):
+      for key in keys:
+        yield key, chunk
+    return
+
+  offsets = dict((key, 0) for key in keys) if dcids else {}
+  while offsets:
+    for key in list(offsets):
+      start = offsets[key]
+      end = start + sizer.size(endpoint, key)
+      yield key, dcids[start:end]
+      if end >= len(dcids):
+        del offsets[key]
+      else:
+        offsets[key] = end
+
+
+def _send(endpoint, key, dcids, req_json, use_cache=True,
+          cached_per_dcid=True, **kwargs):
+  """ Sends one batch request for :code:`dcids` to the given endpoint.
+
+  The network time and size of the response are reported to the adaptive
+  batch sizer, unless it came from the cache, and to the progress counters of
+  the calling thread if any. Time spent waiting for the rate limit is not
+  counted, so that throttling does not shrink batches. Unless
+  :code:`use_cache` is set, the request is sent even if it is cached.
+  Requests whose results are cached per dcid by :obj:`_run` are not cached
+  themselves when per dcid caching is on, while requests sent outside of it,
+  e.g. for pages, unset :code:`cached_per_dcid` to stay cached.
+  """
+  url = utils._API_ROOT + utils._API_ENDPOINTS[endpoint]
+  stats = {}
+  counters = getattr(_local, 'counters', None)
+  if counters is not None:
+    counters['requests'] += 1
+  # Batches are cached per dcid rather than per request when enabled.
+  use_cache = use_cache and not (cached_per_dcid and
+                                 cache_lib._dcid_cache is not None)
+  payload = utils._send_request(
+    url, req_json, stats=stats, use_cache=use_cache, **kwargs)
+  if counters is not None:
+    counters['bytes'] += stats.get('bytes', 0)
+  sizer = _adaptive_sizer
+  if sizer is not None and not stats['cached']:
+    sizer.observe(endpoint, key, len(dcids), stats['latency'],
+                  stats.get('bytes', 0))
+  return payload
+
+
+def _run(endpoint, dcids, keys, fetch, ordered=False, tolerate_errors=False,
+         journal=None, params=None, progress=None, cacheable=None,
+         stores=(), lookup=True):
+  """ Runs a batched call and yields :code:`(key, dcids, payload, failed)` for
+  every batch.
+
+  Args:
+    endpoint (:obj:`str`): The key of the endpoint in :code:`_API_ENDPOINTS`.
+    dcids (:obj:`list` of :obj:`str`): The dcids to split into batches.
+    keys (:obj:`list`): The values of the non-dcid part of the request which
+      every dcid is fetched for, e.g. stat vars.
+    fetch (:obj:`func`): Called as :code:`fetch(key, dcids)` to fetch a batch,
+      returning a :obj:`dict` payload keyed by dcid.
+    ordered (:obj:`bool`): Whether to yield batches in planning order.
+    tolerate_errors (:obj:`bool`): Whether to retry and split failing batches
+      rather than raise. Dcids that failed are yielded in :code:`failed`,
+      mapped to their error message.
+    journal (:obj:`Journal` or :obj:`str`): Optional journal, or path to one,
+      to checkpoint completed batches to. Dcids already completed in an
+      earlier call with the same :code:`params` are read from the journal
+      and yielded first.
+    params (:obj:`dict`): The request arguments other than dcids and keys,
+      identifying the call in the journal and the per dcid cache.
+    progress (:obj:`func`): Optional, called with a progress report after
+      every batch. See :obj:`_Progress`.
+    cacheable (:obj:`func`): Optional, called as :code:`cacheable(payload)`
+      to tell whether the results of a batch may be cached per dcid, e.g.
+      because they were not truncated. All batches are cacheable if unset.
+    stores (:obj:`list`): Optional, further stores with the interface of
+      :obj:`Journal` to look dcids up in and record batches to, such as
+      :obj:`datacommons.cache._SeriesStore`.
+    lookup (:obj:`bool`): Whether to look dcids up in the stores. If unset,
+      every dcid is fetched and the stores are only recorded to.
+
+  Like the journal, the per dcid cache, if enabled, is used to look up dcids
+  which were fetched before and to record the results of every batch.
+  """
+  tracker = _Progress(progress) if progress is not None else None
+  with journal_lib._opened(journal) as journal:
+    stores = [store for store in
+              [journal, cache_lib._dcid_store(endpoint, params)] + list(stores)
+              if store is not None]
+    call = journal_lib._call_key(endpoint, params)
+    remaining = collections.OrderedDict()
+    for key in keys:
+      todo = dcids
+      for store in (stores if lookup else []):
+        done = store.lookup(call, key, todo) if todo else {}
+        if done:
+          payload = dict((k, v) for k, v in done.items() if v is not None)
+          if tracker is not None:
+            tracker.replay(len(payload))
+          yield key, list(done), payload, {}
+          todo = [dcid for dcid in todo if dcid not in done]
+      if todo:
+        remaining.setdefault(tuple(todo), []).append(key)
+
+    def run(task):
+      key, batch_dcids = task
+      counters = None
+      if tracker is not None:
+        counters = _local.counters = {'requests': 0, 'bytes': 0}
+      try:
+        if tolerate_errors:
+          payload, failed = _send_tolerant(
+            fetch, key, batch_dcids, _merge_dicts)
+          return payload or {}, failed, counters
+        return fetch(key, batch_dcids), {}, counters
+      finally:
+        if counters is not None:
+          _local.counters = None
+
+    # Keys with the same remaining dcids share their batches.
+    tasks = (task
+             for todo, todo_keys in remaining.items()
+             for task in _plan(endpoint, list(todo), todo_keys))
+    if tracker is not None:
+      tracker.total += sum(_estimate_batches(endpoint, len(todo), todo_keys)
+                           for todo, todo_keys in remaining.items())
+      tasks = tracker.count_planned(tasks)
+    for (key, batch_dcids), (payload, failed, counters) in _imap(
+        run, tasks, ordered=ordered):
+      if tracker is not None:
+        tracker.update(len(payload), counters['requests'], counters['bytes'])
+      if stores:
+        completed = [dcid for dcid in batch_dcids if dcid not in failed]
+        for store in stores:
+          if store is journal or cacheable is None or cacheable(payload):
+            store.record(call, key, completed, payload)
+      yield key, batch_dcids, payload, failed
+
+
+def _fetch_all(endpoint, dcids, req_json, transform=None, cacheable=None):
+  """ Fetches :code:`dcids` from :code:`endpoint` in batches.
+
+  Every batch sends :code:`req_json` with its :code:`dcids` field set to the
+  dcids of the batch.
+
+  Args:
+    transform (:obj:`func`): Optional, converts the payload of a batch into a
+      :obj:`dict` keyed by dcid.
+    cacheable (:obj:`func`): Optional, see :obj:`_run`.
+
+  Returns:
+    The payloads of all batches merged into one :obj:`dict` keyed by dcid.
+  """
+  def fetch(_, batch_dcids):
+    payload = _send(endpoint, None, batch_dcids,
+                    dict(req_json, dcids=batch_dcids))
+    return transform(payload) if transform is not None else payload
+
+  merged = {}
+  for _, _, payload, _ in _run(endpoint, dcids, [None], fetch,
+                               params=req_json, cacheable=cacheable):
+    merged.update(payload)
+  return merged
+
+
+class _Progress(object):
+  """ Tracks the progress of a batched call and reports it to a callback.
+
+  The callback is called after every completed batch with a :obj:`dict`
+  holding:
+
+  - :code:`batches_done`: The number of batches completed so far, including
+    batches read from a journal.
+  - :code:`batches_total`: The total number of batches. With adaptive batching
+    this is an estimate until every batch has been planned.
+  - :code:`requests`: The number of requests sent, including retries.
+  - :code:`bytes`: The number of response bytes received.
+  - :code:`records`: The number of records decoded from the responses.
+  - :code:`elapsed`: The number of seconds since the call started.
+  - :code:`requests_per_second`: The average request rate so far.
+  """
+
+  def __init__(self, callback):
+    self.callback = callback
+    self.start = time.time()
+    self.done = 0
+    self.total = 0
+    self.replayed = 0
+    self.requests = 0
+    self.bytes = 0
+    self.records = 0
+
+  def count_planned(self, tasks):
+    """ Yields :code:`tasks`, fixing the total once all are planned. """
+    planned = 0
+    for task in tasks:
+      planned += 1
+      yield task
+    self.total = self.replayed + planned
+
+  def replay(self, records):
+    """ Records a batch read from a journal and calls the callback. """
+    self.replayed += 1
+    self.total += 1
+    self.update(records)
+
+  def update(self, records, requests=0, num_bytes=0):
+    """ Records a completed batch and calls the callback. """
+    self.done += 1
+    self.records += records
+    self.requests += requests
+    self.bytes += num_bytes
+    elapsed = time.time() - self.start
+    self.callback({
+      'batches_done': self.done,
+      'batches_total': max(self.total, self.done),
+      'requests': self.requests,
+      'bytes': self.bytes,
+      'records': self.records,
+      'elapsed': elapsed,
+      'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0,
+    })
+
+
+def _estimate_batches(endpoint, num_dcids, keys):
+  """ Returns the number of batches :code:`_plan` is expected to yield. """
+  sizer = _adaptive_sizer
+  if sizer is None:
+    # Chunks are shared by all keys.
+    return -(-num_dcids // utils._QUERY_BATCH_SIZE) * len(keys)
+  return sum(-(-num_dcids // sizer.size(endpoint, key)) for key in keys)
+
+
+def _send_tolerant(fetch, key, dcids, merge, retries=None):
+  """ Calls :code:`fetch(key, dcids)`, isolating the dcids that make it fail.
+
+  A failing batch is retried :code:`_MAX_BATCH_RETRIES` times, then split in
+  half and each half is fetched separately, recursively. Single dcids which
+  still fail after their own retries are reported as failed.
+
+  Returns:
+    A tuple :code:`(payload, failed)` where :code:`payload` merges, using
+    :code:`merge(a, b)`, the payloads of all requests that succeeded, or is
+    :obj:`None` if none did, and :code:`failed` maps failed dcids to the error
+    message of their last attempt.
+  """
+  if retries is None:
+    retries = utils._MAX_BATCH_RETRIES
+  error = None
+  for attempt in range(retries + 1):
+    if attempt:
+      time.sleep(utils._BATCH_RETRY_DELAY * 2 ** (attempt - 1))
+    try:
+      return fetch(key, dcids), {}
+    except Exception as e:  # pylint: disable=broad-except
+      error = e
+  if len(dcids) <= 1:
+    return None, dict((dcid, str(error)) for dcid in dcids)
+
+  # Split the batch, retrying halves only once they are down to a single dcid.
+  mid = len(dcids) // 2
+  payload, failed = None, {}
+  for half in (dcids[:mid], dcids[mid:]):
+    half_payload, half_failed = _send_tolerant(
+      fetch, key, half, merge, retries if len(half) == 1 else 0)
+    failed.update(half_failed)
+    if half_payload is None:
+      continue
+    payload = half_payload if payload is None else merge(payload, half_payload)
+  return payload, failed
+
+
+def _merge_dicts(a, b):
+  """ Merges two dict payloads of a split batch. """
+  a.update(b)
+  return a
+
+
+def _chunks(items, size):
+  """ Splits :code:`items` into consecutive lists of at most :code:`size`. """
+  size = max(1, int(size))
+  return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _imap(fn, items, max_workers=None, ordered=False):
+  """ Yields :code:`(item, fn(item))` for each item, calling :code:`fn` from a
+  pool of threads.
+
+  Items are pulled from :code:`items` lazily, so at most :code:`max_workers`
+  calls are in flight at any time. Results are yielded in completion order
+  unless :code:`ordered` is set, in which case they are yielded in the order of
+  :code:`items` and at most :code:`max_workers` results are buffered. The first
+  exception raised by :code:`fn` is re-raised to the caller. The threads share
+  the rate limit of the calling thread, if any.
+  """
+  if max_workers is None:
+    max_workers = utils._MAX_CONCURRENT_REQUESTS
+  if max_workers <= 1:
+    for item in items:
+      yield item, fn(item)
+    return
+
+  items = iter(items)
+  done = six.moves.queue.Queue()
+  limiter = getattr(utils._local, 'limiter', None)
+
+  def run(index, item):
+    utils._local.limiter = limiter
+    try:
+      done.put((index, item, fn(item), None))
+    except Exception:  # pylint: disable=broad-except
+      done.put((index, item, None, sys.exc_info()))
+
+  submitted = 0
+  next_index = 0
+  in_flight = 0
+  exhausted = False
+  buffered = {}
+  while True:
+    # Keep the pool full. In ordered mode, also bound the reorder buffer.
+    while not exhausted and in_flight < max_workers and (
+        not ordered or submitted - next_index < max_workers):
+      try:
+        item = next(items)
+      except StopIteration:
+        exhausted = True
+        break
+      thread = threading.Thread(target=run, args=(submitted, item))
+      thread.daemon = True
+      thread.start()
+      submitted += 1
+      in_flight += 1
+    if in_flight == 0:
+      return
+
+    index, item, result, exc_info = done.get()
+    in_flight -= 1
+    if exc_info is not None:
+      six.reraise(*exc_info)
+    if not ordered:
+      yield item, result
+      continue
+    buffered[index] = (item, result)
+    while next_index in buffered:
+      yield buffered.pop(next_index)
+      next_index += 1
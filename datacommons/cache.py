@@ -0,0 +1,1183 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Cache Module.
+
+Provides opt-in caching of REST API responses. Once a cache is installed with
+:any:`set_cache`, every request sent by the wrapper functions is first looked
+up in the cache, keyed on the endpoint and a canonical form of the request in
+which the order of dcids does not matter.
+
+Cached entries are the raw response bytes, so every hit is decoded into fresh
+objects that callers are free to mutate.
+
+Caches may also be installed per dcid, in which case wrapper functions taking
+lists of dcids cache the result of every dcid separately and only send the
+dcids missing from the cache to the server. Dcids for which the server has no
+value are cached too, as negative entries with their own, usually shorter,
+time to live. Negative hits are counted and can be inspected with
+:any:`negative_hits`.
+
+Full time series fetched with :code:`get_stat_series` are also kept per
+(place, stat var, facet) in the installed cache, so that :code:`get_stat_value`
+can answer requests for the latest or specific dates locally. With per dcid
+caching, so are the series fetched with :code:`get_stats`, which then also
+answers requests from the series of either. Without it, responses of
+:code:`get_stats` are only cached per request, since a series per place would
+crowd them out of the cache.
+
+Entries are tagged with the dcids and stat vars they hold, so that they can be
+removed selectively with :any:`invalidate`, e.g. after a bad data import.
+Every cache counts its hits, misses, evictions and expirations per endpoint,
+see :obj:`Cache.stats` and :any:`format_metrics`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+import six
+import six.moves.urllib.parse
+
+import datacommons.utils as utils
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# Request fields holding lists, e.g. of dcids, whose order does not affect the
+# response.
+_UNORDERED_FIELDS = frozenset(['dcids', 'place', 'places', 'stat_vars', 'pvs'])
+
+# Seconds to wait for other processes holding the lock of a disk cache.
+_DISK_TIMEOUT = 30.0
+
+# Seconds between updates of the last access time of disk cache entries.
+_ACCESS_RESOLUTION = 60.0
+
+# The version of the disk cache tables. Caches of other versions are cleared.
+_DISK_SCHEMA_VERSION = 3
+
+# The compression level of zstd compressed disk cache entries.
+_ZSTD_LEVEL = 3
+
+# The number of values a zstd dictionary is trained on, the total size of the
+# samples held for training, and the size of the dictionary in bytes. Training
+# starts once either the number or the size of the samples is reached.
+_ZSTD_DICT_SAMPLES = 256
+_ZSTD_DICT_SAMPLE_BYTES = 2**22
+_ZSTD_DICT_SIZE = 2**17
+
+# Request fields holding the dcids and stat vars entries are tagged with.
+_TAG_FIELDS = frozenset(
+  ['dcid', 'dcids', 'place', 'places', 'stat_var', 'stats_var', 'stat_vars'])
+
+# The endpoints of entries derived from the responses of other endpoints, by
+# the endpoint they are derived from. Invalidating the entries of an endpoint
+# also invalidates the entries derived from it.
+_DERIVED_ENDPOINTS = {'get_stats': ('get_stat_series',)}
+
+# The events counted by caches per endpoint.
+_EVENTS = ('hits', 'misses', 'evictions', 'expirations')
+
+# The buckets of the entry age distribution, by their maximum age in seconds.
+_AGE_BUCKETS = ((60, '1m'), (3600, '1h'), (86400, '1d'), (7 * 86400, '1w'))
+_OLDEST_BUCKET = 'older'
+
+
+# The cache holding per dcid entries of list based wrappers, if enabled.
+_dcid_cache = None
+
+# Counts of negative per dcid cache hits, by endpoint and dcid.
+_negative_hits = collections.defaultdict(collections.Counter)
+_negative_hits_lock = threading.Lock()
+
+
+def set_cache(cache, per_dcid=False):
+  """ Installs :code:`cache` as the response cache of the Python API.
+
+  Args:
+    cache (:obj:`Cache`): The cache to use, e.g. a :obj:`MemoryCache`, or
+      :obj:`None` to disable caching.
+    per_dcid (:obj:`bool`, optional): Whether wrappers taking a list of dcids,
+      such as :any:`get_property_values` and :any:`get_stats`, cache results
+      per (endpoint, dcid, arguments) rather than per request. Overlapping
+      calls then only fetch the dcids that were not fetched before.
+
+  Examples:
+    Cache up to 10000 responses using at most 256MB, keeping
+    :code:`get_stat_all` responses for an hour and all other responses until
+    they are evicted.
+
+    >>> set_cache(MemoryCache(max_entries=10000, max_bytes=256 * 2**20,
+    ...                       ttls={'get_stat_all': 3600}))
+  """
+  global _dcid_cache
+  utils._response_cache = cache
+  _dcid_cache = cache if per_dcid else None
+
+
+def negative_hits(endpoint=None):
+  """ Returns how often dcids were answered by negative cache entries.
+
+  Negative entries record that a dcid has no value for a query, e.g. because
+  the dcid does not exist.
+
+  Args:
+    endpoint (:obj:`str`, optional): The name of an endpoint as in
+      :code:`_API_ENDPOINTS` to return the hits of.
+
+  Returns:
+    A :obj:`dict` mapping endpoint names to :obj:`dict`'s mapping dcids to
+    their number of negative hits, or the latter for :code:`endpoint` only.
+
+  Examples:
+    >>> get_places_in(['dc/MadDcid'], 'City')
+    >>> get_places_in(['dc/MadDcid'], 'City')
+    >>> negative_hits()
+    {'get_places_in': {'dc/MadDcid': 1}}
+  """
+  with _negative_hits_lock:
+    if endpoint is not None:
+      return dict(_negative_hits.get(endpoint, {}))
+    return dict((k, dict(v)) for k, v in _negative_hits.items() if v)
+
+
+def reset_negative_hits():
+  """ Resets the counts returned by :any:`negative_hits`. """
+  with _negative_hits_lock:
+    _negative_hits.clear()
+
+
+def invalidate(endpoint=None, dcid=None, stat_var=None):
+  """ Removes the entries of the installed cache matching all of the given
+  arguments.
+
+  Args:
+    endpoint (:obj:`str`, optional): The name of an endpoint as in
+      :code:`_API_ENDPOINTS`. The series of places kept from the responses of
+      :code:`get_stats` are removed with them.
+    dcid (:obj:`str`, optional): A dcid, e.g. of a place, held by the entries.
+    stat_var (:obj:`str`, optional): A stat var held by the entries.
+
+  Returns:
+    The number of entries removed.
+
+  Raises:
+    ValueError: If no cache is installed.
+
+  Examples:
+    Purge all cached data about a stat var after a bad import, and all
+    :code:`get_stat_all` responses about California.
+
+    >>> invalidate(stat_var='Count_Person')
+    >>> invalidate(endpoint='get_stat_all', dcid='geoId/06')
+  """
+  if utils._response_cache is None:
+    raise ValueError('No cache is installed, see set_cache.')
+  return utils._response_cache.invalidate(endpoint, dcid, stat_var)
+
+
+def format_metrics(cache=None):
+  """ Returns the statistics of a cache in the Prometheus text format.
+
+  Args:
+    cache (:obj:`Cache`, optional): The cache, the installed one by default.
+
+  Returns:
+    A :obj:`str` of metrics named :code:`datacommons_cache_*`, which is empty
+    if no cache is installed.
+  """
+  if cache is None:
+    cache = utils._response_cache
+  if cache is None:
+    return ''
+  stats = cache.stats()
+  lines = []
+  for name, kind in [('entries', 'gauge'), ('bytes', 'gauge')] + [
+      (event, 'counter') for event in _EVENTS]:
+    metric = 'datacommons_cache_{}'.format(name)
+    lines.append('# TYPE {} {}'.format(metric, kind))
+    for endpoint, counts in sorted(stats['endpoints'].items()):
+      lines.append('{}{{endpoint="{}"}} {}'.format(
+        metric, endpoint, counts[name]))
+  lines.append('# TYPE datacommons_cache_entry_age gauge')
+  for _, bucket in _AGE_BUCKETS + ((None, _OLDEST_BUCKET),):
+    lines.append('datacommons_cache_entry_age{{le="{}"}} {}'.format(
+      bucket, stats['ages'][bucket]))
+  lines.append('# TYPE datacommons_cache_negative_hits counter')
+  for endpoint, hits in sorted(negative_hits().items()):
+    lines.append('datacommons_cache_negative_hits{{endpoint="{}"}} {}'.format(
+      endpoint, sum(hits.values())))
+  return '\n'.join(lines) + '\n'
+
+
+class Cache(object):
+  """ The interface of response caches.
+
+  Keys and values are :obj:`bytes`. Every entry belongs to an endpoint, named
+  as in :code:`_API_ENDPOINTS`, which determines its time to live. Negative
+  entries, recording that a query has no value, use :code:`negative_ttl`
+  instead unless it is longer.
+
+  Endpoints with a soft time to live in :code:`soft_ttls` are served stale
+  while revalidating: once an entry is older than its soft TTL it is still
+  returned at once, while a single background request refreshes it. Only
+  entries past their (hard) TTL block on a new request. If a refresh fails,
+  the entry is kept for another TTL rather than evicted.
+
+  Entries are tagged with the dcids, including stat vars, of their request so
+  that they can be invalidated selectively. Hits, misses, evictions and
+  expirations are counted per endpoint, see :obj:`Cache.stats`.
+
+  Args:
+    ttl (:obj:`float`, optional): The default number of seconds entries are
+      kept for, or :obj:`None` to keep them until evicted.
+    ttls (:obj:`dict`, optional): Per endpoint overrides of :code:`ttl`,
+      keyed by endpoint name as in :code:`_API_ENDPOINTS`.
+    negative_ttl (:obj:`float`, optional): The number of seconds negative
+      entries are kept for, or :obj:`None` to use :code:`ttl`.
+    soft_ttls (:obj:`dict`, optional): The number of seconds after which
+      entries are refreshed in the background, keyed by endpoint name.
+  """
+
+  def __init__(self, ttl=None, ttls=None, negative_ttl=None, soft_ttls=None):
+    self.ttl = ttl
+    self.ttls = dict(ttls or {})
+    self.negative_ttl = negative_ttl
+    self.soft_ttls = dict(soft_ttls or {})
+    self._refreshing = set()
+    self._refresh_lock = threading.Lock()
+    self._counters = collections.defaultdict(collections.Counter)
+    self._counters_lock = threading.Lock()
+
+  def _expires(self, endpoint, negative=False):
+    """ Returns when an entry of :code:`endpoint` cached now expires. """
+    ttl = self.ttls.get(endpoint, self.ttl)
+    if negative and self.negative_ttl is not None:
+      ttl = self.negative_ttl if ttl is None else min(ttl, self.negative_ttl)
+    return time.time() + ttl if ttl is not None else None
+
+  def _stale_at(self, endpoint):
+    """ Returns when an entry of :code:`endpoint` cached now becomes stale. """
+    soft_ttl = self.soft_ttls.get(endpoint)
+    return time.time() + soft_ttl if soft_ttl is not None else None
+
+  def _count(self, endpoint, event, n=1):
+    """ Counts :code:`n` occurrences of :code:`event`, one of :code:`'hits'`,
+    :code:`'misses'`, :code:`'evictions'` or :code:`'expirations'`.
+    """
+    with self._counters_lock:
+      self._counters[endpoint][event] += n
+
+  def key(self, req_url, req_json, post):
+    """ Returns the cache key of a request and the name of its endpoint. """
+    return _key(req_url, req_json, post)
+
+  def tags(self, req_url, req_json, post):
+    """ Returns the dcids and stat vars of a request to tag its entry with. """
+    return _request_tags(req_url, req_json, post)
+
+  def get(self, key, endpoint):
+    """ Returns the value cached for :code:`key`, or :obj:`None`. """
+    raise NotImplementedError
+
+  def lookup(self, key, endpoint):
+    """ Returns the value cached for :code:`key`, or :obj:`None`, and whether
+    it is past its soft time to live.
+    """
+    return self.get(key, endpoint), False
+
+  def extend(self, key, endpoint):
+    """ Keeps the entry of :code:`key` for another time to live. """
+    pass
+
+  def revalidate(self, key, endpoint, load, tags=()):
+    """ Refreshes the entry of :code:`key` in the background.
+
+    At most one refresh per key runs at a time; further calls while it runs
+    are ignored.
+
+    Args:
+      load (:obj:`func`): A function returning the fresh value, or raising
+        :obj:`ValueError` if it cannot be fetched.
+      tags (:obj:`list` of :obj:`str`): The tags of the refreshed entry.
+
+    Returns:
+      The started :obj:`threading.Thread`, or :obj:`None` if a refresh of
+      :code:`key` is already running.
+    """
+    with self._refresh_lock:
+      if key in self._refreshing:
+        return None
+      self._refreshing.add(key)
+
+    def refresh():
+      try:
+        value = load()
+      except Exception:
+        self.extend(key, endpoint)
+      else:
+        self.set(key, value, endpoint, tags=tags)
+      finally:
+        with self._refresh_lock:
+          self._refreshing.discard(key)
+
+    thread = threading.Thread(target=refresh)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+  def set(self, key, value, endpoint, negative=False, tags=()):
+    """ Caches :code:`value` for :code:`key`, as a negative entry if
+    :code:`negative` is set, and tagged with the strings in :code:`tags`.
+    """
+    raise NotImplementedError
+
+  def invalidate(self, endpoint=None, dcid=None, stat_var=None):
+    """ Removes the entries matching all of the given arguments.
+
+    Args:
+      endpoint (:obj:`str`, optional): The name of the endpoint of the entries
+        as in :code:`_API_ENDPOINTS`. Entries derived from its responses, see
+        :code:`_DERIVED_ENDPOINTS`, are removed too.
+      dcid (:obj:`str`, optional): A dcid the entries are tagged with.
+      stat_var (:obj:`str`, optional): A stat var the entries are tagged with.
+
+    Returns:
+      The number of entries removed.
+
+    Examples:
+      Purge everything cached about a stat var after a bad import.
+
+      >>> cache.invalidate(stat_var='Count_Person')
+      42
+    """
+    raise NotImplementedError
+
+  def clear(self):
+    """ Removes all entries. """
+    raise NotImplementedError
+
+  def stats(self):
+    """ Returns statistics of the cache.
+
+    Returns:
+      A :obj:`dict` with the total number of :code:`entries` and their
+      :code:`bytes`, the number of entries per age in :code:`ages`, keyed by
+      the upper bound of their age as in :code:`_AGE_BUCKETS`, and per
+      endpoint in :code:`endpoints` a :obj:`dict` of the number of
+      :code:`entries` and :code:`bytes` resident and of the :code:`hits`,
+      :code:`misses`, :code:`evictions` and :code:`expirations` counted by
+      this process.
+    """
+    raise NotImplementedError
+
+  def _stats(self, sizes, ages):
+    """ Returns :obj:`Cache.stats` given the :code:`(entries, bytes)` per
+    endpoint and the number of entries per age bucket.
+    """
+    endpoints = collections.defaultdict(dict)
+    with self._counters_lock:
+      for endpoint, counter in self._counters.items():
+        for event in _EVENTS:
+          endpoints[endpoint][event] = counter[event]
+    for endpoint, (entries, num_bytes) in sizes.items():
+      endpoints[endpoint].update(entries=entries, bytes=num_bytes)
+    for counts in endpoints.values():
+      for name in ('entries', 'bytes') + _EVENTS:
+        counts.setdefault(name, 0)
+    return {
+      'entries': sum(entries for entries, _ in sizes.values()),
+      'bytes': sum(num_bytes for _, num_bytes in sizes.values()),
+      'ages': ages,
+      'endpoints': dict(endpoints),
+    }
+
+
+class _MemoryEntry(object):
+  """ An entry of a :obj:`MemoryCache`. """
+
+  __slots__ = ('value', 'endpoint', 'expires', 'stale_at', 'created', 'tags')
+
+  def __init__(self, value, endpoint, expires, stale_at, tags):
+    self.value = value
+    self.endpoint = endpoint
+    self.expires = expires
+    self.stale_at = stale_at
+    self.created = time.time()
+    self.tags = frozenset(tags)
+
+
+class MemoryCache(Cache):
+  """ An in-process least recently used cache of responses.
+
+  Args:
+    max_entries (:obj:`int`, optional): The maximum number of entries kept.
+    max_bytes (:obj:`int`, optional): The maximum total size of the values
+      kept, in bytes.
+    ttl (:obj:`float`, optional): The default time to live, see :obj:`Cache`.
+    ttls (:obj:`dict`, optional): Per endpoint times to live.
+    negative_ttl (:obj:`float`, optional): The time to live of negative
+      entries.
+    soft_ttls (:obj:`dict`, optional): Per endpoint soft times to live.
+
+  Examples:
+    Serve dashboards from memory, refreshing series older than ten minutes in
+    the background, and refetching them in the foreground after a day.
+
+    >>> set_cache(MemoryCache(ttl=24 * 3600, soft_ttls={
+    ...   'get_stat_all': 600, 'get_stat_series': 600}))
+  """
+
+  def __init__(self, max_entries=1024, max_bytes=64 * 2**20, ttl=None,
+               ttls=None, negative_ttl=600, soft_ttls=None):
+    super(MemoryCache, self).__init__(ttl, ttls, negative_ttl, soft_ttls)
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, endpoint):
+    return self.lookup(key, endpoint)[0]
+
+  def lookup(self, key, endpoint):
+    now = time.time()
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is not None and entry.expires is not None and (
+          entry.expires <= now):
+        self.bytes -= len(entry.value)
+        self._count(endpoint, 'expirations')
+        entry = None
+      if entry is None:
+        self._count(endpoint, 'misses')
+        return None, False
+      # Re-insert the entry as the most recently used.
+      self._entries[key] = entry
+      self._count(endpoint, 'hits')
+      return entry.value, entry.stale_at is not None and entry.stale_at <= now
+
+  def extend(self, key, endpoint):
+    expires = self._expires(endpoint)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        entry.expires = expires
+
+  def set(self, key, value, endpoint, negative=False, tags=()):
+    if len(value) > self.max_bytes:
+      return
+    entry = _MemoryEntry(value, endpoint, self._expires(endpoint, negative),
+                         self._stale_at(endpoint), tags)
+    with self._lock:
+      old = self._entries.pop(key, None)
+      if old is not None:
+        self.bytes -= len(old.value)
+      self._entries[key] = entry
+      self.bytes += len(value)
+      while (len(self._entries) > self.max_entries or
+             self.bytes > self.max_bytes):
+        _, evicted = self._entries.popitem(last=False)
+        self.bytes -= len(evicted.value)
+        self._count(evicted.endpoint, 'evictions')
+
+  def invalidate(self, endpoint=None, dcid=None, stat_var=None):
+    tags = set(tag for tag in (dcid, stat_var) if tag is not None)
+    endpoints = _with_derived(endpoint)
+    with self._lock:
+      keys = [key for key, entry in self._entries.items()
+              if (endpoint is None or entry.endpoint in endpoints) and
+              tags <= entry.tags]
+      for key in keys:
+        self.bytes -= len(self._entries.pop(key).value)
+    return len(keys)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.bytes = 0
+
+  def stats(self):
+    now = time.time()
+    sizes = collections.defaultdict(lambda: (0, 0))
+    ages = _age_histogram()
+    with self._lock:
+      for entry in self._entries.values():
+        entries, num_bytes = sizes[entry.endpoint]
+        sizes[entry.endpoint] = (entries + 1, num_bytes + len(entry.value))
+        ages[_age_bucket(now - entry.created)] += 1
+    return self._stats(sizes, ages)
+
+
+class DiskCache(Cache):
+  """ A least recently used cache of responses stored in a SQLite file.
+
+  The cache may be shared by several processes, which read it concurrently
+  and serialize their writes.
+
+  Values are stored compressed with zstd if the :code:`zstandard` package is
+  installed, using a dictionary trained on the first values stored, since
+  responses repeat the same keys, facets and dates. Otherwise they are
+  compressed with zlib. Values of at least :code:`mmap_bytes` are instead
+  stored uncompressed in files next to the cache and read through memory
+  maps, so that processes reading them share the page cache. They are
+  returned as read-only :obj:`mmap.mmap` objects rather than :obj:`bytes`.
+
+  Args:
+    path (:obj:`str`): The path of the cache file. It is created if it does
+      not exist.
+    max_bytes (:obj:`int`, optional): The maximum total size of the stored,
+      compressed values, in bytes.
+    ttl (:obj:`float`, optional): The default time to live, see :obj:`Cache`.
+    ttls (:obj:`dict`, optional): Per endpoint times to live.
+    negative_ttl (:obj:`float`, optional): The time to live of negative
+      entries.
+    soft_ttls (:obj:`dict`, optional): Per endpoint soft times to live.
+    compression (:obj:`str`, optional): :code:`'zstd'`, :code:`'zlib'`, or
+      :code:`'auto'` to use zstd if available.
+    mmap_bytes (:obj:`int`, optional): The size from which values are stored
+      in memory mapped files, or :obj:`None` to store all values in the
+      cache file.
+
+  Raises:
+    ValueError: If zstd compression is requested but :code:`zstandard` is not
+      installed.
+
+  Examples:
+    Keep up to 1GB of responses on disk for a week.
+
+    >>> set_cache(DiskCache('/tmp/datacommons.db', max_bytes=2**30,
+    ...                     ttl=7 * 24 * 3600))
+  """
+
+  def __init__(self, path, max_bytes=2**30, ttl=None, ttls=None,
+               negative_ttl=3600, soft_ttls=None, compression='auto',
+               mmap_bytes=2**23):
+    super(DiskCache, self).__init__(ttl, ttls, negative_ttl, soft_ttls)
+    if compression == 'auto':
+      compression = 'zstd' if zstandard is not None else 'zlib'
+    if compression not in ('zstd', 'zlib'):
+      raise ValueError('Unknown compression {}.'.format(compression))
+    if compression == 'zstd' and zstandard is None:
+      raise ValueError('zstd compression requires the zstandard package.')
+    self.path = path
+    self.max_bytes = max_bytes
+    self.compression = compression
+    self.mmap_bytes = mmap_bytes
+    self._files = path + '.files'
+    self._zstd_dict = None
+    self._zstd_samples = []
+    self._zstd_sample_bytes = 0
+    self._codec_lock = threading.Lock()
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(
+      path, timeout=_DISK_TIMEOUT, isolation_level=None,
+      check_same_thread=False)
+    with self._lock:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute('PRAGMA synchronous=NORMAL')
+      with self._write():
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != _DISK_SCHEMA_VERSION:
+          # Caches written by other versions are discarded.
+          for table in ('entries', 'tags', 'meta'):
+            self._conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+          self._conn.execute(
+            'PRAGMA user_version = {}'.format(_DISK_SCHEMA_VERSION))
+        self._conn.execute(
+          'CREATE TABLE IF NOT EXISTS entries ('
+          '  key BLOB PRIMARY KEY,'
+          '  endpoint TEXT NOT NULL,'
+          '  value BLOB NOT NULL,'
+          '  size INTEGER NOT NULL,'
+          '  expires REAL,'
+          '  accessed REAL NOT NULL,'
+          '  stale REAL,'
+          '  created REAL NOT NULL,'
+          '  codec TEXT NOT NULL)')
+        self._conn.execute(
+          'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self._conn.execute(
+          'CREATE TABLE IF NOT EXISTS tags ('
+          '  tag TEXT NOT NULL,'
+          '  key BLOB NOT NULL,'
+          '  PRIMARY KEY (tag, key))')
+        self._conn.execute(
+          'CREATE INDEX IF NOT EXISTS tags_key ON tags (key)')
+        self._conn.execute(
+          'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)')
+        self._conn.execute(
+          "INSERT OR IGNORE INTO meta VALUES ('bytes', 0)")
+
+  def __len__(self):
+    with self._lock:
+      return self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+  @property
+  def bytes(self):
+    """ The total size of the stored values, in bytes. """
+    with self._lock:
+      return self._conn.execute(
+        "SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+  def close(self):
+    """ Closes the cache file. """
+    with self._lock:
+      self._conn.close()
+
+  def get(self, key, endpoint):
+    return self.lookup(key, endpoint)[0]
+
+  def lookup(self, key, endpoint):
+    now = time.time()
+    with self._lock:
+      row = self._conn.execute(
+        'SELECT value, expires, accessed, stale, codec FROM entries '
+        'WHERE key = ?', (sqlite3.Binary(key),)).fetchone()
+      if row is None:
+        self._count(endpoint, 'misses')
+        return None, False
+      value, expires, accessed, stale_at, codec = row
+      if expires is not None and expires <= now:
+        with self._write():
+          self._delete(key)
+        self._count(endpoint, 'expirations')
+        self._count(endpoint, 'misses')
+        return None, False
+      # Only record accesses coarsely to avoid a write on every hit.
+      if now - accessed > _ACCESS_RESOLUTION:
+        with self._write():
+          self._conn.execute('UPDATE entries SET accessed = ? WHERE key = ?',
+                             (now, sqlite3.Binary(key)))
+    try:
+      value = self._decode(key, codec, bytes(value))
+    except (EnvironmentError, ValueError, zlib.error):
+      # E.g. zstd entries read without zstandard, or files deleted by another
+      # process.
+      self._count(endpoint, 'misses')
+      return None, False
+    self._count(endpoint, 'hits')
+    return value, stale_at is not None and stale_at <= now
+
+  def extend(self, key, endpoint):
+    with self._lock:
+      with self._write():
+        self._conn.execute('UPDATE entries SET expires = ? WHERE key = ?',
+                           (self._expires(endpoint), sqlite3.Binary(key)))
+
+  def set(self, key, value, endpoint, negative=False, tags=()):
+    if isinstance(value, six.text_type):
+      value = value.encode('utf-8')
+    if self.mmap_bytes is not None and len(value) >= self.mmap_bytes:
+      if len(value) > self.max_bytes:
+        return
+      codec, size = 'file', len(value)
+      self._write_file(key, value)
+      value = b''
+    else:
+      codec, value = self._encode(value)
+      size = len(value)
+      if size > self.max_bytes:
+        return
+    now = time.time()
+    with self._lock:
+      with self._write():
+        self._delete(key, keep_file=codec == 'file')
+        self._conn.execute(
+          'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+          (sqlite3.Binary(key), endpoint, sqlite3.Binary(value), size,
+           self._expires(endpoint, negative), now, self._stale_at(endpoint),
+           now, codec))
+        self._conn.executemany(
+          'INSERT OR IGNORE INTO tags VALUES (?, ?)',
+          [(tag, sqlite3.Binary(key)) for tag in tags])
+        total = self._add_bytes(size)
+        self._evict(total)
+
+  def invalidate(self, endpoint=None, dcid=None, stat_var=None):
+    query = 'SELECT key FROM entries WHERE 1'
+    args = []
+    if endpoint is not None:
+      endpoints = _with_derived(endpoint)
+      query += ' AND endpoint IN ({})'.format(', '.join('?' * len(endpoints)))
+      args.extend(endpoints)
+    for tag in (dcid, stat_var):
+      if tag is not None:
+        query += ' AND key IN (SELECT key FROM tags WHERE tag = ?)'
+        args.append(tag)
+    with self._lock:
+      with self._write():
+        keys = [bytes(key) for (key,) in self._conn.execute(query, args)]
+        for key in keys:
+          self._delete(key)
+    return len(keys)
+
+  def clear(self):
+    with self._lock:
+      with self._write():
+        self._conn.execute('DELETE FROM entries')
+        self._conn.execute('DELETE FROM tags')
+        self._conn.execute("UPDATE meta SET value = 0 WHERE name = 'bytes'")
+        shutil.rmtree(self._files, ignore_errors=True)
+
+  def stats(self):
+    now = time.time()
+    ages = _age_histogram()
+    with self._lock:
+      sizes = dict(
+        (endpoint, (entries, num_bytes)) for endpoint, entries, num_bytes in
+        self._conn.execute(
+          'SELECT endpoint, COUNT(*), SUM(size) FROM entries '
+          'GROUP BY endpoint'))
+      younger = 0
+      for max_age, bucket in _AGE_BUCKETS:
+        count = self._conn.execute(
+          'SELECT COUNT(*) FROM entries WHERE created > ?',
+          (now - max_age,)).fetchone()[0]
+        ages[bucket] = count - younger
+        younger = count
+      ages[_OLDEST_BUCKET] = sum(
+        entries for entries, _ in sizes.values()) - younger
+    return self._stats(sizes, ages)
+
+  @contextlib.contextmanager
+  def _write(self):
+    """ Runs the enclosed statements in one write transaction. """
+    self._conn.execute('BEGIN IMMEDIATE')
+    try:
+      yield
+    except Exception:
+      self._conn.execute('ROLLBACK')
+      raise
+    self._conn.execute('COMMIT')
+
+  def _delete(self, key, keep_file=False):
+    row = self._conn.execute('SELECT size, codec FROM entries WHERE key = ?',
+                             (sqlite3.Binary(key),)).fetchone()
+    if row is not None:
+      self._conn.execute('DELETE FROM entries WHERE key = ?',
+                         (sqlite3.Binary(key),))
+      self._conn.execute('DELETE FROM tags WHERE key = ?',
+                         (sqlite3.Binary(key),))
+      self._add_bytes(-row[0])
+      if row[1] == 'file' and not keep_file:
+        try:
+          os.remove(self._file(key))
+        except EnvironmentError:
+          pass
+
+  def _encode(self, value):
+    """ Returns the codec and compressed form of a value. """
+    if self.compression == 'zlib':
+      return 'zlib', zlib.compress(value)
+    zstd_dict = self._load_zstd_dict()
+    if zstd_dict is None:
+      self._sample(value)
+      zstd_dict = self._zstd_dict
+    if zstd_dict is None:
+      compressor = zstandard.ZstdCompressor(level=_ZSTD_LEVEL)
+      return 'zstd', compressor.compress(value)
+    compressor = zstandard.ZstdCompressor(level=_ZSTD_LEVEL,
+                                          dict_data=zstd_dict)
+    return 'zstd-dict', compressor.compress(value)
+
+  def _decode(self, key, codec, value):
+    """ Returns the original form of a stored value. """
+    if codec == 'zlib':
+      return zlib.decompress(value)
+    if codec == 'file':
+      with open(self._file(key), 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if codec not in ('zstd', 'zstd-dict'):
+      raise ValueError('Unknown codec {}.'.format(codec))
+    if zstandard is None:
+      raise ValueError('Reading zstd entries requires zstandard.')
+    zstd_dict = self._load_zstd_dict() if codec == 'zstd-dict' else None
+    if codec == 'zstd-dict' and zstd_dict is None:
+      raise ValueError('The zstd dictionary is missing.')
+    try:
+      decompressor = zstandard.ZstdDecompressor(dict_data=zstd_dict)
+      return decompressor.decompress(value)
+    except zstandard.ZstdError as e:
+      raise ValueError(str(e))
+
+  def _sample(self, value):
+    """ Collects values to train the zstd dictionary on, and trains it once
+    enough are collected. At most :code:`_ZSTD_DICT_SAMPLE_BYTES` are held,
+    so the last sample may be truncated.
+    """
+    with self._codec_lock:
+      if self._zstd_dict is not None:
+        return
+      sample = value[:_ZSTD_DICT_SAMPLE_BYTES - self._zstd_sample_bytes]
+      self._zstd_samples.append(sample)
+      self._zstd_sample_bytes += len(sample)
+      if (len(self._zstd_samples) < _ZSTD_DICT_SAMPLES and
+          self._zstd_sample_bytes < _ZSTD_DICT_SAMPLE_BYTES):
+        return
+      samples, self._zstd_samples = self._zstd_samples, []
+      self._zstd_sample_bytes = 0
+      try:
+        trained = zstandard.train_dictionary(_ZSTD_DICT_SIZE, samples)
+      except zstandard.ZstdError:
+        return
+    # Keep the dictionary of another process if it trained one first.
+    with self._lock:
+      with self._write():
+        self._conn.execute(
+          "INSERT OR IGNORE INTO meta VALUES ('zstd_dict', ?)",
+          (sqlite3.Binary(trained.as_bytes()),))
+    self._load_zstd_dict()
+
+  def _load_zstd_dict(self):
+    """ Returns the zstd dictionary of the cache, or :obj:`None`. """
+    if self._zstd_dict is None:
+      with self._lock:
+        row = self._conn.execute(
+          "SELECT value FROM meta WHERE name = 'zstd_dict'").fetchone()
+      if row is not None:
+        self._zstd_dict = zstandard.ZstdCompressionDict(bytes(row[0]))
+    return self._zstd_dict
+
+  def _file(self, key):
+    return os.path.join(self._files, hashlib.sha1(key).hexdigest())
+
+  def _write_file(self, key, value):
+    """ Atomically writes the file of a large value. """
+    if not os.path.isdir(self._files):
+      try:
+        os.makedirs(self._files)
+      except EnvironmentError:
+        if not os.path.isdir(self._files):
+          raise
+    fd, tmp = tempfile.mkstemp(dir=self._files)
+    with os.fdopen(fd, 'wb') as f:
+      f.write(value)
+    os.rename(tmp, self._file(key))
+
+  def _add_bytes(self, delta):
+    self._conn.execute(
+      "UPDATE meta SET value = value + ? WHERE name = 'bytes'", (delta,))
+    return self._conn.execute(
+      "SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+  def _evict(self, total):
+    """ Deletes expired, then least recently used entries above the cap. """
+    if total <= self.max_bytes:
+      return
+    expired = self._conn.execute(
+      'SELECT key, endpoint FROM entries WHERE expires <= ?',
+      (time.time(),)).fetchall()
+    for key, endpoint in expired:
+      self._delete(bytes(key))
+      self._count(endpoint, 'expirations')
+    total = self._add_bytes(0)
+    rows = self._conn.execute(
+      'SELECT key, endpoint, size FROM entries ORDER BY accessed')
+    victims = []
+    for key, endpoint, size in rows:
+      if total <= self.max_bytes:
+        break
+      victims.append((bytes(key), endpoint))
+      total -= size
+    for key, endpoint in victims:
+      self._delete(key)
+      self._count(endpoint, 'evictions')
+
+
+class _DcidStore(object):
+  """ Stores the per dcid results of a batched call in a :obj:`Cache`.
+
+  This has the same interface as :obj:`datacommons.journal.Journal` so that
+  batched calls can treat both alike. Entries are tagged with their dcid, their
+  key if it is a stat var, and the stat vars in :code:`params`.
+  """
+
+  def __init__(self, cache, endpoint, params=None):
+    self.cache = cache
+    self.endpoint = endpoint
+    self.tags = _tags(params or {})
+
+  def lookup(self, call, key, dcids):
+    """ Returns the cached values of :code:`dcids` for :code:`(call, key)`.
+
+    Dcids with a negative entry are mapped to their empty value, or to
+    :obj:`None` if the server returned no value at all.
+    """
+    found = {}
+    negative = []
+    for dcid in dcids:
+      value = self.cache.get(_dcid_key(call, key, dcid), self.endpoint)
+      if value is not None:
+        found[dcid] = value = json.loads(utils._mapped_text(value))
+        if _is_empty(value):
+          negative.append(dcid)
+    if negative:
+      with _negative_hits_lock:
+        _negative_hits[self.endpoint].update(negative)
+    return found
+
+  def record(self, call, key, dcids, payload):
+    """ Caches the values of :code:`dcids` in :code:`payload`.
+
+    Dcids with no or an empty value are cached as negative entries.
+    """
+    tags = self.tags | _tags({'stat_var': key})
+    for dcid in dcids:
+      value = payload.get(dcid)
+      self.cache.set(_dcid_key(call, key, dcid),
+                     json.dumps(value).encode('utf-8'), self.endpoint,
+                     negative=_is_empty(value), tags=tags | set([dcid]))
+
+
+class _SeriesStore(object):
+  """ Stores the :code:`get_stats` time series of places in a :obj:`Cache`.
+
+  This has the interface of :obj:`datacommons.journal.Journal`, with stat vars
+  as keys, and finds series recorded by either :code:`get_stats` or
+  :code:`get_stat_series` for the same facet. Only series with a place name
+  are looked up, as :code:`get_stats` returns one.
+  """
+
+  def __init__(self, cache, facet):
+    self.cache = cache
+    self.facet = facet
+
+  def lookup(self, call, key, dcids):
+    """ Returns the stats of the places in :code:`dcids` with a cached series
+    of stat var :code:`key`.
+    """
+    found = {}
+    for dcid in dcids:
+      stats = _lookup_series(dcid, key, self.facet, self.cache)
+      if stats is not None and 'place_name' in stats:
+        found[dcid] = stats
+    return found
+
+  def record(self, call, key, dcids, payload):
+    """ Caches the series of stat var :code:`key` in :code:`payload`. """
+    for dcid in dcids:
+      stats = payload.get(dcid)
+      if stats and stats.get('data'):
+        _record_series(dcid, key, self.facet, stats['data'],
+                       stats.get('place_name'), self.cache)
+
+
+def _series_store(facet):
+  """ Returns a :obj:`_SeriesStore` if per dcid caching is enabled. """
+  if _dcid_cache is None:
+    return None
+  return _SeriesStore(_dcid_cache, facet)
+
+
+def _facet(measurement_method=None, observation_period=None, unit=None,
+           scaling_factor=None):
+  """ Returns the facet identifying a time series apart from place and stat
+  var.
+  """
+  facet = {
+    'measurement_method': measurement_method,
+    'observation_period': observation_period,
+    'unit': unit,
+    'scaling_factor': scaling_factor,
+  }
+  return dict((k, v) for k, v in facet.items() if v)
+
+
+def _series_key(place, stat_var, facet):
+  blob = json.dumps(['series', place, stat_var, facet], sort_keys=True)
+  return hashlib.sha1(blob.encode('utf-8')).hexdigest().encode('ascii')
+
+
+def _lookup_series(place, stat_var, facet, cache=None):
+  """ Returns the cached stats of a series as :code:`{'data': series}`, with
+  a :code:`'place_name'` if known, or :obj:`None`.
+  """
+  if cache is None:
+    cache = utils._response_cache
+  if cache is None:
+    return None
+  value = cache.get(_series_key(place, stat_var, facet), 'get_stat_series')
+  if value is None:
+    return None
+  return json.loads(utils._mapped_text(value))
+
+
+def _record_series(place, stat_var, facet, series, place_name=None,
+                   cache=None):
+  """ Caches the full time series of a place and stat var. """
+  if cache is None:
+    cache = utils._response_cache
+  if cache is None or not series:
+    return
+  stats = {'data': series}
+  if place_name is None:
+    # Keep the name recorded by get_stats when get_stat_series refreshes it.
+    old = _lookup_series(place, stat_var, facet, cache)
+    if old is not None and 'place_name' in old:
+      place_name = old['place_name']
+  if place_name is not None:
+    stats['place_name'] = place_name
+  cache.set(_series_key(place, stat_var, facet),
+            json.dumps(stats).encode('utf-8'), 'get_stat_series',
+            tags=[place, stat_var])
+
+
+def _merge_series(place, stat_var, facet, stats):
+  """ Merges the observations of :code:`stats` newer than the latest cached
+  date into the cached series of a place and stat var.
+
+  Returns:
+    A :obj:`dict` mapping the dates of the merged observations to their
+    values. If no series was cached, every observation is merged.
+  """
+  series = stats.get('data') if stats else None
+  if not series:
+    return {}
+  old = _lookup_series(place, stat_var, facet) or {}
+  merged = old.get('data', {})
+  last = max(merged) if merged else None
+  new = dict((date, value) for date, value in series.items()
+             if last is None or date > last)
+  if new:
+    merged.update(new)
+    _record_series(place, stat_var, facet, merged,
+                   stats.get('place_name', old.get('place_name')))
+  return new
+
+
+def _stat_value(place, stat_var, facet, date=None):
+  """ Returns the value of a cached series at :code:`date`, or its latest
+  value, or :obj:`None` if it is not cached.
+  """
+  stats = _lookup_series(place, stat_var, facet)
+  if stats is None:
+    return None
+  series = stats['data']
+  if date is None:
+    return series[max(series)]
+  return series.get(date)
+
+
+def _dcid_store(endpoint, params=None):
+  """ Returns the per dcid store for :code:`endpoint` if enabled. """
+  if _dcid_cache is None:
+    return None
+  return _DcidStore(_dcid_cache, endpoint, params)
+
+
+def _is_empty(value):
+  """ Returns whether a per dcid value holds no data. """
+  if isinstance(value, dict):
+    return not any(value.values())
+  return not value
+
+
+def _dcid_key(call, key, dcid):
+  blob = json.dumps([call, key, dcid])
+  return hashlib.sha1(blob.encode('utf-8')).hexdigest().encode('ascii')
+
+
+def _canonical(value):
+  """ Returns :code:`value` with the order of unordered lists removed. """
+  if isinstance(value, dict):
+    return dict(
+      (k, _sorted(v) if k in _UNORDERED_FIELDS and isinstance(v, list)
+       else _canonical(v))
+      for k, v in value.items())
+  if isinstance(value, list):
+    return [_canonical(v) for v in value]
+  return value
+
+
+def _sorted(values):
+  return sorted(values, key=lambda v: json.dumps(v, sort_keys=True))
+
+
+def _key(req_url, req_json, post):
+  """ Returns the cache key of a request and the name of its endpoint. """
+  url = six.moves.urllib.parse.urlsplit(req_url)
+  query = sorted(six.moves.urllib.parse.parse_qsl(url.query))
+  blob = json.dumps(
+    [url.netloc, url.path, query, _canonical(req_json) if post else None],
+    sort_keys=True)
+  key = hashlib.sha1(blob.encode('utf-8')).hexdigest().encode('ascii')
+  return key, _endpoint_name(url.path)
+
+
+def _request_tags(req_url, req_json, post):
+  """ Returns the dcids and stat vars of a request. """
+  url = six.moves.urllib.parse.urlsplit(req_url)
+  tags = _tags(dict(six.moves.urllib.parse.parse_qsl(url.query)))
+  if post and isinstance(req_json, dict):
+    tags |= _tags(req_json)
+  return tags
+
+
+def _tags(fields):
+  """ Returns the strings in the tag fields of a request :obj:`dict`. """
+  tags = set()
+  for field in _TAG_FIELDS:
+    value = fields.get(field)
+    if isinstance(value, six.string_types):
+      tags.add(value)
+    elif isinstance(value, list):
+      tags.update(v for v in value if isinstance(v, six.string_types))
+  return tags
+
+
+def _with_derived(endpoint):
+  """ Returns :code:`endpoint` and the endpoints of entries derived from it.
+  """
+  return (endpoint,) + _DERIVED_ENDPOINTS.get(endpoint, ())
+
+
+def _age_histogram():
+  return collections.OrderedDict(
+    [(bucket, 0) for _, bucket in _AGE_BUCKETS] + [(_OLDEST_BUCKET, 0)])
+
+
+def _age_bucket(age):
+  """ Returns the bucket of the age distribution an age in seconds falls in.
+  """
+  for max_age, bucket in _AGE_BUCKETS:
+    if age < max_age:
+      return bucket
+  return _OLDEST_BUCKET
+
+
+def _endpoint_name(path):
+  """ Returns the name in :code:`_API_ENDPOINTS` of an endpoint path. """
+  for name, endpoint_path in utils._API_ENDPOINTS.items():
+    if endpoint_path == path:
+      return name
+  return path
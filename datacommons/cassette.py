@@ -0,0 +1,169 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Cassette Module.
+
+Records the responses of the REST API to a cassette file and replays them,
+for reproducible runs without network access. Cassettes sit below the
+response cache, at the point where requests are sent over the network.
+
+Requests are matched on their endpoint and a canonical form of their
+arguments, in which the order of dcids does not matter. The API key is not
+part of the match, and is not stored in the cassette.
+
+The cassette file holds one gzip compressed JSON line per distinct request.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import gzip
+import io
+import json
+import threading
+
+import six
+import six.moves.urllib.parse
+
+import datacommons.cache as cache_lib
+import datacommons.utils as utils
+
+# The modes a cassette can be used in.
+_MODES = ('record', 'replay')
+
+
+class Cassette(object):
+  """ Recorded responses of the REST API.
+
+  Args:
+    path (:obj:`str`): The path of the cassette file.
+    mode (:obj:`str`, optional): :code:`'record'` to send every request and
+      record its response, or :code:`'replay'` to answer requests with the
+      recorded responses.
+    strict (:obj:`bool`, optional): Whether requests without a recorded
+      response raise a :obj:`ValueError` when replaying rather than being
+      sent over the network.
+
+  Raises:
+    ValueError: If :code:`mode` is not a valid mode.
+  """
+
+  def __init__(self, path, mode='replay', strict=False):
+    if mode not in _MODES:
+      raise ValueError('Cassette mode must be one of {}.'.format(_MODES))
+    self.path = path
+    self.mode = mode
+    self.strict = strict
+    self._responses = {}
+    self._lock = threading.Lock()
+    if mode == 'replay':
+      self._load()
+
+  def __len__(self):
+    return len(self._responses)
+
+  def play(self, req_url, req_json, post):
+    """ Returns the recorded :code:`(status, body)` of a request, or
+    :obj:`None` if it should be sent over the network.
+
+    Raises:
+      ValueError: If the request was not recorded and the cassette is
+        strict.
+    """
+    if self.mode != 'replay':
+      return None
+    response = self._responses.get(_key(req_url, req_json, post))
+    if response is None and self.strict:
+      raise ValueError(
+        'No recorded response for request {} {}'.format(
+          req_url, json.dumps(req_json, sort_keys=True) if post else ''))
+    return response
+
+  def record(self, req_url, req_json, post, status, body):
+    """ Records the response to a request when recording. """
+    if self.mode != 'record':
+      return
+    if isinstance(body, six.text_type):
+      body = body.encode('utf-8')
+    with self._lock:
+      self._responses[_key(req_url, req_json, post)] = (status, body)
+
+  def save(self):
+    """ Writes the recorded responses to the cassette file. """
+    with self._lock:
+      responses = sorted(self._responses.items())
+    with gzip.open(self.path, 'wb') as f:
+      for key, (status, body) in responses:
+        line = json.dumps({
+          'key': key,
+          'status': status,
+          'body': body.decode('utf-8'),
+        }, sort_keys=True)
+        f.write(line.encode('utf-8') + b'\n')
+
+  def _load(self):
+    with gzip.open(self.path, 'rb') as f:
+      for line in io.TextIOWrapper(f, encoding='utf-8'):
+        entry = json.loads(line)
+        self._responses[entry['key']] = (
+          entry['status'], entry['body'].encode('utf-8'))
+
+
+def set_cassette(cassette):
+  """ Installs :code:`cassette` to record or replay requests, or removes the
+  installed one if :obj:`None`.
+  """
+  utils._cassette = cassette
+
+
+@contextlib.contextmanager
+def use_cassette(path, mode='replay', strict=False):
+  """ Records or replays the requests sent in the enclosed block.
+
+  Args:
+    path (:obj:`str`): The path of the cassette file.
+    mode (:obj:`str`, optional): :code:`'record'` or :code:`'replay'`, see
+      :obj:`Cassette`.
+    strict (:obj:`bool`, optional): Whether unrecorded requests fail when
+      replaying.
+
+  Examples:
+    Record a workload once, then replay it without network access.
+
+    >>> with use_cassette('/tmp/workload.jsonl.gz', mode='record'):
+    ...   run_workload()
+    >>> with use_cassette('/tmp/workload.jsonl.gz', strict=True):
+    ...   run_workload()
+  """
+  cassette = Cassette(path, mode, strict)
+  saved = utils._cassette
+  set_cassette(cassette)
+  try:
+    yield cassette
+  finally:
+    set_cassette(saved)
+    if mode == 'record':
+      cassette.save()
+
+
+def _key(req_url, req_json, post):
+  """ Returns the key a request is matched on, ignoring any API key. """
+  url = six.moves.urllib.parse.urlsplit(req_url)
+  query = [(k, v) for k, v in six.moves.urllib.parse.parse_qsl(url.query)
+           if k != 'key']
+  req_url = six.moves.urllib.parse.urlunsplit(
+    url._replace(query=six.moves.urllib.parse.urlencode(query)))
+  key, _ = cache_lib._key(req_url, req_json, post)
+  return key.decode('ascii')
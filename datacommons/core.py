@@ -20,6 +20,9 @@ following:
 - Getting all property labels
 - Getting all property values
 - Getting all triples
+
+The :code:`iter_` variants stream the values and triples of nodes with more of
+them than fit in a single response.
 """
 
 from __future__ import absolute_import
@@ -28,28 +31,42 @@ from __future__ import print_function
 
 from collections import defaultdict
 
+import datacommons.batch as batch
+import datacommons.graph as graph
 import datacommons.utils as utils
 
+try:
+  import pandas
+except ImportError:
+  pandas = None
+
 # ----------------------------- WRAPPER FUNCTIONS -----------------------------
 
 
-def get_property_labels(dcids, out=True):
+def get_property_labels(dcids, out=True, types=None, type_cache=None):
   """ Returns the labels of properties defined for the given :code:`dcids`.
 
   Args:
     dcids (:obj:`iterable` of :obj:`str`): A list of nodes identified by their
       dcids.
     out (:obj:`bool`, optional): Whether or not the property points away from
-      the given list of nodes.
+      the given list of nodes, or :obj:`None` for both directions.
+    types (:obj:`dict`, optional): A map from dcids to their type. Nodes of
+      the same type are assumed to have the same labels, which are fetched
+      for only one of them. Nodes missing from it are fetched as usual.
+    type_cache (:obj:`dict`, optional): A map from types to their labels,
+      filled and reused across calls given :code:`types`.
 
   Returns:
     A :obj:`dict` mapping dcids to lists of property labels. If `out` is `True`,
     then property labels correspond to edges directed away from given nodes.
-    Otherwise, they correspond to edges directed towards the given nodes.
+    Otherwise, they correspond to edges directed towards the given nodes. If
+    `out` is `None`, dcids are mapped to a :obj:`dict` with the lists of both
+    directions under :code:`'out'` and :code:`'in'`.
 
   Raises:
-    ValueError: If the payload returned by the Data Commons REST API is
-      malformed.
+    ValueError: If :code:`type_cache` is given without :code:`types`, or if
+      the payload returned by the Data Commons REST API is malformed.
 
   Examples:
     To get all outgoing property labels for
@@ -77,7 +94,8 @@ def get_property_labels(dcids, out=True):
       ]
     }
 
-    We can also get incoming property labels by setting `out=False`.
+    We can also get incoming property labels by setting `out=False`, or both
+    directions from a single request by setting `out=None`.
 
     >>> get_property_labels(['geoId/06', 'geoId/08'], out=False)
     {
@@ -98,16 +116,24 @@ def get_property_labels(dcids, out=True):
   # Generate the GetProperty query and send the request
   dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
   dcids = list(dcids)
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_property_labels']
-  payload = utils._send_request(url, req_json={'dcids': dcids})
+  if type_cache is not None and types is None:
+    raise ValueError('type_cache requires the types of the nodes.')
+  if types is not None:
+    payload = _get_labels_by_type(
+      dcids, types, type_cache if type_cache is not None else {})
+  else:
+    payload = batch._fetch_all('get_property_labels', dcids, {})
 
   # Return the results based on the orientation
   results = {}
   for dcid in dcids:
-    if out:
-      results[dcid] = payload[dcid]['outLabels']
+    if out is None:
+      results[dcid] = {'out': list(payload[dcid]['outLabels']),
+                       'in': list(payload[dcid]['inLabels'])}
+    elif out:
+      results[dcid] = list(payload[dcid]['outLabels'])
     else:
-      results[dcid] = payload[dcid]['inLabels']
+      results[dcid] = list(payload[dcid]['inLabels'])
   return results
 
 
@@ -115,7 +141,9 @@ def get_property_values(dcids,
                         prop,
                         out=True,
                         value_type=None,
-                        limit=utils._MAX_LIMIT):
+                        limit=utils._MAX_LIMIT,
+                        paginate=False,
+                        sort=True):
   """ Returns property values of given :code:`dcids` along the given property.
 
   Args:
@@ -126,7 +154,15 @@ def get_property_values(dcids,
     value_type (:obj:`str`, optional): A type to filter returned property values
       by.
     limit (:obj:`int`, optional): The maximum number of property values returned
-      aggregated over all given nodes.
+      aggregated over all given nodes of a batch. Nodes are sent in batches of
+      :code:`_QUERY_BATCH_SIZE`. If :code:`paginate` is set, this is instead
+      the maximum number of values returned per node, or :obj:`None` for all.
+    paginate (:obj:`bool`, optional): Whether to keep fetching the values of
+      nodes whose batch hit the limit until they are exhausted, rather than
+      return them truncated. See :any:`iter_property_values`.
+    sort (:obj:`bool`, optional): Whether to sort the values of each node.
+      Otherwise they are kept in the order returned by the REST API, which
+      avoids the sort for nodes with many values.
 
   Returns:
     Returned property values are formatted as a :obj:`dict` from a given dcid
@@ -155,13 +191,19 @@ def get_property_values(dcids,
   # Convert the dcids field and format the request to GetPropertyValue
   dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
   dcids = list(dcids)
+  if paginate:
+    paged_results = defaultdict(list)
+    for dcid, value in iter_property_values(dcids, prop, out, value_type,
+                                            limit=limit):
+      paged_results[dcid].append(value)
+    return {dcid: utils._unique(paged_results[dcid], sort) for dcid in dcids}
+
   if out:
     direction = 'out'
   else:
     direction = 'in'
 
   req_json = {
-    'dcids': dcids,
     'property': prop,
     'limit': limit,
     'direction': direction
@@ -169,12 +211,14 @@ def get_property_values(dcids,
   if value_type:
     req_json['value_type'] = value_type
 
-  # Send the request
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_property_values']
-  payload = utils._send_request(url, req_json=req_json)
+  # Send the request. Batches returning as many values as the limit may be
+  # truncated, so their values are not cached per dcid.
+  payload = batch._fetch_all(
+    'get_property_values', dcids, req_json,
+    cacheable=lambda payload: _is_complete(payload, direction, limit))
 
   # Create the result format for when dcids is provided as a list.
-  unique_results = defaultdict(set)
+  unique_results = defaultdict(list)
   for dcid in dcids:
     # Get the list of nodes based on the direction given.
     nodes = []
@@ -186,19 +230,148 @@ def get_property_values(dcids,
           nodes = payload[dcid]['in']
 
     # Add nodes to unique_results if it is not empty
-    for node in nodes:
-      if 'dcid' in node:
-        unique_results[dcid].add(node['dcid'])
-      elif 'value' in node:
-        unique_results[dcid].add(node['value'])
+    unique_results[dcid].extend(_node_values(nodes))
+
+  # Make sure each dcid is in the results dict, and deduplicate the values.
+  results = {dcid: utils._unique(unique_results[dcid], sort)
+             for dcid in dcids}
+
+  return results
+
+
+def iter_property_values(dcids, prop, out=True, value_type=None, limit=None):
+  """ Yields all property values of :code:`dcids` along the given property as
+  the pages holding them arrive.
+
+  The limit of a request to the REST API applies to the values of all its
+  nodes together, so nodes whose batch returns as many values as the limit
+  are fetched again until they are exhausted, see :obj:`_iter_pages`. Values
+  already yielded are not yielded again.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): dcids to get property values for.
+    prop (:obj:`str`): The property to get property values for.
+    out (:obj:`bool`, optional): A flag that indicates the property is directed
+      away from the given nodes when set to true.
+    value_type (:obj:`str`, optional): A type to filter returned property values
+      by.
+    limit (:obj:`int`, optional): The maximum number of values yielded per
+      node, all of them if :obj:`None`.
+
+  Yields:
+    :code:`(dcid, value)` tuples, in the order they are received.
+
+  Raises:
+    ValueError: If the payload returned by the Data Commons REST API is
+      malformed.
 
-  # Make sure each dcid is in the results dict, and convert all sets to lists.
-  results = {dcid: sorted(list(unique_results[dcid])) for dcid in dcids}
+  Examples:
+    We would like to stream all counties of the United States.
+
+    >>> for _, county in iter_property_values(
+    ...     ['country/USA'], 'containedInPlace', out=False,
+    ...     value_type='County'):
+    ...   store(county)
+  """
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+  direction = 'out' if out else 'in'
+  req_json = {'property': prop, 'direction': direction}
+  if value_type:
+    req_json['value_type'] = value_type
+  fetch = _values_page_fetcher(req_json, direction)
+
+  seen = defaultdict(set)
+  for dcid, values in _iter_pages(dcids, fetch, limit):
+    for value in values:
+      if value not in seen[dcid]:
+        seen[dcid].add(value)
+        yield dcid, value
+
+
+def get_properties(dcids, props, out=True, value_type=None,
+                   limit=utils._MAX_LIMIT, as_frame=False):
+  """ Returns the values of several properties of the given :code:`dcids`.
+
+  This is equivalent to calling :any:`get_property_values` for every property,
+  but the dcids are deduplicated and the batches of all properties are sent
+  concurrently in one planned call.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): dcids to get property values for.
+    props (:obj:`iterable` of :obj:`str`): The properties to get values for.
+    out (:obj:`bool`, optional): A flag that indicates the properties are
+      directed away from the given nodes when set to true.
+    value_type (:obj:`str`, optional): A type to filter returned property values
+      by.
+    limit (:obj:`int`, optional): The maximum number of values returned per
+      node and property, or :obj:`None` for all. Nodes with more values than
+      fit in one request are fetched again as in :any:`iter_property_values`.
+    as_frame (:obj:`bool`, optional): Whether to return a
+      :obj:`pandas.DataFrame` with a row per dcid and a column per property.
+
+  Returns:
+    A :obj:`dict` from each dcid to a :obj:`dict` from each property to a sorted
+    list of its values, or a :obj:`pandas.DataFrame` of these lists if
+    :code:`as_frame` is set.
+
+  Raises:
+    ValueError: If the payload returned by the Data Commons REST API is
+      malformed, or if :code:`as_frame` is set but pandas is not installed.
+
+  Examples:
+    We would like to get the disease and clinical significance of two genetic
+    variants.
+
+    >>> get_properties(['bio/rs13317', 'bio/rs7903146'],
+    ...                ['diseaseName', 'clinicalSignificance'])
+    {
+      "bio/rs13317": {
+        "diseaseName": ["Hypogonadotropic hypogonadism"],
+        "clinicalSignificance": ["ClinSigPathogenic"]
+      },
+      "bio/rs7903146": {
+        "diseaseName": ["Diabetes mellitus type 2"],
+        "clinicalSignificance": ["ClinSigRiskFactor"]
+      }
+    }
+  """
+  if as_frame and pandas is None:
+    raise ValueError('as_frame requires pandas to be installed.')
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+  unique = set()
+  dcids = [d for d in dcids if not (d in unique or unique.add(d))]
+  props = list(props)
+  direction = 'out' if out else 'in'
+  req_json = {'direction': direction}
+  if value_type:
+    req_json['value_type'] = value_type
 
+  def fetch(prop, batch_dcids):
+    # The values of every node of the batch are paged in up to the limit, so
+    # none are truncated.
+    fetch_page = _values_page_fetcher(dict(req_json, property=prop),
+                                      direction, prop, cached_per_dcid=True)
+    values = defaultdict(list)
+    for dcid, items in _iter_pages(batch_dcids, fetch_page, limit):
+      values[dcid].extend(items)
+    return dict(values)
+
+  # Every property is fetched as a key of the batched call.
+  results = dict((dcid, dict((prop, []) for prop in props)) for dcid in dcids)
+  for prop, _, payload, _ in batch._run(
+      'get_property_values', dcids, props, fetch,
+      params=dict(req_json, limit=limit)):
+    for dcid, values in payload.items():
+      if dcid in results and values:
+        results[dcid][prop] = sorted(set(values))
+
+  if as_frame:
+    return pandas.DataFrame([[results[dcid][prop] for prop in props]
+                             for dcid in dcids], index=dcids, columns=props)
   return results
 
 
-def get_triples(dcids, limit=utils._MAX_LIMIT):
+def get_triples(dcids, limit=utils._MAX_LIMIT, compact=False):
   """ Returns all triples associated with the given :code:`dcids`.
 
   A knowledge graph can be described as a collection of `triples` which are
@@ -210,6 +383,12 @@ def get_triples(dcids, limit=utils._MAX_LIMIT):
   Args:
     dcids (:obj:`iterable` of :obj:`str`): A list of dcids to get triples for.
     limit (:obj:`int`, optional): The maximum total number of triples to get.
+    compact (:obj:`bool`, optional): Whether to return the triples of each dcid
+      as a :obj:`datacommons.graph.TripleList`, which holds them as integer
+      ids into one table of strings shared by all dcids, rather than as a
+      :obj:`list` of tuples. This saves memory at a CPU cost: every string
+      is hashed into the table, so building large results takes about twice
+      as long as tuples.
 
   Returns:
     A :obj:`dict` mapping dcids to a :obj:`list` of triples `(s, p, o)` where
@@ -242,6 +421,8 @@ def get_triples(dcids, limit=utils._MAX_LIMIT):
   payload = utils._send_request(url, req_json={'dcids': dcids, 'limit': limit})
 
   # Create a map from dcid to list of triples.
+  if compact:
+    return _compact_triples(dcids, payload)
   results = defaultdict(list)
   for dcid in dcids:
     # Make sure each dcid is mapped to an empty list.
@@ -256,3 +437,212 @@ def get_triples(dcids, limit=utils._MAX_LIMIT):
         results[dcid].append(
           (t['subjectId'], t['predicate'], t['objectValue']))
   return dict(results)
+
+
+def iter_triples(dcids, limit=None):
+  """ Yields all triples associated with the given :code:`dcids` as the pages
+  holding them arrive.
+
+  This is a streaming variant of :any:`get_triples` for nodes with many
+  triples. The nodes are fetched in concurrent batches, and nodes whose batch
+  returns as many triples as the limit of a request are fetched again until
+  their triples are exhausted. Only a count of the triples yielded per node is
+  held in memory.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): A list of dcids to get triples for.
+    limit (:obj:`int`, optional): The maximum number of triples yielded per
+      node, all of them if :obj:`None`.
+
+  Yields:
+    Triples :code:`(s, p, o)` where either the subject or object is one of
+    :code:`dcids`. Triples linking two of :code:`dcids` are yielded for both.
+
+  Raises:
+    ValueError: If the payload returned by the Data Commons REST API is
+      malformed.
+
+  Examples:
+    We would like to export all triples of
+    `California <https://browser.datacommons.org/kg?dcid=geoId/06>`_.
+
+    >>> for s, p, o in iter_triples(["geoId/06"]):
+    ...   out.write('{}\t{}\t{}\n'.format(s, p, o))
+  """
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+
+  def fetch(batch_dcids, page_limit):
+    return batch._send('get_triples', None, batch_dcids,
+                       {'dcids': batch_dcids, 'limit': page_limit},
+                       cached_per_dcid=False)
+
+  for _, triples in _iter_pages(dcids, fetch, limit):
+    for t in triples:
+      if 'objectId' in t:
+        yield t['subjectId'], t['predicate'], t['objectId']
+      elif 'objectValue' in t:
+        yield t['subjectId'], t['predicate'], t['objectValue']
+
+
+# ------------------------- INTERNAL HELPER FUNCTIONS -------------------------
+
+
+def _compact_triples(dcids, payload):
+  """ Returns the triples of a get_triples payload as
+  :obj:`datacommons.graph.TripleList` objects sharing one string table.
+
+  Each column of the whole payload is interned at once rather than built as
+  tuples, then sliced into the triples of every dcid.
+  """
+  counts = []
+  rows = []
+  for dcid in dcids:
+    start = len(rows)
+    rows.extend(t for t in payload[dcid]
+                if 'objectId' in t or 'objectValue' in t)
+    counts.append(len(rows) - start)
+  triples = graph.TripleList()
+  triples._extend_columns(
+    [t['subjectId'] for t in rows], [t['predicate'] for t in rows],
+    [t['objectId'] if 'objectId' in t else t['objectValue'] for t in rows])
+  del rows
+
+  results = {}
+  start = 0
+  for dcid, count in zip(dcids, counts):
+    results[dcid] = triples[start:start + count]
+    start += count
+  return results
+
+
+def _get_labels_by_type(dcids, types, type_cache):
+  """ Returns the property labels payload of :code:`dcids`, fetching the
+  labels of one node per type not in :code:`type_cache` and sharing them with
+  the other nodes of that type.
+  """
+  todo = []
+  pending = set()
+  for dcid in dcids:
+    node_type = types.get(dcid)
+    if node_type is None:
+      todo.append(dcid)
+    elif node_type not in type_cache and node_type not in pending:
+      todo.append(dcid)
+      pending.add(node_type)
+  payload = batch._fetch_all('get_property_labels', todo, {}) if todo else {}
+  for dcid in todo:
+    if types.get(dcid) is not None:
+      type_cache[types[dcid]] = payload[dcid]
+
+  for dcid in dcids:
+    if types.get(dcid) is not None:
+      payload[dcid] = type_cache[types[dcid]]
+  return payload
+
+
+def _is_complete(payload, direction, limit):
+  """ Returns whether a property values payload has fewer values than the
+  limit of its request, so that none were truncated. Payloads of requests
+  without a limit are complete.
+  """
+  if limit is None:
+    return True
+  count = sum(len(values.get(direction, []))
+              for values in payload.values() if values)
+  return count < limit
+
+
+def _values_page_fetcher(req_json, direction, key=None, cached_per_dcid=False):
+  """ Returns a function fetching pages of property values for
+  :obj:`_iter_pages`, as lists of values by dcid.
+
+  Args:
+    req_json (:obj:`dict`): The get_property_values request without its
+      dcids and limit.
+    direction (:obj:`str`): :code:`'out'` or :code:`'in'`.
+    key: The key the requests are sent for, see :code:`batch._send`.
+    cached_per_dcid (:obj:`bool`): Whether the pages are fetched within
+      :code:`batch._run`, which caches their results per dcid, see
+      :code:`batch._send`.
+  """
+  def fetch(batch_dcids, page_limit):
+    payload = batch._send('get_property_values', key, batch_dcids,
+                          dict(req_json, dcids=batch_dcids, limit=page_limit),
+                          cached_per_dcid=cached_per_dcid)
+    return dict((dcid, list(_node_values((values or {}).get(direction, []))))
+                for dcid, values in payload.items())
+  return fetch
+
+
+def _node_values(nodes):
+  """ Yields the dcids or values of the nodes in a property values payload. """
+  for node in nodes:
+    if 'dcid' in node:
+      yield node['dcid']
+    elif 'value' in node:
+      yield node['value']
+
+
+def _iter_pages(dcids, fetch, limit=None):
+  """ Yields :code:`(dcid, items)` with the items of each node not yielded
+  before, fetching pages until every node is exhausted or has :code:`limit`
+  items.
+
+  The REST API has no offsets, and the limit of a request applies to the items
+  of all its nodes together. The first request for a batch thus asks for
+  :code:`_MAX_LIMIT` items per node, or :code:`limit` if set, up to
+  :code:`_MAX_PAGE_LIMIT`, so that nodes with few items are fetched in one
+  request. A batch returning as many items as the limit may be truncated. Its
+  nodes are fetched again in halves until each is on its own, and a single
+  node returning as many items as the limit is fetched again with double the
+  limit. The pages of a round are fetched concurrently.
+
+  Nodes fetched again are assumed to return their items in the same order, so
+  only a count of the items yielded per node is kept and the items before it
+  are skipped.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): The nodes to fetch items of.
+    fetch (:obj:`func`): Called as :code:`fetch(dcids, page_limit)` to fetch a
+      page, returning a :obj:`dict` from dcid to a :obj:`list` of items.
+    limit (:obj:`int`): The maximum number of items yielded per node, all of
+      them if :obj:`None`.
+  """
+  unique = set()
+  dcids = [d for d in dcids if not (d in unique or unique.add(d))]
+  counts = defaultdict(int)
+
+  def capped(dcid):
+    return limit is not None and counts[dcid] >= limit
+
+  per_node = utils._MAX_LIMIT if limit is None else max(limit, 1)
+  tasks = [(chunk, min(len(chunk) * per_node, utils._MAX_PAGE_LIMIT))
+           for chunk in batch._chunks(dcids, utils._QUERY_BATCH_SIZE)]
+  while tasks:
+    next_tasks = []
+    for (batch_dcids, page_limit), page in batch._imap(
+        lambda task: fetch(*task), tasks):
+      total = 0
+      for dcid in batch_dcids:
+        items = page.get(dcid) or []
+        total += len(items)
+        items = items[counts[dcid]:]
+        if limit is not None:
+          items = items[:limit - counts[dcid]]
+        if items:
+          counts[dcid] += len(items)
+          yield dcid, items
+      if total < page_limit:
+        continue
+      # The page may be truncated.
+      todo = [dcid for dcid in batch_dcids if not capped(dcid)]
+      if len(batch_dcids) > 1:
+        half = (len(todo) + 1) // 2
+        next_tasks.extend((chunk, page_limit)
+                          for chunk in (todo[:half], todo[half:]) if chunk)
+      elif todo:
+        next_limit = page_limit * 2
+        if limit is not None:
+          next_limit = min(next_limit, limit)
+        next_tasks.append((todo, next_limit))
+    tasks = next_tasks
@@ -61,6 +61,10 @@ def main():
   stats = dc.get_stats(['geoId/05', 'geoId/06', 'dc/madDcid'], 'dc/0hyp6tkn18vcb', obs_dates=['2015', '2016'])
   print(stats)
 
+  print('Get place stats -- several stat vars in one call')
+  stats = dc.get_stats(['geoId/05', 'geoId/06', 'dc/madDcid'], ['Count_Person', 'Median_Age_Person'])
+  print(stats)
+
   # Get related places.
 # TODO(*): Fix the related places example.
 #  print('Get related places')
@@ -0,0 +1,445 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Graph Module.
+
+Provides a local in-memory store of triples, to answer follow-up questions
+about a subgraph fetched with the wrapper functions without further requests
+to the REST API, and the compact lists of triples returned by
+:code:`get_triples(..., compact=True)`.
+
+Every string is interned once and triples are held as integer ids in three
+sorted indexes, ordered by subject, predicate and object (SPO), by predicate,
+object and subject (POS), and by object, subject and predicate (OSP). Each
+index is a set of compact :obj:`array.array` columns, so a triple takes 36
+bytes in total. Triples are added to a buffer which is merged into the indexes
+on the next lookup, or once it holds a quarter as many triples as the indexes.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import array
+import bisect
+import collections
+import itertools
+import sys
+import threading
+
+import six
+
+# The typecode of the id arrays, 4 byte signed integers.
+_ID_TYPECODE = 'i'
+
+# The estimated bytes taken by the intern table per string, on top of the
+# string itself.
+_INTERN_OVERHEAD = 3 * 8 * 2
+
+# The estimated bytes taken per pending triple while they are sorted, as a
+# packed integer in a set and a list.
+_SORT_OVERHEAD = 128
+
+# The number of pending triples merged without a lookup even into a small
+# store.
+_MIN_MERGE = 2**14
+
+# The orders of the components of a triple in each index.
+_SPO = (0, 1, 2)
+_POS = (1, 2, 0)
+_OSP = (2, 0, 1)
+
+
+class _Interner(object):
+  """ Maps strings to consecutive integer ids, holding each string once. """
+
+  __slots__ = ('ids', 'strings', '_nbytes', '_sized')
+
+  def __init__(self):
+    self.ids = {}
+    self.strings = []
+    self._nbytes = 0
+    self._sized = 0
+
+  def __len__(self):
+    return len(self.strings)
+
+  @property
+  def nbytes(self):
+    """ The estimated memory used by the table in bytes.
+
+    Strings are only measured when this is read, so that tables which are
+    never measured do not pay for it.
+    """
+    if self._sized < len(self.strings):
+      new = itertools.islice(self.strings, self._sized, None)
+      self._nbytes += (sum(map(sys.getsizeof, new))
+                       + _INTERN_OVERHEAD * (len(self.strings) - self._sized))
+      self._sized = len(self.strings)
+    return self._nbytes
+
+  def intern(self, term):
+    """ Returns the id of :code:`term`, adding it if it is new. """
+    term_id = self.ids.get(term)
+    if term_id is None:
+      term_id = self.ids[term] = len(self.strings)
+      self.strings.append(term)
+    return term_id
+
+  def intern_all(self, terms):
+    """ Returns an iterator of the ids of :code:`terms`, adding new ones.
+
+    The new terms are added in bulk, without a loop in Python.
+    """
+    new = list(six.moves.filterfalse(self.ids.__contains__,
+                                     dict.fromkeys(terms)))
+    self.ids.update(zip(new, itertools.count(len(self.strings))))
+    self.strings.extend(new)
+    return map(self.ids.__getitem__, terms)
+
+
+class TripleList(object):
+  """ A compact list of :code:`(s, p, o)` triples.
+
+  Triples are held as integer ids in three :obj:`array.array` columns, and
+  their strings in a table which may be shared with other lists. Triples are
+  only built as tuples when accessed.
+
+  Args:
+    interner (:obj:`_Interner`, optional): The string table to share.
+  """
+
+  __slots__ = ('_interner', '_columns')
+
+  def __init__(self, interner=None):
+    self._interner = interner if interner is not None else _Interner()
+    self._columns = _empty_index()
+
+  def __len__(self):
+    return len(self._columns[0])
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      # Slices share the string table and copy only the ids.
+      sliced = TripleList(self._interner)
+      sliced._columns = tuple(column[index] for column in self._columns)
+      return sliced
+    strings = self._interner.strings
+    return tuple(strings[column[index]] for column in self._columns)
+
+  def __iter__(self):
+    strings = self._interner.strings
+    for s, p, o in zip(*self._columns):
+      yield strings[s], strings[p], strings[o]
+
+  def __eq__(self, other):
+    if isinstance(other, (list, TripleList)):
+      return len(self) == len(other) and all(
+        a == tuple(b) for a, b in zip(self, other))
+    return NotImplemented
+
+  def __ne__(self, other):
+    equal = self.__eq__(other)
+    return equal if equal is NotImplemented else not equal
+
+  def __repr__(self):
+    return 'TripleList({!r})'.format(list(self))
+
+  def append(self, s, p, o):
+    """ Adds the triple :code:`(s, p, o)`. """
+    intern = self._interner.intern
+    for column, term in zip(self._columns, (s, p, o)):
+      column.append(intern(term))
+
+  def extend(self, triples):
+    """ Adds the :code:`(s, p, o)` triples of an iterable. """
+    columns = [list(terms) for terms in zip(*triples)]
+    if columns:
+      self._extend_columns(*columns)
+
+  def _extend_columns(self, subjects, predicates, objects):
+    """ Adds triples given as lists of their subjects, predicates and
+    objects.
+    """
+    for column, terms in zip(self._columns, (subjects, predicates, objects)):
+      column.extend(self._interner.intern_all(terms))
+
+
+class TripleStore(object):
+  """ An in-memory store of triples with pattern lookups.
+
+  Args:
+    max_bytes (:obj:`int`, optional): The estimated memory budget of the store,
+      unlimited if :obj:`None`, including the copies made while merging. Adding
+      a triple that would exceed it raises a :obj:`ValueError`, and leaves the
+      store as it was before that triple.
+
+  Examples:
+    Load the triples of two states and the names of their counties, then look
+    them up locally.
+
+    >>> store = TripleStore(max_bytes=2**28)
+    >>> store.add_triples(get_triples(['geoId/06', 'geoId/24']))
+    >>> counties = [s for s, _, _ in
+    ...             store.match(p='containedInPlace', o='geoId/06')]
+    >>> store.add_property_values(get_property_values(counties, 'name'),
+    ...                           'name')
+    >>> list(store.match(s='geoId/06085', p='name'))
+    [('geoId/06085', 'name', 'Santa Clara County')]
+  """
+
+  def __init__(self, max_bytes=None):
+    self.max_bytes = max_bytes
+    self._interner = _Interner()
+    self._pending = _empty_index()
+    self._indexes = dict((order, _empty_index()) for order in
+                         (_SPO, _POS, _OSP))
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._index(_SPO)[0])
+
+  @property
+  def nbytes(self):
+    """ The estimated peak memory used by the store in bytes, including the
+    copies made while merging the pending triples.
+    """
+    return self._estimate(len(self._pending[0]), self._interner.nbytes)
+
+  def add(self, s, p, o):
+    """ Adds the triple :code:`(s, p, o)`.
+
+    Raises:
+      ValueError: If the triple would exceed the memory budget.
+    """
+    with self._lock:
+      if not self._fits([s], [p], [o]):
+        raise ValueError(
+          'Adding {} would exceed the memory budget of the triple store '
+          'of {} bytes.'.format((s, p, o), self.max_bytes))
+      for column, term in zip(self._pending, (s, p, o)):
+        column.append(self._interner.intern(term))
+      self._merge_if_due()
+
+  def add_triples(self, triples):
+    """ Adds triples as returned by :any:`get_triples` or
+    :any:`iter_triples`.
+
+    Args:
+      triples: A :obj:`dict` from dcids to lists of :code:`(s, p, o)`
+        triples, or an iterable of triples.
+    """
+    if isinstance(triples, dict):
+      triples = itertools.chain.from_iterable(triples.values())
+    columns = [list(terms) for terms in zip(*triples)]
+    if columns:
+      self._add_columns(*columns)
+
+  def add_property_values(self, values, prop, out=True):
+    """ Adds the property values returned by :any:`get_property_values`.
+
+    Args:
+      values (:obj:`dict`): A :obj:`dict` from dcids to lists of values of
+        :code:`prop`.
+      prop (:obj:`str`): The property of the values.
+      out (:obj:`bool`, optional): Whether the property points away from the
+        dcids, as in the call that returned the values.
+    """
+    dcids, dcid_values = [], []
+    for dcid, values in values.items():
+      dcids.extend([dcid] * len(values))
+      dcid_values.extend(values)
+    if dcids:
+      if out:
+        self._add_columns(dcids, [prop] * len(dcids), dcid_values)
+      else:
+        self._add_columns(dcid_values, [prop] * len(dcids), dcids)
+
+  def add_properties(self, properties, out=True):
+    """ Adds the property values returned by :any:`get_properties` without
+    :code:`as_frame`.
+    """
+    by_prop = collections.defaultdict(dict)
+    for dcid, dcid_properties in properties.items():
+      for prop, dcid_values in dcid_properties.items():
+        by_prop[prop][dcid] = dcid_values
+    for prop, values in by_prop.items():
+      self.add_property_values(values, prop, out)
+
+  def match(self, s=None, p=None, o=None):
+    """ Yields the triples matching a pattern, where :obj:`None` matches any
+    value.
+
+    Examples:
+      All triples with subject :code:`'geoId/06'`, and all names.
+
+      >>> store.match(s='geoId/06')
+      >>> store.match(p='name')
+    """
+    pattern = (s, p, o)
+    ids = []
+    for term in pattern:
+      if term is None:
+        ids.append(None)
+      elif term in self._interner.ids:
+        ids.append(self._interner.ids[term])
+      else:
+        return
+    bound = tuple(term is not None for term in pattern)
+    order = _order(bound)
+    columns = self._index(order)
+    lo, hi = _range(columns, [ids[i] for i in order if ids[i] is not None])
+    strings = self._interner.strings
+    for i in six.moves.range(lo, hi):
+      triple = [None] * 3
+      for position, column in zip(order, columns):
+        triple[position] = strings[column[i]]
+      yield tuple(triple)
+
+  def count(self, s=None, p=None, o=None):
+    """ Returns the number of triples matching a pattern. """
+    return sum(1 for _ in self.match(s, p, o))
+
+  def _add_columns(self, subjects, predicates, objects):
+    """ Adds triples given as lists of their subjects, predicates and objects,
+    interning each list in bulk. Triples are added one by one if they would
+    exceed the memory budget, up to the first that does not fit.
+    """
+    with self._lock:
+      fits = self._fits(subjects, predicates, objects)
+      if fits:
+        for column, terms in zip(self._pending,
+                                 (subjects, predicates, objects)):
+          column.extend(self._interner.intern_all(terms))
+        self._merge_if_due()
+    if not fits:
+      for s, p, o in zip(subjects, predicates, objects):
+        self.add(s, p, o)
+
+  def _fits(self, subjects, predicates, objects):
+    """ Returns whether the triples given as columns fit in the memory
+    budget.
+    """
+    if self.max_bytes is None:
+      return True
+    new = set(subjects).union(predicates, objects).difference(
+      self._interner.ids)
+    needed = sum(sys.getsizeof(term) + _INTERN_OVERHEAD for term in new)
+    return self._estimate(len(self._pending[0]) + len(subjects),
+                          self._interner.nbytes + needed) <= self.max_bytes
+
+  def _estimate(self, pending, interner_bytes):
+    """ Returns the estimated peak memory of the store with :code:`pending`
+    triples to merge.
+
+    A merge sorts the pending triples, and builds each index as a copy of the
+    old one, from slices of its columns.
+    """
+    count = len(self._indexes[_SPO][0]) + pending
+    itemsize = self._pending[0].itemsize
+    return ((count * 9 + pending * 3 + count * 4) * itemsize
+            + pending * _SORT_OVERHEAD + interner_bytes)
+
+  def _index(self, order):
+    """ Returns the columns of an index, merging pending triples first. """
+    with self._lock:
+      if self._pending[0]:
+        self._merge()
+      return self._indexes[order]
+
+  def _merge_if_due(self):
+    """ Merges the pending triples once they are a quarter of the store, so
+    that their sort stays small and merges copy the indexes a bounded number
+    of times.
+    """
+    if len(self._pending[0]) >= max(_MIN_MERGE,
+                                    len(self._indexes[_SPO][0]) // 4):
+      self._merge()
+
+  def _merge(self):
+    """ Merges the pending triples into every index, dropping duplicates.
+
+    Only the pending triples are sorted, packed into single integers which
+    sort much faster than tuples. Each index is then rebuilt in a single pass,
+    copying the runs of old triples between the new ones.
+    """
+    n = len(self._interner)
+    triples = list(set((s * n + p) * n + o
+                       for s, p, o in zip(*self._pending)))
+    self._pending = _empty_index()
+    for order in (_SPO, _POS, _OSP):
+      keys = sorted(_repack(key, n, order) for key in triples)
+      self._indexes[order] = _merge_sorted(self._indexes[order], keys, n)
+
+
+def _empty_index():
+  return tuple(array.array(_ID_TYPECODE) for _ in range(3))
+
+
+def _range(columns, prefix, lo=0):
+  """ Returns the bounds of the rows of sorted columns starting with
+  :code:`prefix`, searching from row :code:`lo`.
+  """
+  hi = len(columns[0])
+  for column, key in zip(columns, prefix):
+    lo = bisect.bisect_left(column, key, lo, hi)
+    hi = bisect.bisect_right(column, key, lo, hi)
+  return lo, hi
+
+
+def _merge_sorted(columns, keys, n):
+  """ Returns new columns with the sorted packed :code:`keys` merged into
+  sorted :code:`columns`, skipping keys already present.
+  """
+  merged = _empty_index()
+  start = 0
+  for key in keys:
+    rest, c = divmod(key, n)
+    a, b = divmod(rest, n)
+    lo, hi = _range(columns, (a, b, c), start)
+    if lo < hi:
+      continue
+    for new_column, column, term in zip(merged, columns, (a, b, c)):
+      new_column.extend(column[start:lo])
+      new_column.append(term)
+    start = lo
+  for new_column, column in zip(merged, columns):
+    new_column.extend(column[start:])
+  return merged
+
+
+def _repack(key, n, order):
+  """ Returns a packed :code:`(s, p, o)` triple with its components in
+  :code:`order`.
+  """
+  if order == _SPO:
+    return key
+  rest, o = divmod(key, n)
+  s, p = divmod(rest, n)
+  triple = (s, p, o)
+  i, j, k = order
+  return (triple[i] * n + triple[j]) * n + triple[k]
+
+
+def _order(bound):
+  """ Returns the index whose order puts the bound components of a pattern
+  first.
+  """
+  s, p, o = bound
+  if s and not o:
+    return _SPO
+  if p:
+    return _POS
+  if o:
+    return _OSP
+  return _SPO
@@ -0,0 +1,168 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Journal Module.
+
+Provides an on-disk journal that long running bulk fetches can checkpoint their
+completed batches to. Rerunning a call with the same arguments and journal
+reads completed work back from disk and only fetches the remainder.
+
+The journal is a SQLite database holding one row per (call, key, dcid), where a
+call identifies the endpoint and request arguments, and a key identifies the
+part of the request that varies between batches apart from the dcids, such as
+the stat var.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import hashlib
+import json
+import sqlite3
+import threading
+import zlib
+
+import six
+
+# Number of dcids looked up per SQLite query.
+_LOOKUP_BATCH_SIZE = 500
+
+# The dcid under which calls that are not batched by dcid store their payload.
+_WHOLE_CALL = ''
+
+
+class Journal(object):
+  """ A checkpoint journal of completed batches backed by a SQLite file.
+
+  Args:
+    path (:obj:`str`): The path of the journal file. It is created if it does
+      not exist.
+
+  Examples:
+    Journals are usually passed to wrapper functions by path.
+
+    >>> stats = get_stats(counties, 'Count_Person', journal='/tmp/pull.db')
+
+    If the call is interrupted, running it again with the same journal only
+    fetches the places that were not completed.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, check_same_thread=False)
+    with self._lock:
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute(
+        'CREATE TABLE IF NOT EXISTS batches ('
+        '  call TEXT NOT NULL,'
+        '  key TEXT NOT NULL,'
+        '  dcid TEXT NOT NULL,'
+        '  value BLOB,'
+        '  PRIMARY KEY (call, key, dcid))')
+      self._conn.commit()
+
+  def close(self):
+    """ Closes the journal file. """
+    with self._lock:
+      self._conn.close()
+
+  def clear(self):
+    """ Removes all completed work from the journal. """
+    with self._lock:
+      self._conn.execute('DELETE FROM batches')
+      self._conn.commit()
+
+  def lookup(self, call, key, dcids):
+    """ Returns the recorded values of :code:`dcids` for :code:`(call, key)`.
+
+    Returns:
+      A :obj:`dict` mapping each completed dcid to its value in the payload,
+      or :obj:`None` if the payload had no value for it.
+    """
+    key = _encode_key(key)
+    found = {}
+    with self._lock:
+      for i in range(0, len(dcids), _LOOKUP_BATCH_SIZE):
+        chunk = dcids[i:i + _LOOKUP_BATCH_SIZE]
+        rows = self._conn.execute(
+          'SELECT dcid, value FROM batches WHERE call = ? AND key = ? AND '
+          'dcid IN ({})'.format(','.join('?' * len(chunk))),
+          [call, key] + list(chunk))
+        for dcid, value in rows:
+          found[dcid] = _decode_value(value)
+    return found
+
+  def record(self, call, key, dcids, payload):
+    """ Records that :code:`dcids` were fetched for :code:`(call, key)`.
+
+    Args:
+      payload (:obj:`dict`): The payload of the batch, keyed by dcid. Dcids
+        missing from it are recorded as having no value.
+    """
+    key = _encode_key(key)
+    rows = [(call, key, dcid, _encode_value(payload.get(dcid)))
+            for dcid in dcids]
+    with self._lock:
+      self._conn.executemany(
+        'INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?)', rows)
+      self._conn.commit()
+
+  def get(self, call):
+    """ Returns the recorded payload of an unbatched call, or :obj:`None`. """
+    return self.lookup(call, None, [_WHOLE_CALL]).get(_WHOLE_CALL)
+
+  def put(self, call, payload):
+    """ Records the payload of an unbatched call. """
+    self.record(call, None, [_WHOLE_CALL], {_WHOLE_CALL: payload})
+
+
+@contextlib.contextmanager
+def _opened(journal):
+  """ Yields a :obj:`Journal` given a journal, a path to one, or :obj:`None`.
+
+  Journals opened from a path are closed on exit.
+  """
+  if journal is None or isinstance(journal, Journal):
+    yield journal
+    return
+  journal = Journal(journal)
+  try:
+    yield journal
+  finally:
+    journal.close()
+
+
+def _call_key(endpoint, params):
+  """ Returns a key identifying a call to :code:`endpoint` with :code:`params`.
+  """
+  blob = json.dumps([endpoint, params], sort_keys=True)
+  return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def _encode_key(key):
+  return '' if key is None else six.text_type(key)
+
+
+def _encode_value(value):
+  if value is None:
+    return None
+  return sqlite3.Binary(zlib.compress(json.dumps(value).encode('utf-8')))
+
+
+def _decode_value(value):
+  if value is None:
+    return None
+  return json.loads(zlib.decompress(bytes(value)).decode('utf-8'))
@@ -22,10 +22,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import six
+
+import datacommons.batch as batch
+import datacommons.cache as cache_lib
 import datacommons.utils as utils
 
 
-def get_places_in(dcids, place_type):
+def get_places_in(dcids, place_type, sort=True):
   """ Returns :obj:`Place`s contained in :code:`dcids` of type
     :code:`place_type`.
 
@@ -33,6 +37,8 @@ def get_places_in(dcids, place_type):
     dcids (:obj:`iterable` of :obj:`str`): Dcids to get contained in places.
     place_type (:obj:`str`): The type of places contained in the given dcids to
     filter by.
+    sort (:obj:`bool`, optional): Whether to sort the places of each dcid.
+      Otherwise they are kept in the order returned by the REST API.
 
   Returns:
     The returned :obj:`Place`'s are formatted as a :obj:`dict` from a given
@@ -62,24 +68,25 @@ def get_places_in(dcids, place_type):
   """
   dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
   dcids = list(dcids)
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_places_in']
-  payload = utils._send_request(url, req_json = {
-    'dcids': dcids,
-    'place_type': place_type,
-  })
+  payload = batch._fetch_all(
+    'get_places_in', dcids, {'place_type': place_type},
+    transform=lambda p: utils._format_expand_payload(p, 'place', sort=False))
 
-  # Create the results and format it appropriately
-  result = utils._format_expand_payload(payload, 'place', must_exist=dcids)
-  return result
+  # Make sure each dcid is in the results.
+  if sort:
+    return {dcid: sorted(payload.get(dcid, [])) for dcid in dcids}
+  return {dcid: payload.get(dcid, []) for dcid in dcids}
 
 def get_stats(dcids, stats_var, obs_dates='latest', measurement_method=None,
-              unit=None, obs_period=None):
+              unit=None, obs_period=None, errors=None, journal=None,
+              progress=None):
   """ Returns :obj:`TimeSeries` for :code:`dcids` \
     based on the :code:`stats_var`.
 
   Args:
     dcids (:obj:`iterable` of :obj:`str`): Dcids of places to query for.
-    stats_var (:obj:`str`): The dcid of the :obj:StatisticalVariable.
+    stats_var (:obj:`str` or :obj:`iterable` of :obj:`str`): The dcid of the
+      :obj:StatisticalVariable, or several such dcids.
     obs_dates (:obj:`str` or :obj:`iterable` of :obj:`str`):
       Which observation to return.
       Can be 'latest', 'all', or an iterable of dates in 'YYYY-MM-DD' format.
@@ -88,6 +95,20 @@ def get_stats(dcids, stats_var, obs_dates='latest', measurement_method=None,
     unit (:obj:`str`): Optional, the dcid of the preferred `unit` value.
     obs_period (:obj:`str`): Optional, the dcid of the preferred
       `observationPeriod` value.
+    errors (:obj:`dict`): Optional. If given, failing batches are retried and
+      split in half to isolate the places causing the failure instead of
+      raising. Places that could not be fetched are recorded in this
+      :obj:`dict`, mapped to the error message of their last attempt. If
+      :code:`stats_var` is a list, they are recorded under their stat var.
+    journal (:obj:`str` or :obj:`datacommons.journal.Journal`): Optional, the
+      path of an on-disk journal to checkpoint completed batches to. Rerunning
+      the call with the same arguments and journal only fetches the places
+      that were not completed before.
+    progress (:obj:`func`): Optional, a function called after every completed
+      batch with a :obj:`dict` reporting :code:`batches_done`,
+      :code:`batches_total`, :code:`requests`, :code:`bytes` received,
+      :code:`records` decoded, :code:`elapsed` seconds and
+      :code:`requests_per_second`.
   Returns:
     A :obj:`dict` mapping the :obj:`Place` identified by the given :code:`dcid`
     to its place name and the :obj:`TimeSeries` associated with the
@@ -96,6 +117,9 @@ def get_stats(dcids, stats_var, obs_dates='latest', measurement_method=None,
     See example below for more detail about how the returned :obj:`dict` is
     structured.
 
+    If :code:`stats_var` is a list, the returned :obj:`dict` maps each
+    :obj:`StatisticalVariable` to such a :obj:`dict` instead.
+
   Raises:
     ValueError: If the payload returned by the Data Commons REST API is
       malformed.
@@ -137,48 +161,259 @@ def get_stats(dcids, stats_var, obs_dates='latest', measurement_method=None,
         },
       },
     }
+
+    Several :obj:`StatisticalVariable`'s can be fetched for the same places in
+    one call. The places are batched once and all requests are issued
+    concurrently.
+
+    >>> get_stats(["geoId/05", "geoId/06"], ["Count_Person", "Median_Age_Person"])
+    {
+      'Count_Person': {
+        'geoId/05': {...},
+        'geoId/06': {...},
+      },
+      'Median_Age_Person': {
+        'geoId/05': {...},
+        'geoId/06': {...},
+      },
+    }
   """
   dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
   dcids = list(dcids)
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_stats']
-  batches =  -(-len(dcids) // utils._QUERY_BATCH_SIZE)  # Ceil to get # of batches.
-  res = {}
-  for i in range(batches):
-    req_json = {
-      'place': dcids[i * utils._QUERY_BATCH_SIZE:(i+1) * utils._QUERY_BATCH_SIZE],
-      'stats_var': stats_var,
+  single = isinstance(stats_var, six.string_types)
+  stats_vars = [stats_var] if single else list(stats_var)
+  obs_dates = _obs_dates(obs_dates)
+
+  res = {sv: {} for sv in stats_vars}
+  for sv, _, payload, failed in _iter_stats_batches(
+      dcids, stats_vars, measurement_method, unit, obs_period,
+      tolerate_errors=errors is not None, journal=journal, progress=progress):
+    res[sv].update(_filter_stats(payload, obs_dates))
+    _record_errors(errors, sv, failed, single)
+  if single:
+    return res[stats_var]
+  return res
+
+
+def iter_stats(dcids, stats_var, obs_dates='latest', measurement_method=None,
+               unit=None, obs_period=None, ordered=False, errors=None,
+               journal=None, progress=None):
+  """ Yields :obj:`TimeSeries` for :code:`dcids` based on the
+    :code:`stats_var` as each batched request completes.
+
+  This is a streaming variant of :any:`get_stats` which accepts the same
+  arguments. Records are yielded as soon as the batch containing them is
+  received, so only the batches in flight are held in memory.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): Dcids of places to query for.
+    stats_var (:obj:`str` or :obj:`iterable` of :obj:`str`): The dcid of the
+      :obj:StatisticalVariable, or several such dcids.
+    obs_dates (:obj:`str` or :obj:`iterable` of :obj:`str`):
+      Which observation to return.
+      Can be 'latest', 'all', or an iterable of dates in 'YYYY-MM-DD' format.
+    measurement_method (:obj:`str`): Optional, the dcid of the preferred
+      `measurementMethod` value.
+    unit (:obj:`str`): Optional, the dcid of the preferred `unit` value.
+    obs_period (:obj:`str`): Optional, the dcid of the preferred
+      `observationPeriod` value.
+    ordered (:obj:`bool`, optional): Whether to yield batches in the order of
+      :code:`dcids` rather than in the order they complete.
+    errors (:obj:`dict`): Optional. If given, failing batches are retried and
+      split instead of raising, and failed places are recorded in it as in
+      :any:`get_stats`.
+    journal (:obj:`str` or :obj:`datacommons.journal.Journal`): Optional, a
+      journal to checkpoint completed batches to as in :any:`get_stats`.
+    progress (:obj:`func`): Optional, a function called with a progress report
+      after every completed batch as in :any:`get_stats`.
+
+  Yields:
+    :code:`(place, stats)` tuples where :code:`stats` has the same form as the
+    values returned by :any:`get_stats`. If :code:`stats_var` is a list,
+    :code:`(stats_var, place, stats)` tuples are yielded instead.
+
+  Raises:
+    ValueError: If the payload returned by the Data Commons REST API is
+      malformed.
+
+  Examples:
+    >>> for place, stats in iter_stats(counties, "Count_Person"):
+    ...   store(place, stats['data'])
+  """
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+  dcids = list(dcids)
+  single = isinstance(stats_var, six.string_types)
+  stats_vars = [stats_var] if single else list(stats_var)
+  obs_dates = _obs_dates(obs_dates)
+
+  for sv, _, payload, failed in _iter_stats_batches(
+      dcids, stats_vars, measurement_method, unit, obs_period, ordered=ordered,
+      tolerate_errors=errors is not None, journal=journal, progress=progress):
+    _record_errors(errors, sv, failed, single)
+    for place, stats in _filter_stats(payload, obs_dates).items():
+      if single:
+        yield place, stats
+      else:
+        yield sv, place, stats
+
+
+def refresh_stats(dcids, stats_var, measurement_method=None, unit=None,
+                  obs_period=None, errors=None, progress=None):
+  """ Refreshes the cached :obj:`TimeSeries` of :code:`dcids` and returns the
+    observations that are new since they were cached.
+
+  The full series are fetched again, bypassing the cache, since the REST API
+  cannot filter them by date. For every place, only observations dated after
+  the latest date already cached for it are merged into the cached series,
+  which :any:`get_stats` and :any:`get_stat_value` then read. Places without a
+  cached series are cached in full and reported as entirely new. Series are
+  only cached per place, so the cache must be installed per dcid.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): Dcids of places to refresh.
+    stats_var (:obj:`str` or :obj:`iterable` of :obj:`str`): The dcid of the
+      :obj:StatisticalVariable, or several such dcids.
+    measurement_method (:obj:`str`): Optional, the dcid of the preferred
+      `measurementMethod` value.
+    unit (:obj:`str`): Optional, the dcid of the preferred `unit` value.
+    obs_period (:obj:`str`): Optional, the dcid of the preferred
+      `observationPeriod` value.
+    errors (:obj:`dict`): Optional. If given, failing batches are retried and
+      split instead of raising, and failed places are recorded in it as in
+      :any:`get_stats`.
+    progress (:obj:`func`): Optional, a function called with a progress report
+      after every completed batch as in :any:`get_stats`.
+
+  Returns:
+    A :obj:`dict` mapping each place with new observations to a :obj:`dict`
+    from their dates to their values. If :code:`stats_var` is a list, the
+    returned :obj:`dict` maps each :obj:`StatisticalVariable` to such a
+    :obj:`dict` instead.
+
+  Raises:
+    ValueError: If no cache is installed per dcid, or if the payload returned
+      by the Data Commons REST API is malformed.
+
+  Examples:
+    >>> set_cache(DiskCache('/tmp/datacommons.db'), per_dcid=True)
+    >>> stats = get_stats(counties, "UnemploymentRate_Person", "all")
+
+    A month later, only the new observations are returned.
+
+    >>> refresh_stats(counties, "UnemploymentRate_Person")
+    {
+      'geoId/06001': {'2020-09': 8.8},
+      'geoId/06003': {'2020-09': 7.1},
+      ...
     }
-    if measurement_method:
-      req_json['measurement_method'] = measurement_method
-    if unit:
-      req_json['unit'] = unit
-    if obs_period:
-      req_json['observation_period'] = obs_period
-    payload = utils._send_request(url, req_json)
-    if obs_dates == 'all':
-      res.update(payload)
-    elif obs_dates == 'latest':
-      for geo, stats in payload.items():
-        if not stats:
-          continue
-        time_series = stats.get('data')
-        if not time_series: continue
-        max_date = max(time_series)
-        max_date_stat = time_series[max_date]
-        time_series.clear()
-        time_series[max_date] = max_date_stat
-        res[geo] = stats
-    elif obs_dates:
-      obs_dates = set(obs_dates)
-      for geo, stats in payload.items():
-        if not stats:
-          continue
-        time_series = stats.get('data')
-        if not time_series: continue
-        for date in list(time_series):
-          if date not in obs_dates:
-            time_series.pop(date)
-        res[geo] = stats
+  """
+  if cache_lib._dcid_cache is None:
+    raise ValueError(
+      'Refreshing stats requires a cache installed per dcid, see set_cache.')
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+  dcids = list(dcids)
+  single = isinstance(stats_var, six.string_types)
+  stats_vars = [stats_var] if single else list(stats_var)
+  facet = cache_lib._facet(measurement_method, obs_period, unit)
+
+  res = {sv: {} for sv in stats_vars}
+  for sv, _, payload, failed in _iter_stats_batches(
+      dcids, stats_vars, measurement_method, unit, obs_period,
+      tolerate_errors=errors is not None, progress=progress, refresh=True):
+    _record_errors(errors, sv, failed, single)
+    for place, stats in payload.items():
+      new = cache_lib._merge_series(place, sv, facet, stats)
+      if new:
+        res[sv][place] = new
+  if single:
+    return res[stats_var]
+  return res
+
+
+def _iter_stats_batches(dcids, stats_vars, measurement_method=None, unit=None,
+                        obs_period=None, ordered=False, tolerate_errors=False,
+                        journal=None, progress=None, refresh=False):
+  """ Yields :code:`(stats_var, places, payload, failed)` for every batch of a
+  :code:`get_stats` call.
+
+  Every (place batch, stat var) pair is issued as one request, with all
+  requests sharing a single concurrent schedule. See :code:`batch._run` for
+  :code:`tolerate_errors`, :code:`journal` and :code:`progress`.
+
+  With per dcid caching, places whose full series is cached, by an earlier
+  :code:`get_stats` call with any :code:`obs_dates`, are not fetched again.
+  If :code:`refresh` is set, every place is fetched and the caller merges the
+  cached series.
+  """
+  params = {}
+  if measurement_method:
+    params['measurement_method'] = measurement_method
+  if unit:
+    params['unit'] = unit
+  if obs_period:
+    params['observation_period'] = obs_period
+
+  def fetch(sv, places):
+    req_json = dict(params, place=places, stats_var=sv)
+    return batch._send('get_stats', sv, places, req_json,
+                       use_cache=not refresh)
+
+  facet = cache_lib._facet(measurement_method, obs_period, unit)
+  return batch._run('get_stats', dcids, stats_vars, fetch, ordered=ordered,
+                    tolerate_errors=tolerate_errors, journal=journal,
+                    params=params, progress=progress,
+                    stores=[] if refresh else [cache_lib._series_store(facet)],
+                    lookup=not refresh)
+
+
+def _record_errors(errors, stats_var, failed, single):
+  """ Records places that failed for :code:`stats_var` in :code:`errors`. """
+  if not failed:
+    return
+  if single:
+    errors.update(failed)
+  else:
+    errors.setdefault(stats_var, {}).update(failed)
+
+
+def _obs_dates(obs_dates):
+  """ Returns :code:`obs_dates` as a set of dates, unless it is
+  :code:`'all'` or :code:`'latest'`, so that it can filter every batch.
+  """
+  if isinstance(obs_dates, six.string_types) and obs_dates in ('all',
+                                                               'latest'):
+    return obs_dates
+  return set(obs_dates or ())
+
+
+def _filter_stats(payload, obs_dates):
+  """ Filters a :code:`get_stats` payload down to the requested dates, a set
+  or :code:`'all'` or :code:`'latest'`.
+  """
+  res = {}
+  if obs_dates == 'all':
+    res.update(payload)
+  elif obs_dates == 'latest':
+    for geo, stats in payload.items():
+      if not stats:
+        continue
+      time_series = stats.get('data')
+      if not time_series: continue
+      max_date = max(time_series)
+      max_date_stat = time_series[max_date]
+      time_series.clear()
+      time_series[max_date] = max_date_stat
+      res[geo] = stats
+  elif obs_dates:
+    for geo, stats in payload.items():
+      if not stats:
+        continue
+      time_series = stats.get('data')
+      if not time_series: continue
+      for date in list(time_series):
+        if date not in obs_dates:
+          time_series.pop(date)
+      res[geo] = stats
   return res
 
 
@@ -26,6 +26,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import datacommons.batch as batch
+import datacommons.journal as journal_lib
 import datacommons.utils as utils
 
 
@@ -100,16 +102,12 @@ def get_populations(dcids, population_type, constraining_properties={}):
   dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
   dcids = list(dcids)
   pv = [{'property': k, 'value': v} for k, v in constraining_properties.items()]
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_populations']
-  payload = utils._send_request(url, req_json={
-    'dcids': dcids,
-    'population_type': population_type,
-    'pvs': pv,
-  })
+  payload = batch._fetch_all(
+    'get_populations', dcids, {'population_type': population_type, 'pvs': pv},
+    transform=lambda p: utils._format_expand_payload(p, 'population'))
 
-  # Create the results and format it appropriately
-  result = utils._format_expand_payload(
-    payload, 'population', must_exist=dcids)
+  # Make sure each dcid is in the results.
+  result = {dcid: payload.get(dcid, []) for dcid in dcids}
 
   # Drop empty results while flattening
   return _flatten_results(result)
@@ -324,8 +322,8 @@ def get_pop_obs(dcid):
   url = utils._API_ROOT + utils._API_ENDPOINTS['get_pop_obs'] + '?dcid={}'.format(dcid)
   return utils._send_request(url, compress=True, post=False)
 
-def get_place_obs(
-  place_type, observation_date, population_type, constraining_properties={}):
+def get_place_obs(place_type, observation_date, population_type,
+                  constraining_properties={}, journal=None, progress=None):
   """ Returns all :obj:`Observation`'s for all places given the place type,
   observation date and the :obj:`StatisticalPopulation` constraints.
 
@@ -338,6 +336,11 @@ def get_place_obs(
     constraining_properties (:obj:`map` from :obj:`str` to :obj:`str`, optional):
       A map from constraining property to the value that the
       :obj:`StatisticalPopulation` should be constrained by.
+    journal (:obj:`str` or :obj:`datacommons.journal.Journal`, optional): The
+      path of an on-disk journal to checkpoint the result to. Rerunning the
+      call with the same arguments and journal reads the result from disk.
+    progress (:obj:`func`, optional): A function called with a progress report
+      once the result is received, as in :any:`get_stats`.
 
   Returns:
     A list of dictionaries, with each dictionary containng *all*
@@ -408,11 +411,34 @@ def get_place_obs(
   """
   # Create the json payload and send it to the REST API.
   pv = [{'property': k, 'value': v} for k, v in constraining_properties.items()]
-  url = utils._API_ROOT + utils._API_ENDPOINTS['get_place_obs']
-  payload = utils._send_request(url, req_json={
+  req_json = {
     'place_type': place_type,
     'observation_date': observation_date,
     'population_type': population_type,
     'pvs': pv,
-  }, compress=True)
-  return payload['places']
+  }
+
+  tracker = batch._Progress(progress) if progress is not None else None
+
+  # Read the result from the journal if it was completed before.
+  with journal_lib._opened(journal) as journal:
+    if journal is not None:
+      call = journal_lib._call_key(
+        'get_place_obs',
+        dict(req_json, pvs=sorted(pv, key=lambda p: p['property'])))
+      places = journal.get(call)
+      if places is not None:
+        if tracker is not None:
+          tracker.replay(len(places))
+        return places
+
+    url = utils._API_ROOT + utils._API_ENDPOINTS['get_place_obs']
+    stats = {}
+    payload = utils._send_request(
+      url, req_json=req_json, compress=True, stats=stats)
+    if journal is not None:
+      journal.put(call, payload['places'])
+    if tracker is not None:
+      tracker.total = 1
+      tracker.update(len(payload['places']), 1, stats['bytes'])
+    return payload['places']
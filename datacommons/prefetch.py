@@ -0,0 +1,186 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Prefetch Module.
+
+Warms up the installed cache with the places and stat vars listed in a
+manifest, so that later calls are served without requests to the REST API.
+The cache must be installed per dcid, see :any:`set_cache`, so that later
+calls for any subset of the places are served from it, and so must the cache
+reading the prefetched entries.
+
+A manifest is a :obj:`dict`, or a JSON file holding one, of the form
+
+.. code-block:: json
+
+  {
+    "places": ["geoId/06", "geoId/21"],
+    "places_in": [{"dcids": ["country/USA"], "place_type": "County"}],
+    "stat_vars": ["Count_Person", "Median_Age_Person"],
+    "endpoints": ["get_stats", "get_stat_all"]
+  }
+
+where :code:`places_in` lists expansions to the places returned by
+:code:`get_places_in`, and :code:`endpoints` the wrapper functions to fetch the
+stat vars with, :code:`get_stats` by default.
+
+The prefetch can also be run from the command line, which fills a disk cache
+to be installed with :code:`set_cache(DiskCache(path), per_dcid=True)`:
+
+.. code-block:: bash
+
+  python -m datacommons prefetch manifest.json --cache /tmp/datacommons.db \
+    --rate 20
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+import six
+
+import datacommons.cache as cache_lib
+import datacommons.places as places_lib
+import datacommons.stat_vars as stat_vars_lib
+import datacommons.utils as utils
+
+# The wrapper functions a manifest can prefetch stat vars with.
+_ENDPOINTS = ('get_stats', 'get_stat_all')
+
+
+def prefetch(manifest, rate=None, errors=None, progress=None):
+  """ Fetches the places and stat vars of :code:`manifest` into the cache.
+
+  All stat vars are fetched for all places in one batched call per endpoint,
+  with the usual concurrency.
+
+  Args:
+    manifest (:obj:`dict` or :obj:`str`): The manifest, or the path of a JSON
+      file holding it. See the module documentation for its form.
+    rate (:obj:`float`, optional): The maximum number of requests the
+      prefetch sends per second. Unlike :any:`set_rate_limit`, this does not
+      limit the requests of other threads.
+    errors (:obj:`dict`, optional): If given, failing batches are retried and
+      split instead of raising, and failed places are recorded in it, keyed by
+      endpoint.
+    progress (:obj:`func`, optional): A function called with a progress report
+      after every completed batch as in :any:`get_stats`.
+
+  Returns:
+    A :obj:`dict` with the number of :code:`places` and :code:`stat_vars`
+    prefetched, and the number of :code:`records` received.
+
+  Raises:
+    ValueError: If no cache is installed per dcid, if the manifest is
+      malformed, or if the payload returned by the Data Commons REST API is
+      malformed.
+
+  Examples:
+    >>> set_cache(DiskCache('/tmp/datacommons.db'), per_dcid=True)
+    >>> prefetch({
+    ...   'places_in': [{'dcids': ['country/USA'], 'place_type': 'County'}],
+    ...   'stat_vars': ['Count_Person'],
+    ... }, rate=20)
+    {'places': 3233, 'stat_vars': 1, 'records': 3220}
+  """
+  if cache_lib._dcid_cache is None:
+    raise ValueError(
+      'Prefetching requires a cache installed per dcid, see set_cache.')
+  if isinstance(manifest, six.string_types):
+    with open(manifest) as f:
+      manifest = json.load(f)
+  stat_vars = list(manifest.get('stat_vars', []))
+  endpoints = list(manifest.get('endpoints', ['get_stats']))
+  for endpoint in endpoints:
+    if endpoint not in _ENDPOINTS:
+      raise ValueError('Cannot prefetch endpoint {}.'.format(endpoint))
+
+  with utils._thread_rate_limit(rate):
+    places = _expand_places(manifest)
+    records = 0
+    for endpoint in endpoints:
+      endpoint_errors = {} if errors is not None else None
+      if endpoint == 'get_stats':
+        for _ in places_lib.iter_stats(places, stat_vars, 'all',
+                                       errors=endpoint_errors,
+                                       progress=progress):
+          records += 1
+      else:
+        records += len(stat_vars_lib.get_stat_all(
+          places, stat_vars, errors=endpoint_errors, progress=progress))
+      if endpoint_errors:
+        errors[endpoint] = endpoint_errors
+  return {'places': len(places), 'stat_vars': len(stat_vars),
+          'records': records}
+
+
+def _expand_places(manifest):
+  """ Returns the deduplicated places of a manifest in order. """
+  places = list(manifest.get('places', []))
+  for expansion in manifest.get('places_in', []):
+    try:
+      dcids, place_type = expansion['dcids'], expansion['place_type']
+    except (KeyError, TypeError):
+      raise ValueError(
+        'Expansions need "dcids" and "place_type": {}'.format(expansion))
+    contained = places_lib.get_places_in(dcids, place_type)
+    for dcid in dcids:
+      places.extend(contained[dcid])
+  seen = set()
+  return [p for p in places if not (p in seen or seen.add(p))]
+
+
+def main(argv=None):
+  """ Runs a prefetch from the command line. """
+  parser = argparse.ArgumentParser(
+    prog='python -m datacommons prefetch',
+    description='Warms up a Data Commons disk cache from a manifest.')
+  parser.add_argument('manifest', help='the path of the JSON manifest')
+  parser.add_argument('--cache', required=True,
+                      help='the path of the disk cache to fill')
+  parser.add_argument('--max-bytes', type=int, default=2**30,
+                      help='the maximum size of the disk cache in bytes')
+  parser.add_argument('--ttl', type=float,
+                      help='the time to live of cached entries in seconds')
+  parser.add_argument('--rate', type=float,
+                      help='the maximum number of requests per second')
+  parser.add_argument('--api-key', help='the Data Commons API key')
+  args = parser.parse_args(argv)
+
+  if args.api_key:
+    utils.set_api_key(args.api_key)
+  cache = cache_lib.DiskCache(args.cache, max_bytes=args.max_bytes,
+                              ttl=args.ttl)
+  cache_lib.set_cache(cache, per_dcid=True)
+
+  def report(status):
+    sys.stderr.write('\r{batches_done}/{batches_total} batches, '
+                     '{requests} requests, {bytes} bytes'.format(**status))
+
+  errors = {}
+  try:
+    summary = prefetch(args.manifest, rate=args.rate, errors=errors,
+                       progress=report)
+  finally:
+    cache_lib.set_cache(None)
+    cache.close()
+  sys.stderr.write('\n')
+  print('Prefetched {records} records for {places} places and {stat_vars} '
+        'stat vars.'.format(**summary))
+  for endpoint, failed in sorted(errors.items()):
+    print('{} failed for {} places.'.format(endpoint, len(failed)))
+  return 1 if errors else 0
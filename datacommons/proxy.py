@@ -0,0 +1,286 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Proxy Module.
+
+Provides a caching HTTP proxy for the REST API endpoints in
+:code:`_API_ENDPOINTS`, to be shared by the worker processes of a host. The
+proxy forwards requests to the upstream REST API and caches successful
+responses, so that every distinct request is fetched once per host. Identical
+requests arriving while one is in flight wait for its response rather than
+being forwarded again, and forwarded requests can be rate limited.
+
+Clients point the API root at the proxy:
+
+>>> datacommons.utils._API_ROOT = 'http://localhost:8080'
+
+The proxy can be run from the command line:
+
+.. code-block:: bash
+
+  python -m datacommons proxy --port 8080 --cache /tmp/datacommons.db
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import threading
+
+import six
+import six.moves.BaseHTTPServer
+import six.moves.socketserver
+import six.moves.urllib.error
+import six.moves.urllib.parse
+import six.moves.urllib.request
+
+import datacommons.cache as cache_lib
+import datacommons.utils as utils
+
+# The path serving the cache statistics in the Prometheus text format.
+_METRICS_PATH = '/metrics'
+
+# Seconds to wait for a response of the upstream REST API.
+_UPSTREAM_TIMEOUT = 300
+
+
+class Proxy(object):
+  """ A caching proxy server for the REST API.
+
+  Args:
+    cache (:obj:`datacommons.cache.Cache`, optional): The cache of responses,
+      a :obj:`datacommons.cache.MemoryCache` by default.
+    upstream (:obj:`str`, optional): The root URL of the REST API to forward
+      requests to, :code:`_API_ROOT` by default.
+    rate (:obj:`float`, optional): The maximum number of requests forwarded
+      upstream per second.
+    api_key (:obj:`str`, optional): The API key to forward requests with if
+      the client did not send one.
+    host (:obj:`str`, optional): The address to listen on.
+    port (:obj:`int`, optional): The port to listen on, any free one if 0.
+
+  Examples:
+    Serve a proxy in the background of the current process.
+
+    >>> proxy = Proxy(cache=DiskCache('/tmp/datacommons.db'), port=8080)
+    >>> proxy.start()
+    >>> datacommons.utils._API_ROOT = proxy.url
+  """
+
+  def __init__(self, cache=None, upstream=None, rate=None, api_key=None,
+               host='127.0.0.1', port=0):
+    self.cache = cache if cache is not None else cache_lib.MemoryCache()
+    self.upstream = (upstream or utils._API_ROOT).rstrip('/')
+    self.api_key = api_key
+    self.counters = collections.Counter()
+    self._limiter = utils._RateLimiter(rate) if rate else None
+    self._paths = frozenset(utils._API_ENDPOINTS.values())
+    self._inflight = {}
+    self._lock = threading.Lock()
+    self._thread = None
+    self.server = _Server((host, port), _Handler)
+    self.server.proxy = self
+
+  @property
+  def url(self):
+    """ The root URL clients send requests to. """
+    host, port = self.server.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
+
+  def serve_forever(self, poll_interval=0.5):
+    """ Serves requests until :obj:`Proxy.stop` is called, checking for it
+    every :code:`poll_interval` seconds.
+    """
+    self.server.serve_forever(poll_interval)
+
+  def start(self, poll_interval=0.5):
+    """ Serves requests in a background thread. """
+    self._thread = threading.Thread(target=self.serve_forever,
+                                    args=(poll_interval,))
+    self._thread.daemon = True
+    self._thread.start()
+    return self
+
+  def stop(self):
+    """ Stops serving requests and closes the listening socket. """
+    if self._thread is not None:
+      self.server.shutdown()
+      self._thread.join()
+      self._thread = None
+    self.server.server_close()
+
+  def handle(self, method, path, body, api_key=None):
+    """ Answers a request to the proxy.
+
+    Args:
+      method (:obj:`str`): :code:`'GET'` or :code:`'POST'`.
+      path (:obj:`str`): The path of the request, including its query.
+      body (:obj:`bytes`): The body of a POST request.
+      api_key (:obj:`str`, optional): The API key sent by the client.
+
+    Returns:
+      The HTTP status code and the response body.
+    """
+    url = six.moves.urllib.parse.urlsplit(path)
+    if url.path == _METRICS_PATH:
+      return 200, self.metrics().encode('utf-8')
+    if url.path not in self._paths:
+      return 404, b'Unknown endpoint ' + url.path.encode('utf-8')
+    post = method == 'POST'
+    req_json = {}
+    if post:
+      try:
+        req_json = json.loads(body.decode('utf-8'))
+      except ValueError:
+        return 400, b'The request body is not JSON.'
+    req_url = self.upstream + path
+
+    key, endpoint = self.cache.key(req_url, req_json, post)
+    value = self.cache.get(key, endpoint)
+    if value is not None:
+      self._count('hits')
+      return 200, value
+
+    # Coalesce identical requests: the first one is forwarded, and the others
+    # wait for its response.
+    with self._lock:
+      call = self._inflight.get(key)
+      leader = call is None
+      if leader:
+        call = self._inflight[key] = _Call()
+    if not leader:
+      self._count('coalesced')
+      call.done.wait()
+      return call.result
+
+    self._count('misses')
+    try:
+      call.result = self._forward(req_url, body if post else None, api_key)
+      if call.result[0] == 200:
+        self.cache.set(key, call.result[1], endpoint,
+                       tags=self.cache.tags(req_url, req_json, post))
+    except Exception as e:
+      call.result = 502, 'Upstream error: {}'.format(e).encode('utf-8')
+    finally:
+      with self._lock:
+        del self._inflight[key]
+      call.done.set()
+    return call.result
+
+  def metrics(self):
+    """ Returns the proxy and cache statistics in the Prometheus text format.
+    """
+    lines = ['# TYPE datacommons_proxy_requests counter']
+    with self._lock:
+      counters = dict(self.counters)
+    for result in ('hits', 'misses', 'coalesced'):
+      lines.append('datacommons_proxy_requests{{result="{}"}} {}'.format(
+        result, counters.get(result, 0)))
+    return '\n'.join(lines) + '\n' + cache_lib.format_metrics(self.cache)
+
+  def _count(self, result):
+    with self._lock:
+      self.counters[result] += 1
+
+  def _forward(self, req_url, body, api_key):
+    """ Sends a request upstream and returns its status code and body. """
+    headers = {'Content-Type': 'application/json'}
+    api_key = api_key or self.api_key
+    if api_key:
+      headers['x-api-key'] = api_key
+    req = six.moves.urllib.request.Request(req_url, data=body,
+                                           headers=headers)
+    if self._limiter is not None:
+      self._limiter.acquire()
+    try:
+      res = six.moves.urllib.request.urlopen(req, timeout=_UPSTREAM_TIMEOUT)
+    except six.moves.urllib.error.HTTPError as e:
+      return e.code, e.read()
+    return 200, res.read()
+
+
+class _Call(object):
+  """ A request forwarded upstream that other requests may wait for. """
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+
+
+class _Server(six.moves.socketserver.ThreadingMixIn,
+              six.moves.BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class _Handler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    self._respond(b'')
+
+  def do_POST(self):
+    length = int(self.headers.get('Content-Length') or 0)
+    self._respond(self.rfile.read(length))
+
+  def _respond(self, body):
+    status, res_body = self.server.proxy.handle(
+      self.command, self.path, body, self.headers.get('x-api-key'))
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(res_body)))
+    self.end_headers()
+    self.wfile.write(res_body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def main(argv=None):
+  """ Runs a proxy from the command line. """
+  parser = argparse.ArgumentParser(
+    prog='python -m datacommons proxy',
+    description='Serves a caching proxy for the Data Commons REST API.')
+  parser.add_argument('--host', default='127.0.0.1',
+                      help='the address to listen on')
+  parser.add_argument('--port', type=int, default=8080,
+                      help='the port to listen on')
+  parser.add_argument('--upstream', default=utils._API_ROOT,
+                      help='the root URL of the REST API')
+  parser.add_argument('--cache',
+                      help='the path of a disk cache, in memory if unset')
+  parser.add_argument('--max-bytes', type=int, default=2**30,
+                      help='the maximum size of the cache in bytes')
+  parser.add_argument('--ttl', type=float,
+                      help='the time to live of cached entries in seconds')
+  parser.add_argument('--rate', type=float,
+                      help='the maximum number of upstream requests per second')
+  parser.add_argument('--api-key', help='the Data Commons API key')
+  args = parser.parse_args(argv)
+
+  if args.cache:
+    cache = cache_lib.DiskCache(args.cache, max_bytes=args.max_bytes,
+                                ttl=args.ttl)
+  else:
+    cache = cache_lib.MemoryCache(max_bytes=args.max_bytes, ttl=args.ttl)
+  proxy = Proxy(cache, upstream=args.upstream, rate=args.rate,
+                api_key=args.api_key, host=args.host, port=args.port)
+  print('Serving the Data Commons REST API at {}'.format(proxy.url))
+  try:
+    proxy.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    proxy.server.server_close()
+  return 0
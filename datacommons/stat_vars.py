@@ -28,6 +28,8 @@ import os
 import six.moves.urllib.error
 import six.moves.urllib.request
 
+import datacommons.batch as batch
+import datacommons.cache as cache_lib
 import datacommons.utils as utils
 
 
@@ -53,7 +55,9 @@ def get_stat_value(place,
       scaling_factor (`int`): Optional, the preferred `scalingFactor` value.
     Returns:
       A `float` the value of `stat_var` for `place`, filtered
-      by optional args.
+      by optional args. If a cache is installed and holds the full series
+      for `place`, `stat_var` and the optional args, from `get_stat_series`
+      or `get_stats`, the value is read from it without a request.
 
     Raises:
       ValueError: If the payload returned by the Data Commons REST API is
@@ -63,6 +67,12 @@ def get_stat_value(place,
       >>> get_stat_value("geoId/05", "Count_Person")
           366331
     """
+    facet = cache_lib._facet(measurement_method, observation_period, unit,
+                             scaling_factor)
+    value = cache_lib._stat_value(place, stat_var, facet, date)
+    if value is not None:
+        return value
+
     url = utils._API_ROOT + utils._API_ENDPOINTS['get_stat_value']
     url += '?place={}&stat_var={}'.format(place, stat_var)
     if date:
@@ -123,19 +133,35 @@ def get_stat_series(place,
     if scaling_factor:
         url += '&scaling_factor={}'.format(scaling_factor)
 
-    res_json = utils._send_request(url, post=False, use_payload=False)
+    stats = {}
+    res_json = utils._send_request(url, post=False, use_payload=False,
+                                   stats=stats)
 
     if 'series' not in res_json:
         raise ValueError('No data in response.')
+    if stats['cached']:
+        return res_json['series']
+    facet = cache_lib._facet(measurement_method, observation_period, unit,
+                             scaling_factor)
+    cache_lib._record_series(place, stat_var, facet, res_json['series'])
     return res_json['series']
 
 
-def get_stat_all(places, stat_vars):
+def get_stat_all(places, stat_vars, errors=None, journal=None, progress=None):
     """Returns a nested `dict` of all time series for `places` and `stat_vars`.
 
     Args:
       places (`Iterable` of `str`): The dcids of Places to query for.
       stat_vars (`Iterable` of `str`): The dcids of the StatisticalVariables.
+      errors (`dict`): Optional. If given, failing batches of places are
+        retried and split instead of raising, and places that could not be
+        fetched are recorded in it, mapped to an error message.
+      journal (`str` or `datacommons.journal.Journal`): Optional, the path
+        of an on-disk journal to checkpoint completed batches of places to.
+        Rerunning the call with the same arguments and journal only fetches
+        the places that were not completed before.
+      progress (`func`): Optional, a function called after every completed
+        batch with a progress report, as in `get_stats`.
     Returns:
       A nested `dict` mapping Places to StatisticalVariables and all available
       time series for each Place and StatisticalVariable pair.
@@ -200,18 +226,26 @@ def get_stat_all(places, stat_vars):
         }
       }
     """
-    url = utils._API_ROOT + utils._API_ENDPOINTS['get_stat_all']
-    req_json = {'stat_vars': stat_vars, 'places': places}
-
-    # Send the request
-    res_json = utils._send_request(url, req_json=req_json, use_payload=False)
+    places = list(places)
+    stat_vars = list(stat_vars)
 
-    if 'placeData' not in res_json:
-        raise ValueError('No data in response.')
+    def fetch(_, batch_places):
+        req_json = {'stat_vars': stat_vars, 'places': batch_places}
+        res_json = batch._send('get_stat_all', None, batch_places, req_json,
+                               use_payload=False)
+        if 'placeData' not in res_json:
+            raise ValueError('No data in response.')
+        return res_json['placeData']
 
     # Unnest the REST response for keys that have single-element values.
     place_statvar_series = collections.defaultdict(dict)
-    for place_dcid, place in res_json['placeData'].items():
-        for stat_var_dcid, stat_var in place['statVarData'].items():
-            place_statvar_series[place_dcid][stat_var_dcid] = stat_var
+    for _, _, place_data, failed in batch._run(
+            'get_stat_all', places, [None], fetch,
+            tolerate_errors=errors is not None, journal=journal,
+            params={'stat_vars': stat_vars}, progress=progress):
+        for place_dcid, place in place_data.items():
+            for stat_var_dcid, stat_var in place['statVarData'].items():
+                place_statvar_series[place_dcid][stat_var_dcid] = stat_var
+        if failed:
+            errors.update(failed)
     return dict(place_statvar_series)
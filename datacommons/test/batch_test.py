@@ -0,0 +1,213 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for the batching helpers in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  from unittest.mock import patch
+except ImportError:
+  from mock import patch
+
+import json
+import threading
+import time
+import unittest
+
+import datacommons as dc
+import datacommons.batch as batch
+import datacommons.utils as utils
+
+
+class TestChunks(unittest.TestCase):
+  """ Unit tests for _chunks. """
+
+  def test_chunks(self):
+    """ Items are split into consecutive lists of at most the given size. """
+    self.assertEqual(batch._chunks([1, 2, 3, 4, 5], 2), [[1, 2], [3, 4], [5]])
+    self.assertEqual(batch._chunks([], 2), [])
+    self.assertEqual(batch._chunks([1, 2], 0), [[1], [2]])
+
+
+class TestImap(unittest.TestCase):
+  """ Unit tests for _imap. """
+
+  def test_ordered(self):
+    """ Ordered mode yields results in input order. """
+    def slow_square(x):
+      time.sleep(0.01 * (5 - x))
+      return x * x
+    results = list(batch._imap(slow_square, range(5), ordered=True))
+    self.assertEqual(results, [(x, x * x) for x in range(5)])
+
+  def test_completion_order(self):
+    """ Unordered mode yields every result exactly once. """
+    results = list(batch._imap(lambda x: x + 1, range(20), max_workers=4))
+    self.assertEqual(sorted(results), [(x, x + 1) for x in range(20)])
+
+  def test_max_workers(self):
+    """ No more than max_workers calls are in flight at once. """
+    lock = threading.Lock()
+    state = {'current': 0, 'peak': 0}
+    def track(x):
+      with lock:
+        state['current'] += 1
+        state['peak'] = max(state['peak'], state['current'])
+      time.sleep(0.005)
+      with lock:
+        state['current'] -= 1
+      return x
+    list(batch._imap(track, range(30), max_workers=3))
+    self.assertLessEqual(state['peak'], 3)
+
+  def test_error(self):
+    """ Errors raised by the function propagate to the caller. """
+    def fail(x):
+      if x == 3:
+        raise ValueError('bad input')
+      return x
+    with self.assertRaises(ValueError):
+      list(batch._imap(fail, range(5)))
+
+
+class TestSendTolerant(unittest.TestCase):
+  """ Unit tests for _send_tolerant. """
+
+  def setUp(self):
+    self.save_retry_delay = utils._BATCH_RETRY_DELAY
+    utils._BATCH_RETRY_DELAY = 0
+
+  def tearDown(self):
+    utils._BATCH_RETRY_DELAY = self.save_retry_delay
+
+  def test_isolates_poison_dcids(self):
+    """ Failing batches are split until the failing dcids are isolated. """
+    calls = []
+    def fetch(key, dcids):
+      calls.append(list(dcids))
+      if 'bad1' in dcids or 'bad2' in dcids:
+        raise ValueError('poison')
+      return dict((dcid, key) for dcid in dcids)
+    dcids = ['a', 'bad1', 'b', 'c', 'd', 'e', 'bad2', 'f']
+    payload, failed = batch._send_tolerant(
+      fetch, 'k', dcids, batch._merge_dicts)
+    self.assertEqual(payload, dict((d, 'k') for d in 'abcdef'))
+    self.assertEqual(failed, {'bad1': 'poison', 'bad2': 'poison'})
+    # The full batch is retried before splitting.
+    self.assertEqual(calls[:3], [dcids] * 3)
+
+  def test_transient_failure(self):
+    """ A batch that fails once is retried without splitting. """
+    attempts = []
+    def fetch(key, dcids):
+      attempts.append(dcids)
+      if len(attempts) == 1:
+        raise ValueError('flaky')
+      return {'a': 1, 'b': 2}
+    payload, failed = batch._send_tolerant(
+      fetch, 'k', ['a', 'b'], batch._merge_dicts)
+    self.assertEqual(payload, {'a': 1, 'b': 2})
+    self.assertEqual(failed, {})
+    self.assertEqual(len(attempts), 2)
+
+  def test_all_fail(self):
+    """ A batch in which every dcid fails returns no payload. """
+    def fetch(key, dcids):
+      raise ValueError('down')
+    payload, failed = batch._send_tolerant(
+      fetch, 'k', ['a', 'b'], batch._merge_dicts, retries=0)
+    self.assertIsNone(payload)
+    self.assertEqual(failed, {'a': 'down', 'b': 'down'})
+
+
+class TestAdaptiveBatching(unittest.TestCase):
+  """ Unit tests for adaptive batch sizing. """
+
+  def tearDown(self):
+    dc.set_adaptive_batching(False)
+
+  def test_disabled(self):
+    """ Without adaptive batching, dcids are chunked once for all keys. """
+    save_batch_size = utils._QUERY_BATCH_SIZE
+    utils._QUERY_BATCH_SIZE = 2
+    plan = list(batch._plan('get_stats', ['a', 'b', 'c'], ['x', 'y']))
+    utils._QUERY_BATCH_SIZE = save_batch_size
+    self.assertEqual(plan, [
+      ('x', ['a', 'b']), ('y', ['a', 'b']), ('x', ['c']), ('y', ['c'])])
+
+  def test_grow_and_shrink(self):
+    """ Batch sizes grow on small fast responses and shrink on large ones. """
+    dc.set_adaptive_batching(min_size=10, max_size=1000, target_latency=1.0,
+                             target_bytes=1000)
+    sizer = batch._adaptive_sizer
+    start = sizer.size('get_stats', 'Count_Person')
+    self.assertEqual(start, min(1000, utils._QUERY_BATCH_SIZE))
+
+    # Tiny, fast responses double the batch size up to the bound.
+    for _ in range(5):
+      size = sizer.size('get_stats', 'Count_Person')
+      sizer.observe('get_stats', 'Count_Person', size, 0.01, size // 10)
+    self.assertEqual(sizer.size('get_stats', 'Count_Person'), 1000)
+
+    # Large responses halve the batch size down to the bound.
+    for _ in range(10):
+      size = sizer.size('get_stats', 'Count_Person')
+      sizer.observe('get_stats', 'Count_Person', size, 0.01, size * 1000)
+    self.assertEqual(sizer.size('get_stats', 'Count_Person'), 10)
+
+    # Sizes are learned separately per key.
+    self.assertEqual(sizer.size('get_stats', 'Median_Age_Person'), start)
+
+  def test_plan(self):
+    """ Adaptive plans chunk every key with its own learned size. """
+    dc.set_adaptive_batching(min_size=1, max_size=3)
+    batch._adaptive_sizer._sizes[('get_stats', 'y')] = 1
+    plan = list(batch._plan('get_stats', ['a', 'b', 'c'], ['x', 'y']))
+    self.assertEqual(plan, [
+      ('x', ['a', 'b', 'c']), ('y', ['a']), ('y', ['b']), ('y', ['c'])])
+    self.assertEqual(list(batch._plan('get_stats', [], ['x'])), [])
+
+  @patch('six.moves.urllib.request.urlopen')
+  def test_latency_excludes_throttling(self, urlopen):
+    """ Waiting for the rate limit is not observed as server latency. """
+    urlopen.return_value.read.return_value = json.dumps(
+      {'payload': json.dumps({})})
+    dc.set_adaptive_batching(min_size=1, max_size=1000)
+    dc.set_rate_limit(10)
+    latencies = []
+    try:
+      with patch.object(batch._adaptive_sizer, 'observe',
+                        side_effect=lambda *args: latencies.append(args[3])):
+        start = time.time()
+        for _ in range(3):
+          batch._send('get_stats', 'Count_Person', ['geoId/06'], {})
+    finally:
+      dc.set_rate_limit(None)
+    self.assertGreaterEqual(time.time() - start, 0.2)
+    self.assertEqual(len(latencies), 3)
+    self.assertLess(max(latencies), 0.05)
+
+  def test_bad_bounds(self):
+    """ Invalid bounds are rejected. """
+    with self.assertRaises(ValueError):
+      dc.set_adaptive_batching(min_size=10, max_size=5)
+
+
+if __name__ == '__main__':
+  unittest.main()
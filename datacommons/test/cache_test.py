@@ -0,0 +1,742 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for response caching in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import datacommons as dc
+import datacommons.cache as cache
+import datacommons.utils as utils
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+# The get_stat_series requests sent to the mock, and how it handles them.
+series_requests = []
+series_refresh = {}
+
+# The series the get_stats mock returns for every place.
+stats_series = {'2017': 1, '2018': 2}
+
+
+def request_mock(*args, **kwargs):
+  """ A mock urlopen in the urllib package. """
+  # Create the mock response object.
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  req = args[0]
+
+  # Mock responses for urlopen requests to get_stat_series, which count the
+  # requests made so far.
+  if req.get_full_url().startswith(
+      utils._API_ROOT + utils._API_ENDPOINTS['get_stat_series']):
+    series_requests.append(req.get_full_url())
+    if series_refresh.get('block'):
+      series_refresh['block'].wait()
+    if series_refresh.get('fail'):
+      raise ValueError('mixer down')
+    return MockResponse(json.dumps(
+      {'series': {'2018': len(series_requests)}}))
+
+  # Mock responses for urlopen requests to get_stat_value.
+  if req.get_full_url().startswith(
+      utils._API_ROOT + utils._API_ENDPOINTS['get_stat_value']):
+    return MockResponse(json.dumps({'value': 42}))
+
+  data = json.loads(req.data)
+
+  # Mock responses for urlopen requests to get_property_values.
+  if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_property_values']:
+    res_json = json.dumps(dict(
+      (dcid, {'out': [] if dcid == 'dc/MadDcid' else [{'value': dcid.upper()}]})
+      for dcid in data['dcids']))
+    return MockResponse(json.dumps({'payload': res_json}))
+
+  # Mock responses for urlopen requests to get_stats.
+  if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_stats']:
+    res_json = json.dumps(dict(
+      (place, {'data': dict(stats_series), 'place_name': place})
+      for place in data['place'] if place != 'dc/MadDcid'))
+    return MockResponse(json.dumps({'payload': res_json}))
+
+
+class TestMemoryCache(unittest.TestCase):
+  """ Unit tests for MemoryCache. """
+
+  def test_lru_entries(self):
+    """ The least recently used entry is evicted beyond max_entries. """
+    c = cache.MemoryCache(max_entries=2)
+    c.set(b'a', b'1', 'get_stats')
+    c.set(b'b', b'2', 'get_stats')
+    self.assertEqual(c.get(b'a', 'get_stats'), b'1')
+    c.set(b'c', b'3', 'get_stats')
+    self.assertIsNone(c.get(b'b', 'get_stats'))
+    self.assertEqual(c.get(b'a', 'get_stats'), b'1')
+    self.assertEqual(c.get(b'c', 'get_stats'), b'3')
+    self.assertEqual(len(c), 2)
+
+  def test_max_bytes(self):
+    """ Entries are evicted to keep the total size within max_bytes. """
+    c = cache.MemoryCache(max_bytes=10)
+    c.set(b'a', b'12345', 'get_stats')
+    c.set(b'b', b'12345', 'get_stats')
+    c.set(b'c', b'123', 'get_stats')
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+    self.assertEqual(c.bytes, 8)
+    # Values larger than the cache are not cached at all.
+    c.set(b'd', b'12345678901', 'get_stats')
+    self.assertIsNone(c.get(b'd', 'get_stats'))
+    self.assertEqual(c.bytes, 8)
+
+  def test_ttl(self):
+    """ Entries expire after the TTL of their endpoint. """
+    c = cache.MemoryCache(ttl=60, ttls={'get_stat_all': 0})
+    c.set(b'a', b'1', 'get_stat_all')
+    c.set(b'b', b'2', 'get_stats')
+    self.assertIsNone(c.get(b'a', 'get_stat_all'))
+    self.assertEqual(c.get(b'b', 'get_stats'), b'2')
+    self.assertEqual(c.bytes, 1)
+
+  def test_negative_ttl(self):
+    """ Negative entries expire after the shorter of both TTLs. """
+    c = cache.MemoryCache(ttl=60, negative_ttl=0)
+    c.set(b'a', b'null', 'get_stats', negative=True)
+    c.set(b'b', b'null', 'get_stats')
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+    self.assertEqual(c.get(b'b', 'get_stats'), b'null')
+    c = cache.MemoryCache(ttl=0, negative_ttl=60)
+    c.set(b'a', b'null', 'get_stats', negative=True)
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+
+  def test_key(self):
+    """ Keys ignore the order of dcids but not other fields. """
+    url = utils._API_ROOT + utils._API_ENDPOINTS['get_places_in']
+    key, endpoint = cache._key(
+      url, {'dcids': ['b', 'a'], 'place_type': 'City'}, True)
+    self.assertEqual(endpoint, 'get_places_in')
+    self.assertEqual(key, cache._key(
+      url, {'place_type': 'City', 'dcids': ['a', 'b']}, True)[0])
+    self.assertNotEqual(key, cache._key(
+      url, {'dcids': ['a', 'b'], 'place_type': 'County'}, True)[0])
+
+    url = utils._API_ROOT + utils._API_ENDPOINTS['get_stat_value']
+    self.assertEqual(
+      cache._key(url + '?place=geoId/06&stat_var=Count_Person', {}, False),
+      cache._key(url + '?stat_var=Count_Person&place=geoId/06', {}, False))
+
+
+class TestDiskCache(unittest.TestCase):
+  """ Unit tests for DiskCache. """
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'cache.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_get_set(self):
+    """ Entries persist across instances and are stored compressed. """
+    c = cache.DiskCache(self.path)
+    value = b'{"payload": "' + b'x' * 1000 + b'"}'
+    c.set(b'a', value, 'get_stats')
+    self.assertLess(c.bytes, len(value))
+    c.close()
+
+    c = cache.DiskCache(self.path)
+    self.assertEqual(c.get(b'a', 'get_stats'), value)
+    self.assertIsNone(c.get(b'b', 'get_stats'))
+    c.clear()
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+    self.assertEqual(c.bytes, 0)
+    c.close()
+
+  def test_ttl(self):
+    """ Entries expire after the TTL of their endpoint. """
+    c = cache.DiskCache(self.path, ttls={'get_stat_all': 0})
+    c.set(b'a', b'1', 'get_stat_all')
+    c.set(b'b', b'2', 'get_stats')
+    self.assertIsNone(c.get(b'a', 'get_stat_all'))
+    self.assertEqual(c.get(b'b', 'get_stats'), b'2')
+    self.assertEqual(len(c), 1)
+    c.close()
+
+  def test_lru(self):
+    """ Least recently used entries are evicted beyond max_bytes. """
+    save_resolution = cache._ACCESS_RESOLUTION
+    cache._ACCESS_RESOLUTION = -1
+    values = [os.urandom(100) for _ in range(3)]
+    c = cache.DiskCache(self.path, max_bytes=250)
+    c.set(b'a', values[0], 'get_stats')
+    c.set(b'b', values[1], 'get_stats')
+    c.get(b'a', 'get_stats')
+    c.set(b'c', values[2], 'get_stats')
+    self.assertEqual(c.get(b'a', 'get_stats'), values[0])
+    self.assertIsNone(c.get(b'b', 'get_stats'))
+    self.assertEqual(c.get(b'c', 'get_stats'), values[2])
+    self.assertLessEqual(c.bytes, 250)
+    c.close()
+    cache._ACCESS_RESOLUTION = save_resolution
+
+  def test_concurrent_writers(self):
+    """ Several connections can write to the same cache file at once. """
+    def write(n):
+      c = cache.DiskCache(self.path)
+      for i in range(20):
+        c.set('{}-{}'.format(n, i).encode('ascii'), b'v' * i, 'get_stats')
+      c.close()
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    c = cache.DiskCache(self.path)
+    self.assertEqual(len(c), 80)
+    self.assertEqual(c.get(b'3-19', 'get_stats'), b'v' * 19)
+    c.close()
+
+  def test_zlib(self):
+    """ Entries can be compressed with zlib. """
+    c = cache.DiskCache(self.path, compression='zlib')
+    value = b'{"payload": "' + b'x' * 1000 + b'"}'
+    c.set(b'a', value, 'get_stats')
+    self.assertLess(c.bytes, len(value))
+    self.assertEqual(c.get(b'a', 'get_stats'), value)
+    with self.assertRaises(ValueError):
+      cache.DiskCache(self.path, compression='lz4')
+    c.close()
+
+  @unittest.skipIf(cache.zstandard is None, 'zstandard is not installed')
+  def test_zstd_dictionary(self):
+    """ A zstd dictionary is trained on the first values and shared. """
+    save_samples = cache._ZSTD_DICT_SAMPLES
+    cache._ZSTD_DICT_SAMPLES = 64
+    try:
+      c = cache.DiskCache(self.path, compression='zstd')
+      values = [json.dumps({'geoId/{:02d}'.format(i): {
+        'data': dict((str(year), i * year) for year in range(2000, 2020)),
+        'place_name': 'Place {}'.format(i)}}).encode('utf-8')
+        for i in range(100)]
+      for i, value in enumerate(values):
+        c.set(str(i).encode('ascii'), value, 'get_stats')
+      self.assertIsNotNone(c._zstd_dict)
+      codecs = dict(c._conn.execute('SELECT key, codec FROM entries'))
+      self.assertEqual(codecs[b'0'], 'zstd')
+      self.assertEqual(codecs[b'99'], 'zstd-dict')
+      c.close()
+
+      c = cache.DiskCache(self.path)
+      for i, value in enumerate(values):
+        self.assertEqual(c.get(str(i).encode('ascii'), 'get_stats'), value)
+      c.close()
+    finally:
+      cache._ZSTD_DICT_SAMPLES = save_samples
+
+  @unittest.skipIf(cache.zstandard is None, 'zstandard is not installed')
+  def test_zstd_sample_bytes(self):
+    """ The samples held for training are capped in total size. """
+    save_bytes = cache._ZSTD_DICT_SAMPLE_BYTES
+    cache._ZSTD_DICT_SAMPLE_BYTES = 10000
+    sizes = []
+    train = cache.zstandard.train_dictionary
+    try:
+      with patch.object(cache.zstandard, 'train_dictionary',
+                        side_effect=lambda size, samples: (
+                          sizes.append([len(s) for s in samples]) or
+                          train(size, samples))):
+        c = cache.DiskCache(self.path, compression='zstd')
+        for i in range(20):
+          c.set(str(i).encode('ascii'), b'x' * 3000, 'get_stats')
+        c.close()
+    finally:
+      cache._ZSTD_DICT_SAMPLE_BYTES = save_bytes
+    self.assertEqual(sizes[0], [3000, 3000, 3000, 1000])
+
+  def test_undecodable(self):
+    """ Entries that cannot be decoded are misses. """
+    c = cache.DiskCache(self.path, compression='zlib')
+    c.set(b'a', b'1', 'get_stats')
+    c._conn.execute("UPDATE entries SET codec = 'unknown'")
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+    c.close()
+
+  def test_mmap(self):
+    """ Large entries are served from memory mapped files. """
+    c = cache.DiskCache(self.path, mmap_bytes=1000)
+    value = b'{"payload": "' + b'x' * 1000 + b'"}'
+    c.set(b'a', value, 'get_stats')
+    c.set(b'b', b'1', 'get_stats')
+    self.assertEqual(c.bytes, len(value) + len(c._encode(b'1')[1]))
+    mapped = c.get(b'a', 'get_stats')
+    self.assertIsInstance(mapped, mmap.mmap)
+    self.assertEqual(mapped[:], value)
+    mapped.close()
+    # Mapped values are decoded without a copy as bytes, and unmapped.
+    mapped = c.get(b'a', 'get_stats')
+    self.assertEqual(utils._mapped_text(mapped), value.decode('utf-8'))
+    with self.assertRaises(ValueError):
+      mapped[:]
+    self.assertEqual(c.get(b'b', 'get_stats'), b'1')
+
+    # Replacing and invalidating an entry removes its file.
+    c.set(b'a', b'2', 'get_stats')
+    self.assertEqual(os.listdir(c._files), [])
+    c.set(b'a', value, 'get_stats')
+    c.invalidate(endpoint='get_stats')
+    self.assertEqual(os.listdir(c._files), [])
+    c.set(b'a', value, 'get_stats')
+    c.clear()
+    self.assertFalse(os.path.exists(c._files))
+    self.assertIsNone(c.get(b'a', 'get_stats'))
+    c.close()
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_mmap_response(self, urlopen):
+    """ Responses served from memory mapped files are parsed as usual. """
+    c = cache.DiskCache(self.path, mmap_bytes=0)
+    dc.set_cache(c)
+    try:
+      expected = {'geoId/06': ['GEOID/06'], 'geoId/21': ['GEOID/21']}
+      self.assertDictEqual(
+        dc.get_property_values(['geoId/06', 'geoId/21'], 'name'), expected)
+      self.assertDictEqual(
+        dc.get_property_values(['geoId/06', 'geoId/21'], 'name'), expected)
+      self.assertEqual(1, urlopen.call_count)
+    finally:
+      dc.set_cache(None)
+      c.close()
+
+
+class TestSendRequestCache(unittest.TestCase):
+  """ Unit tests for caching in _send_request. """
+
+  def setUp(self):
+    dc.set_cache(dc.MemoryCache())
+
+  def tearDown(self):
+    dc.set_cache(None)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_hit(self, urlopen):
+    """ Repeated requests are served from the cache. """
+    expected = {'geoId/06': ['GEOID/06'], 'geoId/21': ['GEOID/21']}
+    self.assertDictEqual(
+      dc.get_property_values(['geoId/06', 'geoId/21'], 'name'), expected)
+    self.assertDictEqual(
+      dc.get_property_values(['geoId/21', 'geoId/06'], 'name'), expected)
+    self.assertEqual(1, urlopen.call_count)
+    dc.get_property_values(['geoId/06', 'geoId/21'], 'typeOf')
+    self.assertEqual(2, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_immutable(self, urlopen):
+    """ Results mutated by callers do not change cached entries. """
+    all_stats = dc.get_stats(['geoId/06'], 'Count_Person', 'all')
+    latest = dc.get_stats(['geoId/06'], 'Count_Person', 'latest')
+    self.assertEqual(latest['geoId/06']['data'], {'2018': 2})
+    all_stats['geoId/06']['data'].clear()
+    self.assertEqual(
+      dc.get_stats(['geoId/06'], 'Count_Person', 'all')['geoId/06']['data'],
+      {'2017': 1, '2018': 2})
+    self.assertEqual(1, urlopen.call_count)
+
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_no_series_per_place(self, urlopen):
+    """ Without per dcid caching, get_stats responses are not split into a
+    series per place.
+    """
+    places = ['geoId/{:02d}'.format(i) for i in range(20)]
+    for _ in range(2):
+      dc.get_stats(places, 'Count_Person')
+    self.assertEqual(1, urlopen.call_count)
+    self.assertEqual(list(utils._response_cache.stats()['endpoints']),
+                     ['get_stats'])
+
+
+class TestPerDcidCache(unittest.TestCase):
+  """ Unit tests for per dcid caching in list based wrappers. """
+
+  def setUp(self):
+    dc.set_cache(dc.MemoryCache(), per_dcid=True)
+    cache.reset_negative_hits()
+
+  def tearDown(self):
+    dc.set_cache(None)
+    cache.reset_negative_hits()
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_property_values(self, urlopen):
+    """ Overlapping calls only fetch the dcids not fetched before. """
+    self.assertDictEqual(
+      dc.get_property_values(['geoId/06', 'geoId/21'], 'name'),
+      {'geoId/06': ['GEOID/06'], 'geoId/21': ['GEOID/21']})
+    self.assertDictEqual(
+      dc.get_property_values(['geoId/21', 'geoId/24', 'geoId/06'], 'name'),
+      {'geoId/06': ['GEOID/06'], 'geoId/21': ['GEOID/21'],
+       'geoId/24': ['GEOID/24']})
+    self.assertEqual(2, urlopen.call_count)
+    self.assertEqual(json.loads(urlopen.call_args[0][0].data)['dcids'],
+                     ['geoId/24'])
+
+    # A fully cached call sends no request.
+    dc.get_property_values(['geoId/24', 'geoId/06'], 'name')
+    self.assertEqual(2, urlopen.call_count)
+
+    # Other arguments are cached separately.
+    dc.get_property_values(['geoId/06'], 'name', limit=10)
+    self.assertEqual(3, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_truncated(self, urlopen):
+    """ Results which may be truncated by the limit are not cached. """
+    dc.get_property_values(['geoId/06', 'geoId/21'], 'name', limit=2)
+    dc.get_property_values(['geoId/06', 'geoId/21'], 'name', limit=2)
+    self.assertEqual(2, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_no_limit(self, urlopen):
+    """ Results of requests without a limit are complete and cached. """
+    for _ in range(2):
+      self.assertDictEqual(
+        dc.get_property_values(['geoId/06'], 'name', limit=None),
+        {'geoId/06': ['GEOID/06']})
+    self.assertEqual(1, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_stats(self, urlopen):
+    """ Overlapping get_stats calls only fetch the places not fetched before.
+    """
+    dc.get_stats(['geoId/06', 'geoId/21'], 'Count_Person')
+    stats = dc.get_stats(['geoId/21', 'geoId/24'], ['Count_Person'], 'all')
+    self.assertEqual(sorted(stats['Count_Person']), ['geoId/21', 'geoId/24'])
+    self.assertEqual(stats['Count_Person']['geoId/21']['data'],
+                     {'2017': 1, '2018': 2})
+    self.assertEqual(2, urlopen.call_count)
+    self.assertEqual(json.loads(urlopen.call_args[0][0].data)['place'],
+                     ['geoId/24'])
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_negative(self, urlopen):
+    """ Dcids without a value are cached and their hits are counted. """
+    for _ in range(3):
+      self.assertDictEqual(
+        dc.get_property_values(['geoId/06', 'dc/MadDcid'], 'name'),
+        {'geoId/06': ['GEOID/06'], 'dc/MadDcid': []})
+      stats = dc.get_stats(['geoId/06', 'dc/MadDcid'], 'Count_Person')
+      self.assertEqual(sorted(stats), ['geoId/06'])
+    self.assertEqual(2, urlopen.call_count)
+    self.assertDictEqual(dc.negative_hits(), {
+      'get_property_values': {'dc/MadDcid': 2},
+      'get_stats': {'dc/MadDcid': 2}})
+    self.assertDictEqual(cache.negative_hits('get_stats'), {'dc/MadDcid': 2})
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_negative_ttl(self, urlopen):
+    """ Negative entries are refetched once their own TTL expires. """
+    dc.set_cache(dc.MemoryCache(negative_ttl=0), per_dcid=True)
+    dc.get_property_values(['geoId/06', 'dc/MadDcid'], 'name')
+    dc.get_property_values(['geoId/06', 'dc/MadDcid'], 'name')
+    self.assertEqual(2, urlopen.call_count)
+    self.assertEqual(json.loads(urlopen.call_args[0][0].data)['dcids'],
+                     ['dc/MadDcid'])
+    self.assertDictEqual(dc.negative_hits(), {})
+
+
+class TestIntrospection(unittest.TestCase):
+  """ Unit tests for cache statistics and invalidation. """
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    dc.set_cache(None)
+    shutil.rmtree(self.dir)
+
+  def caches(self):
+    yield cache.MemoryCache(max_entries=2)
+    disk = cache.DiskCache(os.path.join(self.dir, 'cache.db'), max_bytes=20)
+    try:
+      yield disk
+    finally:
+      disk.close()
+
+  def test_stats(self):
+    """ Hits, misses, evictions and resident entries are reported. """
+    for c in self.caches():
+      c.set(b'a', b'1', 'get_stats', tags=['geoId/06'])
+      c.set(b'b', b'2', 'get_stat_all')
+      c.set(b'c', b'3', 'get_stat_all')
+      c.get(b'a', 'get_stats')
+      c.get(b'b', 'get_stat_all')
+      stats = c.stats()
+      self.assertEqual(stats['entries'], 2)
+      self.assertEqual(stats['ages']['1m'], 2)
+      self.assertEqual(sum(stats['ages'].values()), 2)
+      self.assertEqual(
+        dict((k, stats['endpoints']['get_stats'][k])
+             for k in ('entries', 'hits', 'misses', 'evictions')),
+        {'entries': 0, 'hits': 0, 'misses': 1, 'evictions': 1})
+      self.assertEqual(
+        dict((k, stats['endpoints']['get_stat_all'][k])
+             for k in ('entries', 'hits', 'misses', 'evictions')),
+        {'entries': 2, 'hits': 1, 'misses': 0, 'evictions': 0})
+      self.assertEqual(stats['bytes'], c.bytes)
+
+  def test_invalidate(self):
+    """ Entries are removed by endpoint, dcid and stat var. """
+    for c in self.caches():
+      c.max_entries = c.max_bytes = 2**20
+      c.set(b'a', b'1', 'get_stats', tags=['geoId/06', 'Count_Person'])
+      c.set(b'b', b'2', 'get_stats', tags=['geoId/21', 'Count_Person'])
+      c.set(b'c', b'3', 'get_stat_all', tags=['geoId/06', 'Count_Person'])
+      c.set(b'd', b'4', 'get_stats', tags=['geoId/06', 'Median_Age_Person'])
+      self.assertEqual(c.invalidate(endpoint='get_stats', dcid='geoId/06',
+                                    stat_var='Count_Person'), 1)
+      self.assertIsNone(c.get(b'a', 'get_stats'))
+      self.assertEqual(c.invalidate(stat_var='Count_Person'), 2)
+      self.assertEqual(c.invalidate(endpoint='get_stats'), 1)
+      self.assertEqual(len(c), 0)
+      self.assertEqual(c.bytes, 0)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_request_tags(self, urlopen):
+    """ Cached responses are tagged with the dcids of their request. """
+    for per_dcid in (False, True):
+      dc.set_cache(dc.MemoryCache(), per_dcid=per_dcid)
+      urlopen.reset_mock()
+      dc.get_stats(['geoId/06', 'geoId/21'], 'Count_Person')
+      dc.get_property_values(['geoId/06'], 'name')
+      self.assertGreaterEqual(dc.invalidate(dcid='geoId/21'), 1)
+      dc.get_stats(['geoId/21'], 'Count_Person')
+      dc.get_property_values(['geoId/06'], 'name')
+      self.assertEqual(3, urlopen.call_count)
+      dc.invalidate(stat_var='Count_Person')
+      dc.get_stats(['geoId/06'], 'Count_Person')
+      dc.get_property_values(['geoId/06'], 'name')
+      self.assertEqual(4, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_invalidate_derived(self, urlopen):
+    """ Invalidating get_stats entries also removes the series kept from
+    them.
+    """
+    for c in self.caches():
+      c.max_entries = c.max_bytes = 2**20
+      dc.set_cache(c, per_dcid=True)
+      urlopen.reset_mock()
+      dc.get_stats(['geoId/06', 'geoId/21'], 'Count_Person')
+      self.assertGreaterEqual(
+        dc.invalidate(endpoint='get_stats', dcid='geoId/06'), 2)
+      dc.get_stats(['geoId/06'], 'Count_Person')
+      self.assertEqual(2, urlopen.call_count)
+      self.assertEqual(json.loads(urlopen.call_args[0][0].data)['place'],
+                       ['geoId/06'])
+      dc.get_stats(['geoId/21'], 'Count_Person')
+      self.assertEqual(2, urlopen.call_count)
+
+  def test_format_metrics(self):
+    """ Metrics are formatted in the Prometheus text format. """
+    self.assertEqual(cache.format_metrics(), '')
+    c = cache.MemoryCache()
+    c.set(b'a', b'12', 'get_stats')
+    c.get(b'a', 'get_stats')
+    dc.set_cache(c)
+    text = cache.format_metrics()
+    self.assertIn('datacommons_cache_bytes{endpoint="get_stats"} 2\n', text)
+    self.assertIn('datacommons_cache_hits{endpoint="get_stats"} 1\n', text)
+    self.assertIn('datacommons_cache_entry_age{le="1m"} 1\n', text)
+
+  def test_invalidate_needs_cache(self):
+    """ Invalidating without a cache is an error. """
+    with self.assertRaises(ValueError):
+      dc.invalidate(dcid='geoId/06')
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+  """ Unit tests for serving stale entries while refreshing them. """
+
+  def setUp(self):
+    del series_requests[:]
+    series_refresh.clear()
+    self.cache = dc.MemoryCache(ttl=60, soft_ttls={'get_stat_series': 0})
+    dc.set_cache(self.cache)
+
+  def tearDown(self):
+    dc.set_cache(None)
+
+  def wait_for_refresh(self):
+    while self.cache._refreshing:
+      time.sleep(0.001)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_serves_stale(self, urlopen):
+    """ Stale entries are returned at once and refreshed once. """
+    self.assertEqual(dc.get_stat_series('geoId/06', 'Count_Person'),
+                     {'2018': 1})
+    refresh = threading.Event()
+    series_refresh['block'] = refresh
+    for _ in range(3):
+      self.assertEqual(dc.get_stat_series('geoId/06', 'Count_Person'),
+                       {'2018': 1})
+    refresh.set()
+    self.wait_for_refresh()
+    self.assertEqual(len(series_requests), 2)
+    self.assertEqual(dc.get_stat_series('geoId/06', 'Count_Person'),
+                     {'2018': 2})
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_hard_ttl(self, urlopen):
+    """ Entries past their hard TTL are fetched in the foreground. """
+    dc.set_cache(dc.MemoryCache(ttl=0, soft_ttls={'get_stat_series': 0}))
+    dc.get_stat_series('geoId/06', 'Count_Person')
+    self.assertEqual(dc.get_stat_series('geoId/06', 'Count_Person'),
+                     {'2018': 2})
+
+  def test_failed_refresh(self):
+    """ Failed refreshes keep the stale entry for another TTL. """
+    c = cache.MemoryCache(ttl=0.05, soft_ttls={'get_stat_series': 0})
+    c.set(b'a', b'1', 'get_stat_series')
+    def load():
+      time.sleep(0.1)
+      raise ValueError('mixer down')
+    c.revalidate(b'a', 'get_stat_series', load).join()
+    self.assertEqual(c.lookup(b'a', 'get_stat_series'), (b'1', True))
+
+  def test_disk(self):
+    """ Disk caches serve stale entries too. """
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    try:
+      c = cache.DiskCache(path, soft_ttls={'get_stat_series': 0})
+      c.set(b'a', b'1', 'get_stat_series')
+      c.set(b'b', b'2', 'get_stats')
+      self.assertEqual(c.lookup(b'a', 'get_stat_series'), (b'1', True))
+      self.assertEqual(c.lookup(b'b', 'get_stats'), (b'2', False))
+      c.revalidate(b'a', 'get_stat_series', lambda: b'3').join()
+      self.assertEqual(c.get(b'a', 'get_stat_series'), b'3')
+      c.close()
+    finally:
+      shutil.rmtree(os.path.dirname(path))
+
+
+class TestDerivedStats(unittest.TestCase):
+  """ Unit tests for answering stat requests from cached series. """
+
+  def setUp(self):
+    del series_requests[:]
+    series_refresh.clear()
+    dc.set_cache(dc.MemoryCache(), per_dcid=True)
+
+  def tearDown(self):
+    dc.set_cache(None)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_value_from_series(self, urlopen):
+    """ get_stat_value reads dates and the latest value of cached series. """
+    dc.get_stat_series('geoId/06', 'Count_Person')
+    self.assertEqual(dc.get_stat_value('geoId/06', 'Count_Person'), 1)
+    self.assertEqual(
+      dc.get_stat_value('geoId/06', 'Count_Person', date='2018'), 1)
+    self.assertEqual(1, urlopen.call_count)
+
+    # Missing dates, places and other facets are fetched.
+    dc.get_stat_value('geoId/06', 'Count_Person', date='2010')
+    dc.get_stat_value('geoId/21', 'Count_Person')
+    dc.get_stat_value('geoId/06', 'Count_Person', unit='dcs:USDollar')
+    self.assertEqual(4, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_stats_from_stats(self, urlopen):
+    """ get_stats subsets and get_stat_value read cached get_stats series. """
+    dc.get_stats(['geoId/06', 'geoId/21'], 'Count_Person', 'all')
+    self.assertDictEqual(
+      dc.get_stats(['geoId/21'], 'Count_Person'),
+      {'geoId/21': {'data': {'2018': 2}, 'place_name': 'geoId/21'}})
+    self.assertDictEqual(
+      dc.get_stats(['geoId/06'], 'Count_Person', ['2017']),
+      {'geoId/06': {'data': {'2017': 1}, 'place_name': 'geoId/06'}})
+    self.assertEqual(
+      dc.get_stat_value('geoId/06', 'Count_Person', date='2017'), 1)
+    self.assertEqual(1, urlopen.call_count)
+
+    # Only places without a cached series are fetched.
+    dc.get_stats(['geoId/06', 'geoId/24'], 'Count_Person')
+    self.assertEqual(2, urlopen.call_count)
+    self.assertEqual(json.loads(urlopen.call_args[0][0].data)['place'],
+                     ['geoId/24'])
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_refresh(self, urlopen):
+    """ Refreshes merge and return only observations after the cached ones.
+    """
+    dc.get_stats(['geoId/06'], 'Count_Person', 'all')
+    stats_series.update({'2017': 5, '2019': 3})
+    try:
+      self.assertDictEqual(
+        dc.refresh_stats(['geoId/06', 'geoId/21'], 'Count_Person'),
+        {'geoId/06': {'2019': 3}, 'geoId/21': {'2017': 5, '2018': 2, '2019': 3}})
+      self.assertEqual(2, urlopen.call_count)
+      self.assertDictEqual(
+        dc.get_stats(['geoId/06'], 'Count_Person'),
+        {'geoId/06': {'data': {'2019': 3}, 'place_name': 'geoId/06'}})
+      self.assertEqual(
+        dc.get_stat_value('geoId/06', 'Count_Person', date='2017'), 1)
+      self.assertEqual(2, urlopen.call_count)
+      self.assertDictEqual(
+        dc.refresh_stats(['geoId/06'], ['Count_Person']), {'Count_Person': {}})
+    finally:
+      stats_series.pop('2019')
+      stats_series['2017'] = 1
+
+  def test_refresh_needs_cache(self):
+    """ Refreshing without a cache installed per dcid is an error. """
+    dc.set_cache(None)
+    with self.assertRaises(ValueError):
+      dc.refresh_stats(['geoId/06'], 'Count_Person')
+    # Without per dcid caching, no series are cached to refresh.
+    dc.set_cache(dc.MemoryCache())
+    with self.assertRaises(ValueError):
+      dc.refresh_stats(['geoId/06'], 'Count_Person')
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_stats_need_place_name(self, urlopen):
+    """ Series of get_stat_series lack the place name get_stats returns. """
+    dc.get_stat_series('geoId/06', 'Count_Person')
+    dc.get_stats(['geoId/06'], 'Count_Person')
+    self.assertEqual(2, urlopen.call_count)
+
+
+if __name__ == '__main__':
+  unittest.main()
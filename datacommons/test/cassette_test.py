@@ -0,0 +1,140 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for recording and replaying requests in the Data Commons Python
+API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import datacommons as dc
+import datacommons.cassette as cassette
+import datacommons.utils as utils
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import six
+import six.moves.urllib.error
+
+
+def request_mock(*args, **kwargs):
+  """ A mock urlopen in the urllib package. """
+  # Create the mock response object.
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  req = args[0]
+
+  # Mock responses for urlopen requests to get_stat_value.
+  if req.get_full_url().startswith(
+      utils._API_ROOT + utils._API_ENDPOINTS['get_stat_value']):
+    if 'dc/MadDcid' in req.get_full_url():
+      raise six.moves.urllib.error.HTTPError(
+        req.get_full_url(), 500, 'bad place', {}, six.BytesIO(b'bad place'))
+    return MockResponse(json.dumps({'value': 123}))
+
+  # Mock responses for urlopen requests to get_property_values.
+  data = json.loads(req.data)
+  res_json = json.dumps(dict(
+    (dcid, {'out': [{'value': dcid.upper()}]}) for dcid in data['dcids']))
+  return MockResponse(json.dumps({'payload': res_json}))
+
+
+def offline_mock(*args, **kwargs):
+  """ A mock urlopen failing every request. """
+  raise AssertionError('Unexpected request to {}'.format(
+    args[0].get_full_url()))
+
+
+class TestCassette(unittest.TestCase):
+  """ Unit tests for use_cassette. """
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'cassette.jsonl.gz')
+    self.save_api_key = os.environ.pop(utils._ENV_VAR_API_KEY, None)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+    os.environ.pop(utils._ENV_VAR_API_KEY, None)
+    if self.save_api_key is not None:
+      os.environ[utils._ENV_VAR_API_KEY] = self.save_api_key
+
+  def record(self):
+    with patch('six.moves.urllib.request.urlopen', side_effect=request_mock):
+      with dc.use_cassette(self.path, mode='record') as recorded:
+        dc.get_property_values(['geoId/06', 'geoId/21'], 'name')
+        dc.get_stat_value('geoId/06', 'Count_Person')
+        with self.assertRaises(ValueError):
+          dc.get_stat_value('dc/MadDcid', 'Count_Person')
+    self.assertEqual(len(recorded), 3)
+    self.assertIsNone(utils._cassette)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=offline_mock)
+  def test_replay(self, urlopen):
+    """ Recorded requests are replayed without network access. """
+    self.record()
+    dc.set_api_key('another-key')
+    with dc.use_cassette(self.path, strict=True):
+      self.assertDictEqual(
+        dc.get_property_values(['geoId/21', 'geoId/06'], 'name'),
+        {'geoId/06': ['GEOID/06'], 'geoId/21': ['GEOID/21']})
+      self.assertEqual(dc.get_stat_value('geoId/06', 'Count_Person'), 123)
+      with self.assertRaises(ValueError):
+        dc.get_stat_value('dc/MadDcid', 'Count_Person')
+    self.assertEqual(0, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=offline_mock)
+  def test_strict(self, urlopen):
+    """ Unrecorded requests fail in strict mode. """
+    self.record()
+    with dc.use_cassette(self.path, strict=True):
+      with self.assertRaises(ValueError) as e:
+        dc.get_property_values(['geoId/24'], 'name')
+    self.assertIn('No recorded response', str(e.exception))
+    self.assertEqual(0, urlopen.call_count)
+
+  def test_fallback(self):
+    """ Unrecorded requests are sent over the network unless strict. """
+    self.record()
+    with patch('six.moves.urllib.request.urlopen',
+               side_effect=request_mock) as urlopen:
+      with dc.use_cassette(self.path):
+        dc.get_property_values(['geoId/24'], 'name')
+        dc.get_stat_value('geoId/06', 'Count_Person')
+    self.assertEqual(1, urlopen.call_count)
+
+  def test_bad_mode(self):
+    """ Unknown modes are rejected. """
+    with self.assertRaises(ValueError):
+      cassette.Cassette(self.path, mode='rewind')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -28,6 +28,7 @@ except ImportError:
 import six.moves.urllib as urllib
 
 import datacommons as dc
+import datacommons.core as core
 import datacommons.utils as utils
 import json
 import unittest
@@ -313,6 +314,36 @@ def request_mock(*args, **kwargs):
   # Otherwise, return an empty response and a 404.
   return urllib.error.HTTPError
 
+# The types and property labels of the nodes served by typed_request_mock.
+TYPES = {
+  'geoId/06085': 'County',
+  'geoId/24031': 'County',
+  'geoId/0649670': 'City',
+}
+LABELS = {
+  'geoId/06085': {'inLabels': ['containedInPlace'], 'outLabels': ['name']},
+  'geoId/24031': {'inLabels': ['containedInPlace'], 'outLabels': ['name']},
+  'geoId/0649670': {'inLabels': [], 'outLabels': ['name', 'typeOf']},
+  'dc/Untyped': {'inLabels': ['member'], 'outLabels': []},
+}
+
+
+def typed_request_mock(*args, **kwargs):
+  """ A mock urlopen serving the property labels of nodes, those of
+  geoId/06085 for nodes not in LABELS.
+  """
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  data = json.loads(args[0].data)
+  res = dict((dcid, LABELS.get(dcid, LABELS['geoId/06085']))
+             for dcid in data['dcids'])
+  return MockResponse(json.dumps({'payload': json.dumps(res)}))
+
 
 class TestGetPropertyLabels(unittest.TestCase):
   """ Unit tests for get_property_labels. """
@@ -381,6 +412,97 @@ class TestGetPropertyLabels(unittest.TestCase):
     in_props = dc.get_property_labels([], out=False)
     self.assertDictEqual(in_props, {})
 
+  @patch('six.moves.urllib.request.urlopen', side_effect=typed_request_mock)
+  def test_both_directions(self, urlopen_mock):
+    """ Both directions are returned from a single request. """
+    labels = dc.get_property_labels(['geoId/06085', 'dc/Untyped'], out=None)
+    self.assertDictEqual(labels, {
+      'geoId/06085': {'out': ['name'], 'in': ['containedInPlace']},
+      'dc/Untyped': {'out': [], 'in': ['member']},
+    })
+    self.assertEqual(urlopen_mock.call_count, 1)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=typed_request_mock)
+  def test_types(self, urlopen_mock):
+    """ Labels are fetched once per type. """
+    type_cache = {}
+    dcids = ['geoId/06085', 'geoId/24031', 'geoId/0649670', 'dc/Untyped']
+    labels = dc.get_property_labels(dcids, types=TYPES, type_cache=type_cache)
+    self.assertDictEqual(labels, dict(
+      (dcid, LABELS[dcid]['outLabels']) for dcid in dcids))
+    self.assertEqual(json.loads(urlopen_mock.call_args[0][0].data)['dcids'],
+                     ['geoId/06085', 'geoId/0649670', 'dc/Untyped'])
+    self.assertEqual(sorted(type_cache), ['City', 'County'])
+
+    # Cached types need no requests at all.
+    labels = dc.get_property_labels(['geoId/24031'], out=False, types=TYPES,
+                                    type_cache=type_cache)
+    self.assertDictEqual(labels, {'geoId/24031': ['containedInPlace']})
+    self.assertEqual(urlopen_mock.call_count, 1)
+
+    with self.assertRaises(ValueError):
+      dc.get_property_labels(dcids, type_cache=type_cache)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=typed_request_mock)
+  def test_types_requests(self, urlopen_mock):
+    """ Nodes of one type take a single request, and none once cached. """
+    dcids = ['dc/{:04d}'.format(i) for i in range(1000)]
+    dc.get_property_labels(dcids)
+    self.assertEqual(urlopen_mock.call_count, 2)
+
+    types = dict((dcid, 'County') for dcid in dcids)
+    type_cache = {}
+    labels = dc.get_property_labels(dcids, types=types, type_cache=type_cache)
+    self.assertDictEqual(labels, dict((dcid, ['name']) for dcid in dcids))
+    self.assertEqual(urlopen_mock.call_count, 3)
+    dc.get_property_labels(dcids, types=types, type_cache=type_cache)
+    self.assertEqual(urlopen_mock.call_count, 3)
+
+
+# The children of the nodes served by paged_request_mock.
+CHILDREN = {
+  'geoId/06': ['geoId/06{:03d}'.format(i) for i in range(250)],
+  'geoId/21': ['geoId/21{:03d}'.format(i) for i in range(30)],
+  'geoId/24': [],
+}
+
+
+def children(dcid):
+  """ Returns the children of CHILDREN, or a single child for other nodes
+  under dc/.
+  """
+  if dcid.startswith('dc/'):
+    return [dcid + '/child']
+  return CHILDREN.get(dcid, [])
+
+
+def paged_request_mock(*args, **kwargs):
+  """ A mock urlopen applying the limit of get_property_values and
+  get_triples to the values of all nodes of a request together.
+  """
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  req = args[0]
+  data = json.loads(req.data)
+  triples = req.get_full_url() == (
+    utils._API_ROOT + utils._API_ENDPOINTS['get_triples'])
+  remaining = data['limit']
+  res = {}
+  for dcid in data['dcids']:
+    values = children(dcid)[:remaining]
+    remaining -= len(values)
+    if triples:
+      res[dcid] = [{'subjectId': value, 'predicate': 'containedInPlace',
+                    'objectId': dcid} for value in values]
+    else:
+      res[dcid] = {'in': [{'dcid': value} for value in values]}
+  return MockResponse(json.dumps({'payload': json.dumps(res)}))
+
 
 class TestGetPropertyValues(unittest.TestCase):
   """ Unit tests for get_property_values. """
@@ -467,6 +589,131 @@ class TestGetPropertyValues(unittest.TestCase):
     prop_vals = dc.get_property_values([], 'containedInPlace')
     self.assertDictEqual(prop_vals, {})
 
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_unsorted(self, urlopen_mock):
+    """ Values keep the order of the response when sorting is disabled. """
+    towns = dc.get_property_values(['geoId/06085', 'geoId/24031'],
+                                   'containedInPlace', out=False,
+                                   value_type='Town', sort=False)
+    self.assertDictEqual(towns, {
+      'geoId/06085': ['geoId/0644112', 'geoId/0643294'],
+      'geoId/24031': ['geoId/2462850']
+    })
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_paginate(self, urlopen_mock):
+    """ Paginated calls return all values of every node. """
+    dcids = ['geoId/06', 'geoId/21', 'geoId/24']
+    truncated = dc.get_property_values(dcids, 'containedInPlace', out=False)
+    self.assertEqual(sum(len(v) for v in truncated.values()), 100)
+
+    children = dc.get_property_values(dcids, 'containedInPlace', out=False,
+                                      limit=None, paginate=True)
+    self.assertDictEqual(children, CHILDREN)
+
+    # Limits apply per node.
+    children = dc.get_property_values(dcids, 'containedInPlace', out=False,
+                                      limit=40, paginate=True)
+    self.assertDictEqual(dict((k, len(v)) for k, v in children.items()),
+                         {'geoId/06': 40, 'geoId/21': 30, 'geoId/24': 0})
+
+
+class TestIterPropertyValues(unittest.TestCase):
+  """ Unit tests for iter_property_values. """
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_stream(self, urlopen_mock):
+    """ Values are yielded once each, batches first. """
+    values = list(dc.iter_property_values(
+      ['geoId/06', 'geoId/21', 'geoId/06'], 'containedInPlace', out=False))
+    self.assertEqual(len(values), len(set(values)))
+    self.assertEqual(sorted(values), sorted(
+      [('geoId/06', v) for v in CHILDREN['geoId/06']] +
+      [('geoId/21', v) for v in CHILDREN['geoId/21']]))
+    self.assertEqual(values[:100],
+                     [('geoId/06', v) for v in CHILDREN['geoId/06'][:100]])
+
+    # The batch is split, then geoId/06 is fetched with a limit of 400.
+    limits = [json.loads(call[0][0].data)['limit']
+              for call in urlopen_mock.call_args_list]
+    self.assertEqual(limits, [200, 200, 200, 400])
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_few_values(self, urlopen_mock):
+    """ Nodes with few values are fetched in one request per batch. """
+    dcids = ['dc/{:04d}'.format(i) for i in range(1000)]
+    values = list(dc.iter_property_values(dcids, 'containedInPlace',
+                                          out=False))
+    self.assertEqual(sorted(values),
+                     [(dcid, dcid + '/child') for dcid in dcids])
+    self.assertEqual(urlopen_mock.call_count, 2)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_no_dcids(self, urlopen_mock):
+    """ No dcids yield no values. """
+    self.assertEqual(
+      list(dc.iter_property_values([], 'containedInPlace', out=False)), [])
+    self.assertEqual(urlopen_mock.call_count, 0)
+
+class TestGetProperties(unittest.TestCase):
+  """ Unit tests for get_properties. """
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_multiple_properties(self, urlopen_mock):
+    """ Calling get_properties returns the values of every property. """
+    dcids = ['geoId/06085', 'geoId/24031', 'geoId/06085', float('nan')]
+    props = dc.get_properties(dcids, ['name', 'madProperty'])
+    self.assertDictEqual(props, {
+      'geoId/06085': {'name': ['Santa Clara County'], 'madProperty': []},
+      'geoId/24031': {'name': ['Montgomery County'], 'madProperty': []},
+    })
+    # One request is sent per property, with the dcids deduplicated.
+    self.assertEqual(urlopen_mock.call_count, 2)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_limit_per_node(self, urlopen_mock):
+    """ Limits apply per node, however many nodes share a request. """
+    dcids = ['dc/{:04d}'.format(i) for i in range(1000)]
+    props = dc.get_properties(dcids, ['containedInPlace'], out=False)
+    self.assertDictEqual(props, dict(
+      (dcid, {'containedInPlace': [dcid + '/child']}) for dcid in dcids))
+    self.assertEqual(urlopen_mock.call_count, 2)
+
+    dcids = list(CHILDREN)
+    props = dc.get_properties(dcids, ['containedInPlace'], out=False,
+                              limit=None)
+    self.assertDictEqual(props, dict(
+      (dcid, {'containedInPlace': sorted(CHILDREN[dcid])})
+      for dcid in dcids))
+    props = dc.get_properties(dcids, ['containedInPlace'], out=False,
+                              limit=40)
+    self.assertDictEqual(
+      dict((dcid, len(props[dcid]['containedInPlace'])) for dcid in dcids),
+      {'geoId/06': 40, 'geoId/21': 30, 'geoId/24': 0})
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_no_dcids(self, urlopen_mock):
+    """ Calling get_properties with no dcids returns empty results. """
+    self.assertDictEqual(dc.get_properties([], ['name']), {})
+    self.assertEqual(urlopen_mock.call_count, 0)
+
+  @unittest.skipIf(core.pandas is None, 'pandas is not installed')
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_as_frame(self, urlopen_mock):
+    """ Results can be returned as a DataFrame. """
+    frame = dc.get_properties(['geoId/06085', 'geoId/24031'],
+                              ['name', 'madProperty'], as_frame=True)
+    self.assertEqual(list(frame.index), ['geoId/06085', 'geoId/24031'])
+    self.assertEqual(list(frame.columns), ['name', 'madProperty'])
+    self.assertEqual(frame.loc['geoId/24031', 'name'], ['Montgomery County'])
+
+  @patch('datacommons.core.pandas', None)
+  def test_as_frame_without_pandas(self):
+    """ DataFrames cannot be returned without pandas. """
+    with self.assertRaises(ValueError):
+      dc.get_properties(['geoId/06085'], ['name'], as_frame=True)
+
+
 class TestGetTriples(unittest.TestCase):
   """ Unit tests for get_triples. """
 
@@ -488,6 +735,19 @@ class TestGetTriples(unittest.TestCase):
       ]
     })
 
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_compact(self, urlopen_mock):
+    """ Compact triples share one string table and compare as lists. """
+    expected = dc.get_triples(['geoId/06085', 'geoId/24031'])
+    triples = dc.get_triples(['geoId/06085', 'geoId/24031'], compact=True)
+    self.assertEqual(triples, expected)
+    self.assertEqual(triples['geoId/24031'][0],
+                     ('geoId/24031', 'name', 'Montgomery County'))
+    self.assertEqual(triples['geoId/06085'][-2:],
+                     expected['geoId/06085'][-2:])
+    self.assertIs(triples['geoId/06085']._interner,
+                  triples['geoId/24031']._interner)
+
   @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
   def test_bad_dcids(self, urlopen_mock):
     """ Calling get_triples with dcids that do not exist returns empty
@@ -519,5 +779,59 @@ class TestGetTriples(unittest.TestCase):
     self.assertDictEqual(triples_1, {})
 
 
+class TestIterTriples(unittest.TestCase):
+  """ Unit tests for iter_triples. """
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_stream(self, urlopen_mock):
+    """ All triples of every node are yielded once. """
+    triples = list(dc.iter_triples(['geoId/06', 'geoId/21', 'geoId/24']))
+    self.assertEqual(sorted(triples), sorted(
+      (child, 'containedInPlace', dcid)
+      for dcid, children in CHILDREN.items() for child in children))
+    # The first page is sized to hold 100 triples of each node.
+    self.assertEqual(urlopen_mock.call_count, 1)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_limit(self, urlopen_mock):
+    """ Limits apply per node. """
+    triples = list(dc.iter_triples(['geoId/06', 'geoId/21'], limit=120))
+    self.assertEqual(
+      sum(1 for triple in triples if triple[2] == 'geoId/06'), 120)
+    self.assertEqual(
+      sum(1 for triple in triples if triple[2] == 'geoId/21'), 30)
+
+
+class TestPagesCache(unittest.TestCase):
+  """ Unit tests for caching the pages of paginated calls. """
+
+  def setUp(self):
+    dc.set_cache(dc.MemoryCache(), per_dcid=True)
+
+  def tearDown(self):
+    dc.set_cache(None)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=paged_request_mock)
+  def test_per_dcid(self, urlopen_mock):
+    """ Pages are cached per request even with per dcid caching, since they
+    are not batched per dcid.
+    """
+    dcids = list(CHILDREN)
+
+    def calls():
+      return (
+        dc.get_property_values(dcids, 'containedInPlace', out=False,
+                               limit=None, paginate=True),
+        list(dc.iter_property_values(dcids, 'containedInPlace', out=False)),
+        list(dc.iter_triples(dcids, limit=None)),
+        dc.traverse(['geoId/21'], ['<-containedInPlace']))
+
+    results = calls()
+    requests = urlopen_mock.call_count
+    self.assertEqual(len(results[0]['geoId/06']), 250)
+    self.assertEqual(calls(), results)
+    self.assertEqual(urlopen_mock.call_count, requests)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,150 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for the local triple store in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import datacommons as dc
+import datacommons.graph as graph
+import itertools
+import unittest
+
+TRIPLES = [
+  ('geoId/06085', 'containedInPlace', 'geoId/06'),
+  ('geoId/06001', 'containedInPlace', 'geoId/06'),
+  ('geoId/06', 'containedInPlace', 'country/USA'),
+  ('geoId/06', 'name', 'California'),
+  ('geoId/06085', 'name', 'Santa Clara County'),
+  ('geoId/06', 'typeOf', 'State'),
+]
+
+
+class TestTripleStore(unittest.TestCase):
+  """ Unit tests for TripleStore. """
+
+  def setUp(self):
+    self.store = dc.TripleStore()
+    self.store.add_triples({'geoId/06': TRIPLES, 'geoId/06085': TRIPLES[:1]})
+
+  def test_match(self):
+    """ Every combination of bound components matches the right triples. """
+    self.assertEqual(len(self.store), len(TRIPLES))
+    for triple in TRIPLES:
+      for bound in itertools.product([False, True], repeat=3):
+        pattern = [term if b else None for term, b in zip(triple, bound)]
+        expected = sorted(t for t in TRIPLES if all(
+          term is None or term == value for term, value in zip(pattern, t)))
+        self.assertEqual(sorted(self.store.match(*pattern)), expected)
+    self.assertEqual(list(self.store.match(s='geoId/24')), [])
+    self.assertEqual(self.store.count(p='containedInPlace', o='geoId/06'), 2)
+
+  def test_add_after_lookup(self):
+    """ Triples added after a lookup are merged into the indexes. """
+    self.assertEqual(self.store.count(p='typeOf'), 1)
+    self.store.add('geoId/24', 'typeOf', 'State')
+    self.assertEqual(sorted(self.store.match(o='State')),
+                     [('geoId/06', 'typeOf', 'State'),
+                      ('geoId/24', 'typeOf', 'State')])
+
+  def test_wrapper_results(self):
+    """ Property values are added in the direction they were fetched in. """
+    store = dc.TripleStore()
+    store.add_property_values({'geoId/06': ['geoId/06085', 'geoId/06001']},
+                              'containedInPlace', out=False)
+    store.add_properties({'geoId/06085': {'name': ['Santa Clara County']}})
+    self.assertEqual(sorted(store.match(p='containedInPlace')), [
+      ('geoId/06001', 'containedInPlace', 'geoId/06'),
+      ('geoId/06085', 'containedInPlace', 'geoId/06'),
+    ])
+    self.assertEqual(list(store.match(s='geoId/06085', p='name')),
+                     [('geoId/06085', 'name', 'Santa Clara County')])
+
+  def test_budget(self):
+    """ Triples beyond the memory budget are rejected. """
+    # The budget fits TRIPLES, including the copies made to merge them.
+    full = dc.TripleStore()
+    full.add_triples(TRIPLES)
+    store = dc.TripleStore(max_bytes=full.nbytes)
+    store.add_triples(TRIPLES)
+    with self.assertRaises(ValueError):
+      store.add('geoId/24', 'name', 'Maryland')
+    self.assertEqual(len(store), len(TRIPLES))
+    self.assertLessEqual(store.nbytes, store.max_bytes)
+
+    # Bulk adds beyond the budget add the triples that fit.
+    store = dc.TripleStore(max_bytes=full.nbytes)
+    with self.assertRaises(ValueError):
+      store.add_triples(TRIPLES + [('geoId/24', 'name', 'Maryland')])
+    self.assertEqual(sorted(store.match()), sorted(TRIPLES))
+
+  def test_merge(self):
+    """ Triples merged in several rounds match those of a single merge. """
+    triples = [('dc/{}'.format(i % 50), 'p{}'.format(i % 7),
+                'dc/{}'.format(i % 31)) for i in range(2000)]
+    expected = sorted(set(triples))
+    store = dc.TripleStore()
+    for start in range(0, len(triples), 300):
+      store.add_triples(triples[start:start + 300])
+      self.assertEqual(len(store), len(set(triples[:start + 300])))
+    self.assertEqual(sorted(store.match()), expected)
+    for order in (graph._SPO, graph._POS, graph._OSP):
+      rows = list(zip(*store._index(order)))
+      self.assertEqual(rows, sorted(set(rows)))
+    self.assertEqual(sorted(store.match(p='p3', o='dc/5')),
+                     [t for t in expected if t[1:] == ('p3', 'dc/5')])
+
+  def test_merge_due(self):
+    """ Pending triples are merged once they are a quarter of the store. """
+    store = dc.TripleStore()
+    store.add_triples(('dc/{}'.format(i), 'p', 'o')
+                      for i in range(graph._MIN_MERGE))
+    self.assertEqual(len(store._pending[0]), 0)
+    self.assertEqual(len(store._indexes[graph._SPO][0]), graph._MIN_MERGE)
+    store.add('dc/new', 'p', 'o')
+    self.assertEqual(len(store._pending[0]), 1)
+
+
+class TestTripleList(unittest.TestCase):
+  """ Unit tests for TripleList. """
+
+  def test_list(self):
+    """ Triple lists behave like lists of tuples. """
+    triples = graph.TripleList()
+    for triple in TRIPLES:
+      triples.append(*triple)
+    self.assertEqual(len(triples), len(TRIPLES))
+    self.assertEqual(triples, TRIPLES)
+    self.assertNotEqual(triples, TRIPLES[1:])
+    self.assertEqual(triples[1], TRIPLES[1])
+    self.assertEqual(triples[-1], TRIPLES[-1])
+    self.assertEqual(triples[::2], TRIPLES[::2])
+    self.assertIs(triples[1:]._interner, triples._interner)
+    # Every string is held once.
+    self.assertEqual(len(triples._interner), 10)
+
+    # Lists extended in bulk share the string table.
+    extended = graph.TripleList(triples._interner)
+    extended.extend([])
+    extended.extend(TRIPLES)
+    self.assertEqual(extended, triples)
+    self.assertEqual(len(triples._interner), 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for the checkpoint journal in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import datacommons.batch as batch
+import datacommons.journal as journal_lib
+
+
+class TestJournal(unittest.TestCase):
+  """ Unit tests for Journal. """
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'journal.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+
+  def test_record_lookup(self):
+    """ Recorded dcids are found again after reopening the journal. """
+    journal = journal_lib.Journal(self.path)
+    call = journal_lib._call_key('get_stats', {'unit': 'Inch'})
+    journal.record(call, 'Count_Person', ['geoId/05', 'dc/MadDcid'],
+                   {'geoId/05': {'data': {'2018': 1}}})
+    journal.close()
+
+    journal = journal_lib.Journal(self.path)
+    self.assertEqual(
+      journal.lookup(call, 'Count_Person', ['geoId/05', 'dc/MadDcid', 'geoId/06']),
+      {'geoId/05': {'data': {'2018': 1}}, 'dc/MadDcid': None})
+    self.assertEqual(journal.lookup(call, 'Median_Age_Person', ['geoId/05']), {})
+    other_call = journal_lib._call_key('get_stats', {})
+    self.assertEqual(journal.lookup(other_call, 'Count_Person', ['geoId/05']), {})
+
+    journal.clear()
+    self.assertEqual(journal.lookup(call, 'Count_Person', ['geoId/05']), {})
+    journal.close()
+
+  def test_get_put(self):
+    """ Unbatched calls store their whole payload. """
+    journal = journal_lib.Journal(self.path)
+    call = journal_lib._call_key('get_place_obs', {'place_type': 'City'})
+    self.assertIsNone(journal.get(call))
+    journal.put(call, [{'place': 'geoId/4247344'}])
+    self.assertEqual(journal.get(call), [{'place': 'geoId/4247344'}])
+    journal.close()
+
+  def test_resume(self):
+    """ A rerun of a batched call only fetches dcids not completed before. """
+    state = {'fetched': [], 'interrupt': True}
+    def fetch(key, dcids):
+      state['fetched'].extend(dcids)
+      if state['interrupt'] and 'c' in dcids:
+        raise ValueError('interrupted')
+      return dict((dcid, key) for dcid in dcids)
+
+    def run():
+      result = {}
+      for _, _, payload, _ in batch._run(
+          'get_stats', ['a', 'b', 'c', 'd'], ['x'], fetch, journal=self.path,
+          params={}):
+        result.update(payload)
+      return result
+
+    save_batch_size = batch.utils._QUERY_BATCH_SIZE
+    save_max_concurrent = batch.utils._MAX_CONCURRENT_REQUESTS
+    batch.utils._QUERY_BATCH_SIZE = 2
+    batch.utils._MAX_CONCURRENT_REQUESTS = 1
+
+    with self.assertRaises(ValueError):
+      run()
+    self.assertEqual(state['fetched'], ['a', 'b', 'c', 'd'])
+
+    state['fetched'] = []
+    state['interrupt'] = False
+    self.assertEqual(run(), {'a': 'x', 'b': 'x', 'c': 'x', 'd': 'x'})
+    self.assertEqual(state['fetched'], ['c', 'd'])
+
+    batch.utils._QUERY_BATCH_SIZE = save_batch_size
+    batch.utils._MAX_CONCURRENT_REQUESTS = save_max_concurrent
+
+if __name__ == '__main__':
+  unittest.main()
@@ -28,9 +28,22 @@ except ImportError:
 import datacommons as dc
 import datacommons.utils as utils
 import json
+import six
 import unittest
 import six.moves.urllib as urllib
 
+# Per-place responses of get_stats for Count_Person.
+COUNT_PERSON = {
+  'geoId/05': {
+    'data': {'2017': 3004279, '2018': 3013825},
+    'place_name': 'Arkansas'
+  },
+  'geoId/06': {
+    'data': {'2017': 39536653, '2018': 39557045},
+    'place_name': 'California'
+  },
+}
+
 
 def request_mock(*args, **kwargs):
   """ A mock urlopen requests sent in the requests package. """
@@ -88,6 +101,18 @@ def request_mock(*args, **kwargs):
 
   # Mock responses for urlopen requests to get_stats.
   if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_stats']:
+    if data['stats_var'] == 'Count_Person':
+      if 'dc/PoisonDcid' in data['place']:
+        # Any batch containing this dcid makes the mixer fail.
+        raise urllib.error.HTTPError(
+          req.get_full_url(), 500, 'Internal Server Error', {},
+          six.BytesIO(b'poison'))
+      # Response built per place so any batching of places is supported.
+      res_json = json.dumps({
+        place: COUNT_PERSON[place] for place in data['place']
+        if place in COUNT_PERSON
+      })
+      return MockResponse(json.dumps({'payload': res_json}))
     if (data['place'] == ['geoId/05', 'geoId/06'] and
         data['stats_var'] == 'dc/0hyp6tkn18vcb'):
       # Response returned when querying for multiple valid dcids.
@@ -468,6 +493,158 @@ class TestGetStats(unittest.TestCase):
 
     dc.utils._QUERY_BATCH_SIZE = save_batch_size
 
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_multiple_stats_vars(self, mock_urlopen):
+    """ Calling get_stats with a list of stats vars returns results keyed by
+      stats var and sends one request per place batch and stats var.
+    """
+    save_batch_size = dc.utils._QUERY_BATCH_SIZE
+    dc.utils._QUERY_BATCH_SIZE = 1
+
+    stats = dc.get_stats(['geoId/05', 'geoId/06'],
+                         ['dc/0hyp6tkn18vcb', 'Count_Person'], 'latest')
+    self.assertDictEqual(
+        stats, {
+            'dc/0hyp6tkn18vcb': {
+                'geoId/05': {
+                    'data': {
+                        '2018': 18003
+                    },
+                    'place_name': 'Arkansas'
+                },
+                'geoId/06': {
+                    'data': {
+                        '2018': 366331
+                    },
+                    'place_name': 'California'
+                }
+            },
+            'Count_Person': {
+                'geoId/05': {
+                    'data': {
+                        '2018': 3013825
+                    },
+                    'place_name': 'Arkansas'
+                },
+                'geoId/06': {
+                    'data': {
+                        '2018': 39557045
+                    },
+                    'place_name': 'California'
+                }
+            },
+        })
+    self.assertEqual(4, mock_urlopen.call_count)
+
+    dc.utils._QUERY_BATCH_SIZE = save_batch_size
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_obs_dates_iterator(self, mock_urlopen):
+    """ Dates given as an iterator filter every batch and stats var. """
+    save_batch_size = dc.utils._QUERY_BATCH_SIZE
+    dc.utils._QUERY_BATCH_SIZE = 1
+
+    stats = dc.get_stats(['geoId/05', 'geoId/06'],
+                         ['dc/0hyp6tkn18vcb', 'Count_Person'],
+                         (date for date in ['2017']))
+    self.assertEqual(stats['Count_Person']['geoId/05']['data'],
+                     {'2017': 3004279})
+    self.assertEqual(stats['Count_Person']['geoId/06']['data'],
+                     {'2017': 39536653})
+    records = dc.iter_stats(['geoId/05', 'geoId/06'], 'Count_Person',
+                            iter(['2018']))
+    self.assertDictEqual(
+      dict((place, s['data']) for place, s in records),
+      {'geoId/05': {'2018': 3013825}, 'geoId/06': {'2018': 39557045}})
+
+    dc.utils._QUERY_BATCH_SIZE = save_batch_size
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_errors(self, mock_urlopen):
+    """ Calling get_stats with errors isolates failing places and returns the
+      results of all other places.
+    """
+    save_retry_delay = dc.utils._BATCH_RETRY_DELAY
+    dc.utils._BATCH_RETRY_DELAY = 0
+
+    # Without errors, a failing batch raises.
+    with self.assertRaises(ValueError):
+      dc.get_stats(['geoId/05', 'dc/PoisonDcid', 'geoId/06'], 'Count_Person')
+
+    errors = {}
+    stats = dc.get_stats(['geoId/05', 'dc/PoisonDcid', 'geoId/06'],
+                         'Count_Person', errors=errors)
+    self.assertEqual(sorted(stats), ['geoId/05', 'geoId/06'])
+    self.assertEqual(list(errors), ['dc/PoisonDcid'])
+    self.assertIn('500', errors['dc/PoisonDcid'])
+
+    # Errors are keyed by stats var when given a list of stats vars.
+    errors = {}
+    stats = dc.get_stats(['geoId/05', 'dc/PoisonDcid'], ['Count_Person'],
+                         errors=errors)
+    self.assertEqual(list(stats['Count_Person']), ['geoId/05'])
+    self.assertEqual(list(errors), ['Count_Person'])
+    self.assertEqual(list(errors['Count_Person']), ['dc/PoisonDcid'])
+
+    dc.utils._BATCH_RETRY_DELAY = save_retry_delay
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_progress(self, mock_urlopen):
+    """ Calling get_stats with progress reports every completed batch. """
+    save_batch_size = dc.utils._QUERY_BATCH_SIZE
+    dc.utils._QUERY_BATCH_SIZE = 1
+
+    reports = []
+    dc.get_stats(['geoId/05', 'geoId/06', 'dc/MadDcid'], 'Count_Person',
+                 progress=reports.append)
+    self.assertEqual([r['batches_done'] for r in reports], [1, 2, 3])
+    self.assertEqual(reports[-1]['batches_total'], 3)
+    self.assertEqual(reports[-1]['requests'], 3)
+    self.assertEqual(reports[-1]['records'], 2)
+    self.assertGreater(reports[-1]['bytes'], 0)
+    self.assertIn('requests_per_second', reports[-1])
+
+    dc.utils._QUERY_BATCH_SIZE = save_batch_size
+
+
+class TestIterStats(unittest.TestCase):
+  """ Unit tests for iter_stats. """
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_iter_stats(self, mock_urlopen):
+    """ Calling iter_stats yields the same records as get_stats. """
+    save_batch_size = dc.utils._QUERY_BATCH_SIZE
+    dc.utils._QUERY_BATCH_SIZE = 1
+
+    records = dc.iter_stats(['geoId/05', 'geoId/06'], 'Count_Person')
+    self.assertDictEqual(dict(records), {
+      'geoId/05': {
+        'data': {'2018': 3013825},
+        'place_name': 'Arkansas'
+      },
+      'geoId/06': {
+        'data': {'2018': 39557045},
+        'place_name': 'California'
+      },
+    })
+    self.assertEqual(2, mock_urlopen.call_count)
+
+    dc.utils._QUERY_BATCH_SIZE = save_batch_size
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_ordered(self, mock_urlopen):
+    """ Calling iter_stats with ordered yields batches in input order. """
+    save_batch_size = dc.utils._QUERY_BATCH_SIZE
+    dc.utils._QUERY_BATCH_SIZE = 1
+
+    records = list(dc.iter_stats(['geoId/06', 'geoId/05', 'dc/MadDcid'],
+                                 ['Count_Person'], 'all', ordered=True))
+    self.assertEqual([(sv, place) for sv, place, _ in records],
+                     [('Count_Person', 'geoId/06'),
+                      ('Count_Person', 'geoId/05')])
+
+    dc.utils._QUERY_BATCH_SIZE = save_batch_size
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -31,6 +31,9 @@ except ImportError:
 import datacommons as dc
 import datacommons.utils as utils
 import json
+import os
+import shutil
+import tempfile
 import unittest
 import six.moves.urllib as urllib
 import zlib
@@ -378,6 +381,23 @@ class TestGetPlaceObs(unittest.TestCase):
       }
     ])
 
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_journal(self, urlopen):
+    """ Calling get_place_obs again with a journal reads it from disk. """
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'journal.db')
+    pvs = {
+      'placeOfBirth': 'BornInOtherStateInTheUnitedStates',
+      'age': 'Years5To17'
+    }
+    place_obs = dc.get_place_obs(
+      'City', '2017', 'Person', constraining_properties=pvs, journal=path)
+    self.assertEqual(1, urlopen.call_count)
+    self.assertListEqual(place_obs, dc.get_place_obs(
+      'City', '2017', 'Person', constraining_properties=pvs, journal=path))
+    self.assertEqual(1, urlopen.call_count)
+    shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
   unittest.main()
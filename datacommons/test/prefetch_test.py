@@ -0,0 +1,210 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for cache prefetching in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import datacommons as dc
+import datacommons.utils as utils
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import six
+
+# The prefetch module, which the package shadows with its prefetch function.
+prefetch = importlib.import_module('datacommons.prefetch')
+
+
+def request_mock(*args, **kwargs):
+  """ A mock urlopen in the urllib package. """
+  # Create the mock response object.
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  req = args[0]
+  data = json.loads(req.data)
+
+  # Mock responses for urlopen requests to get_places_in.
+  if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_places_in']:
+    res_json = json.dumps([
+      {'dcid': 'geoId/06', 'place': 'geoId/06085'},
+      {'dcid': 'geoId/06', 'place': 'geoId/06001'},
+    ])
+    return MockResponse(json.dumps({'payload': res_json}))
+
+  # Mock responses for urlopen requests to get_stats.
+  if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_stats']:
+    res_json = json.dumps(dict(
+      (place, {'data': {'2018': 1}, 'place_name': place})
+      for place in data['place']))
+    return MockResponse(json.dumps({'payload': res_json}))
+
+  # Mock responses for urlopen requests to get_stat_all.
+  if req.get_full_url() == utils._API_ROOT + utils._API_ENDPOINTS['get_stat_all']:
+    return MockResponse(json.dumps({'placeData': dict(
+      (place, {'statVarData': dict(
+        (sv, {'sourceSeries': []}) for sv in data['stat_vars'])})
+      for place in data['places'])}))
+
+
+MANIFEST = {
+  'places': ['geoId/06085', 'geoId/21'],
+  'places_in': [{'dcids': ['geoId/06'], 'place_type': 'County'}],
+  'stat_vars': ['Count_Person', 'Median_Age_Person'],
+}
+
+
+class TestPrefetch(unittest.TestCase):
+  """ Unit tests for prefetch. """
+
+  def setUp(self):
+    dc.set_cache(dc.MemoryCache(), per_dcid=True)
+
+  def tearDown(self):
+    dc.set_cache(None)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_prefetch(self, urlopen):
+    """ Prefetched places and stat vars are served from the cache. """
+    summary = dc.prefetch(MANIFEST)
+    self.assertDictEqual(summary,
+                         {'places': 3, 'stat_vars': 2, 'records': 6})
+    # One request expands the places and one fetches each stat var.
+    self.assertEqual(3, urlopen.call_count)
+    self.assertEqual(json.loads(urlopen.call_args[0][0].data)['place'],
+                     ['geoId/06085', 'geoId/21', 'geoId/06001'])
+
+    stats = dc.get_stats(['geoId/06001', 'geoId/21'], 'Count_Person')
+    self.assertEqual(sorted(stats), ['geoId/06001', 'geoId/21'])
+    self.assertEqual(dc.get_stat_value('geoId/21', 'Median_Age_Person'), 1)
+    self.assertEqual(3, urlopen.call_count)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_stat_all(self, urlopen):
+    """ Manifests may prefetch other endpoints. """
+    manifest = dict(MANIFEST, endpoints=['get_stat_all'])
+    self.assertEqual(dc.prefetch(manifest)['records'], 3)
+    dc.get_stat_all(['geoId/06085', 'geoId/21', 'geoId/06001'],
+                    MANIFEST['stat_vars'])
+    self.assertEqual(2, urlopen.call_count)
+
+  def test_bad_manifest(self):
+    """ Unknown endpoints and malformed expansions are rejected. """
+    with self.assertRaises(ValueError):
+      dc.prefetch(dict(MANIFEST, endpoints=['get_triples']))
+    with self.assertRaises(ValueError):
+      dc.prefetch({'places_in': [{'dcids': ['geoId/06']}]})
+
+  def test_needs_cache(self):
+    """ Prefetching without a cache installed per dcid is an error. """
+    dc.set_cache(None)
+    with self.assertRaises(ValueError):
+      dc.prefetch(MANIFEST)
+    dc.set_cache(dc.MemoryCache())
+    with self.assertRaises(ValueError):
+      dc.prefetch(MANIFEST)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_rate(self, urlopen):
+    """ The rate limit applies to the requests of the prefetch only. """
+    limiters = []
+
+    def progress(_):
+      # Other threads are not limited while prefetching.
+      thread = threading.Thread(target=lambda: limiters.append(
+        (utils._rate_limiter, getattr(utils._local, 'limiter', None))))
+      thread.start()
+      thread.join()
+
+    start = time.time()
+    dc.prefetch(MANIFEST, rate=20, progress=progress)
+    self.assertGreaterEqual(time.time() - start, 0.1)
+    self.assertTrue(limiters)
+    self.assertEqual(set(limiters), set([(None, None)]))
+    self.assertIsNone(utils._rate_limiter)
+    self.assertIsNone(getattr(utils._local, 'limiter', None))
+
+
+class TestMain(unittest.TestCase):
+  """ Unit tests for the prefetch command. """
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  @patch('sys.stderr', new_callable=six.StringIO)
+  @patch('sys.stdout', new_callable=six.StringIO)
+  def test_main(self, stdout, stderr, urlopen):
+    """ The command fills a disk cache from a manifest file. """
+    manifest = os.path.join(self.dir, 'manifest.json')
+    with open(manifest, 'w') as f:
+      json.dump(MANIFEST, f)
+    cache = os.path.join(self.dir, 'cache.db')
+    self.assertEqual(prefetch.main([manifest, '--cache', cache]), 0)
+    self.assertIn('Prefetched 6 records for 3 places', stdout.getvalue())
+    self.assertIsNone(utils._response_cache)
+
+    dc.set_cache(dc.DiskCache(cache), per_dcid=True)
+    try:
+      dc.get_stats(['geoId/06085'], 'Count_Person')
+    finally:
+      dc.set_cache(None)
+    self.assertEqual(3, urlopen.call_count)
+
+
+class TestRateLimit(unittest.TestCase):
+  """ Unit tests for set_rate_limit. """
+
+  def tearDown(self):
+    dc.set_rate_limit(None)
+
+  def test_spacing(self):
+    """ Requests are spaced out to the rate. """
+    dc.set_rate_limit(50)
+    start = time.time()
+    for _ in range(6):
+      utils._rate_limiter.acquire()
+    self.assertGreaterEqual(time.time() - start, 0.1)
+
+  def test_bad_rate(self):
+    """ Rates must be positive. """
+    with self.assertRaises(ValueError):
+      dc.set_rate_limit(0)
+
+
+if __name__ == '__main__':
+  unittest.main()
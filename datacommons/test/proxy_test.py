@@ -0,0 +1,166 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for the caching proxy of the Data Commons Python API, run against
+a local stand-in for the REST API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import datacommons as dc
+import datacommons.proxy as proxy
+import datacommons.utils as utils
+import json
+import os
+import threading
+import time
+import unittest
+
+import six.moves.BaseHTTPServer
+
+
+class Upstream(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
+  """ A stand-in for the REST API serving get_stat_all and get_stat_value.
+
+  Requests are recorded in the server's :code:`requests` list, and delayed by
+  its :code:`delay` in seconds.
+  """
+
+  def do_GET(self):
+    self.server.requests.append((self.path, self.headers.get('x-api-key')))
+    time.sleep(self.server.delay)
+    if self.path.startswith(utils._API_ENDPOINTS['get_stat_value']):
+      if 'dc/MadDcid' in self.path:
+        return self._send(500, {'message': 'bad place'})
+      return self._send(200, {'value': 123})
+    self._send(404, {})
+
+  def do_POST(self):
+    data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    self.server.requests.append((self.path, self.headers.get('x-api-key')))
+    time.sleep(self.server.delay)
+    if self.path == utils._API_ENDPOINTS['get_stat_all']:
+      return self._send(200, {'placeData': dict(
+        (place, {'statVarData': dict(
+          (sv, {'sourceSeries': [{'val': {'2018': 1}}]})
+          for sv in data['stat_vars'])})
+        for place in data['places'])})
+    self._send(404, {})
+
+  def _send(self, status, res_json):
+    body = json.dumps(res_json).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+class TestProxy(unittest.TestCase):
+  """ Unit tests for Proxy. """
+
+  def setUp(self):
+    self.upstream = proxy._Server(('127.0.0.1', 0), Upstream)
+    self.upstream.requests = []
+    self.upstream.delay = 0
+    threading.Thread(target=self.upstream.serve_forever,
+                     kwargs={'poll_interval': 0.01}).start()
+    host, port = self.upstream.server_address[:2]
+    self.proxy = proxy.Proxy(upstream='http://{}:{}'.format(host, port),
+                             api_key='proxy-key').start(poll_interval=0.01)
+    self.save_api_root = utils._API_ROOT
+    utils._API_ROOT = self.proxy.url
+
+  def tearDown(self):
+    utils._API_ROOT = self.save_api_root
+    self.proxy.stop()
+    self.upstream.shutdown()
+    self.upstream.server_close()
+
+  def test_caches(self):
+    """ Repeated requests are answered by the proxy. """
+    for _ in range(3):
+      res = dc.get_stat_all(['geoId/06', 'geoId/21'], ['Count_Person'])
+      self.assertEqual(res['geoId/21']['Count_Person'],
+                       {'sourceSeries': [{'val': {'2018': 1}}]})
+      self.assertEqual(dc.get_stat_value('geoId/06', 'Count_Person'), 123)
+    self.assertEqual(len(self.upstream.requests), 2)
+    self.assertEqual(self.proxy.counters['hits'], 4)
+
+    # The order of dcids does not matter.
+    dc.get_stat_all(['geoId/21', 'geoId/06'], ['Count_Person'])
+    self.assertEqual(len(self.upstream.requests), 2)
+
+  def test_coalesces(self):
+    """ Concurrent identical requests are forwarded once. """
+    self.upstream.delay = 0.2
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+      dc.get_stat_value('geoId/06', 'Count_Person'))) for _ in range(5)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results, [123] * 5)
+    self.assertEqual(len(self.upstream.requests), 1)
+    self.assertEqual(self.proxy.counters['coalesced'], 4)
+
+  def test_errors(self):
+    """ Upstream errors are relayed and not cached. """
+    for _ in range(2):
+      with self.assertRaises(ValueError):
+        dc.get_stat_value('dc/MadDcid', 'Count_Person')
+    self.assertEqual(len(self.upstream.requests), 2)
+
+  def test_api_key(self):
+    """ Client API keys are forwarded, with the proxy's key as fallback. """
+    save_api_key = os.environ.pop(utils._ENV_VAR_API_KEY, None)
+    try:
+      dc.get_stat_value('geoId/06', 'Count_Person')
+      dc.set_api_key('client-key')
+      dc.get_stat_value('geoId/21', 'Count_Person')
+    finally:
+      os.environ.pop(utils._ENV_VAR_API_KEY)
+      if save_api_key is not None:
+        os.environ[utils._ENV_VAR_API_KEY] = save_api_key
+    self.assertEqual([key for _, key in self.upstream.requests],
+                     ['proxy-key', 'client-key'])
+
+  def test_unknown_path(self):
+    """ Only the REST API endpoints and metrics are served. """
+    self.assertEqual(self.proxy.handle('GET', '/foo', b'')[0], 404)
+    self.assertEqual(self.upstream.requests, [])
+    dc.get_stat_value('geoId/06', 'Count_Person')
+    status, body = self.proxy.handle('GET', '/metrics', b'')
+    self.assertEqual(status, 200)
+    self.assertIn(b'datacommons_proxy_requests{result="misses"} 1', body)
+    self.assertIn(b'datacommons_cache_entries{endpoint="get_stat_value"} 1',
+                  body)
+
+  def test_rate(self):
+    """ Forwarded requests are rate limited. """
+    self.proxy._limiter = utils._RateLimiter(20)
+    start = time.time()
+    for place in ('geoId/01', 'geoId/02', 'geoId/04'):
+      dc.get_stat_value(place, 'Count_Person')
+    self.assertGreaterEqual(time.time() - start, 0.1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -28,6 +28,9 @@ except ImportError:
 import datacommons as dc
 import datacommons.utils as utils
 import json
+import os
+import shutil
+import tempfile
 import unittest
 import six.moves.urllib as urllib
 
@@ -341,6 +344,18 @@ class TestGetStatAll(unittest.TestCase):
         }
         self.assertDictEqual(stats, exp)
 
+    @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+    def test_journal(self, urlopen):
+        """Calling get_stat_all again with a journal reads it from disk."""
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, 'journal.db')
+        args = (['geoId/06', 'nuts/HU22'], ['Count_Person', 'Count_Person_Male'])
+        stats = dc.get_stat_all(*args, journal=path)
+        self.assertEqual(1, urlopen.call_count)
+        self.assertDictEqual(dc.get_stat_all(*args, journal=path), stats)
+        self.assertEqual(1, urlopen.call_count)
+        shutil.rmtree(tmp_dir)
+
 
 if __name__ == '__main__':
     unittest.main()
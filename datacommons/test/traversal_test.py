@@ -0,0 +1,130 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API unit tests.
+
+Unit tests for graph traversals in the Data Commons Python API.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import datacommons as dc
+import json
+import unittest
+
+# The containedInPlace edges of the graph served by request_mock, and the
+# types of its nodes.
+EDGES = [
+  ('geoId/0649670', 'geoId/06085'),
+  ('geoId/0643294', 'geoId/06085'),
+  ('geoId/06085', 'geoId/06'),
+  ('geoId/06001', 'geoId/06'),
+  ('geoId/2462850', 'geoId/24031'),
+  ('geoId/24031', 'geoId/24'),
+  ('geoId/06', 'country/USA'),
+  ('geoId/24', 'country/USA'),
+]
+TYPES = {
+  'geoId/0649670': 'City',
+  'geoId/0643294': 'Town',
+  'geoId/2462850': 'Town',
+  'geoId/06085': 'County',
+  'geoId/06001': 'County',
+  'geoId/24031': 'County',
+  'geoId/06': 'State',
+  'geoId/24': 'State',
+  'country/USA': 'Country',
+}
+
+
+def request_mock(*args, **kwargs):
+  """ A mock urlopen in the urllib package. """
+  # Create the mock response object.
+  class MockResponse:
+    def __init__(self, json_data):
+      self.json_data = json_data
+
+    def read(self):
+      return self.json_data
+
+  data = json.loads(args[0].data)
+  out = data['direction'] == 'out'
+  res = {}
+  for dcid in data['dcids']:
+    values = [parent if out else child for child, parent in EDGES
+              if (child if out else parent) == dcid]
+    if data.get('value_type'):
+      values = [v for v in values if TYPES[v] == data['value_type']]
+    res[dcid] = {data['direction']: [{'dcid': v} for v in values]}
+  return MockResponse(json.dumps({'payload': json.dumps(res)}))
+
+
+class TestTraverse(unittest.TestCase):
+  """ Unit tests for traverse. """
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_path(self, urlopen):
+    """ Every step is one hop in the given direction. """
+    paths = dc.traverse(['geoId/06', 'geoId/24'],
+                        ['<-containedInPlace', '<-containedInPlace:Town'])
+    self.assertDictEqual(dict(paths), {
+      'geoId/0643294': ('geoId/06', 'geoId/06085', 'geoId/0643294'),
+      'geoId/2462850': ('geoId/24', 'geoId/24031', 'geoId/2462850'),
+    })
+    # One request is sent per hop.
+    self.assertEqual(urlopen.call_count, 2)
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_repeat(self, urlopen):
+    """ Repeated steps are followed until no new nodes are reached. """
+    paths = dc.traverse(['geoId/0649670', 'geoId/2462850'],
+                        ['->containedInPlace+'])
+    self.assertEqual(list(paths), ['geoId/06085', 'geoId/24031', 'geoId/06',
+                                   'geoId/24', 'country/USA'])
+    self.assertEqual(paths['country/USA'],
+                     ('geoId/0649670', 'geoId/06085', 'geoId/06',
+                      'country/USA'))
+    # Every reached node is expanded once, and the last hop reaches nothing.
+    requested = [json.loads(call[0][0].data)['dcids']
+                 for call in urlopen.call_args_list]
+    self.assertEqual(requested, [
+      ['geoId/0649670', 'geoId/2462850'],
+      ['geoId/06085', 'geoId/24031'],
+      ['geoId/06', 'geoId/24'],
+      ['country/USA'],
+    ])
+
+  @patch('six.moves.urllib.request.urlopen', side_effect=request_mock)
+  def test_tuple_steps(self, urlopen):
+    """ Steps can be given as tuples. """
+    paths = dc.traverse(['country/USA'], [('containedInPlace', False, None),
+                                          ('containedInPlace', False, None)])
+    self.assertEqual(sorted(paths),
+                     ['geoId/06001', 'geoId/06085', 'geoId/24031'])
+
+  def test_bad_step(self):
+    """ Malformed steps are rejected before any request is sent. """
+    for step in ['<-', 'contained InPlace', 'containedInPlace:', ('name',), 3]:
+      with self.assertRaises(ValueError):
+        dc.traverse(['geoId/06'], [step])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2020 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+""" Data Commons Python API Traversal Module.
+
+Provides multi-hop traversals of the graph along a path expression, such as
+the counties of a set of states or the ancestors of a place.
+
+A path expression is a list of steps. Each step is a string of the form
+
+.. code-block:: text
+
+  [->|<-]property[+][:Type]
+
+where :code:`->` (the default) follows the property away from the current
+nodes and :code:`<-` towards them, :code:`+` repeats the step until no new
+nodes are reached, and :code:`:Type` keeps only values of the given type. A
+step can also be given as a :code:`(property, out, value_type)` tuple.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import re
+
+import six
+
+import datacommons.core as core
+
+# The form of a path expression step.
+_STEP_RE = re.compile(r'^(->|<-)?([^\s:+<>-][^\s:+]*)(\+)?(?::([^\s:]+))?$')
+
+
+def traverse(dcids, path):
+  """ Returns the nodes reached from :code:`dcids` along :code:`path`, with the
+  path of nodes leading to each.
+
+  The traversal is breadth first. The nodes of each hop are fetched in one
+  batched call, with all their values paginated, and every node is expanded
+  at most once per step. Repeated steps stop once a hop reaches no new nodes.
+
+  Args:
+    dcids (:obj:`iterable` of :obj:`str`): The dcids of the nodes to start
+      from.
+    path (:obj:`list`): The steps to follow, see the module documentation.
+      The type filter of a repeated step applies to every hop.
+
+  Returns:
+    An ordered :obj:`dict` from the dcid of each reached node to a
+    :obj:`tuple` of the dcids on the path to it, from a starting node to the
+    node itself. Nodes reached along several paths keep the first, shortest
+    one found.
+
+  Raises:
+    ValueError: If a step of the path is malformed, or if the payload returned
+      by the Data Commons REST API is malformed.
+
+  Examples:
+    We would like to get the counties of Maryland and Kentucky.
+
+    >>> traverse(['geoId/24', 'geoId/21'], ['<-containedInPlace:County'])
+    OrderedDict([
+      ('geoId/24001', ('geoId/24', 'geoId/24001')),
+      ...
+    ])
+
+    We would like to get every place that Mountain View is contained in.
+
+    >>> list(traverse(['geoId/0649670'], ['containedInPlace+']))
+    ['geoId/06085', 'geoId/06', 'country/USA', ...]
+  """
+  steps = [_parse_step(step) for step in path]
+  dcids = filter(lambda v: v==v, dcids)  # Filter out NaN values
+  paths = collections.OrderedDict((dcid, (dcid,)) for dcid in dcids)
+  for prop, out, value_type, repeat in steps:
+    reached = collections.OrderedDict()
+    frontier = paths
+    while frontier:
+      values = core.get_property_values(
+        list(frontier), prop, out, value_type, limit=None, paginate=True)
+      next_frontier = collections.OrderedDict()
+      for dcid, dcid_path in frontier.items():
+        for value in values[dcid]:
+          if value not in reached:
+            reached[value] = next_frontier[value] = dcid_path + (value,)
+      frontier = next_frontier if repeat else None
+    paths = reached
+  return paths
+
+
+def _parse_step(step):
+  """ Returns :code:`(prop, out, value_type, repeat)` for a path step. """
+  if isinstance(step, tuple):
+    if len(step) != 3:
+      raise ValueError(
+        'Path steps must be (property, out, value_type): {}'.format(step))
+    prop, out, value_type = step
+    return prop, out, value_type, False
+  if not isinstance(step, six.string_types):
+    raise ValueError('Malformed path step: {}'.format(step))
+  match = _STEP_RE.match(step)
+  if match is None:
+    raise ValueError('Malformed path step: {}'.format(step))
+  direction, prop, repeat, value_type = match.groups()
+  return prop, direction != '<-', value_type, bool(repeat)
@@ -20,13 +20,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 import base64
+import contextlib
 import json
+import mmap
 import os
+import six
+import sys
 import six.moves.urllib.error
 import six.moves.urllib.request
+import threading
+import time
 import zlib
 
 
@@ -57,12 +63,44 @@ _API_ENDPOINTS = {
 # The default value to limit to
 _MAX_LIMIT = 100
 
+# The largest limit of the first request for a batch of nodes when
+# paginating.
+_MAX_PAGE_LIMIT = 5000
+
 # Batch size for heavyweight queries.
 _QUERY_BATCH_SIZE = 500
 
+# Maximum number of batched requests a wrapper keeps in flight at once.
+_MAX_CONCURRENT_REQUESTS = 8
+
+# Number of times a failed batch is retried before it is split in half when
+# batch errors are tolerated.
+_MAX_BATCH_RETRIES = 2
+
+# Seconds to wait before the first retry of a failed batch, doubled on every
+# subsequent retry.
+_BATCH_RETRY_DELAY = 1.0
+
 # Environment variable names used by the package	
 _ENV_VAR_API_KEY = 'DC_API_KEY'	
 
+# The response cache installed by datacommons.cache.set_cache, if any.
+_response_cache = None
+
+# The limit on requests per second installed by set_rate_limit, if any.
+_rate_limiter = None
+
+# The cassette installed by datacommons.cassette.set_cassette, if any.
+_cassette = None
+
+# Per-thread state: the rate limiter of the requests sent on behalf of the
+# thread, on top of _rate_limiter, if any. See _thread_rate_limit.
+_local = threading.local()
+
+# A dict type keeping the order of insertion, the faster built-in one if it
+# does.
+_OrderedDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
 # --------------------------- API UTILITY FUNCTIONS ---------------------------
 
 
@@ -82,15 +120,166 @@ def set_api_key(api_key):
   os.environ[_ENV_VAR_API_KEY] = api_key
 
 
+def set_rate_limit(requests_per_second):
+  """Limits the rate of requests sent to the REST API by this process.
+
+  Requests beyond the rate wait until they may be sent. Responses served from
+  the cache are not limited.
+
+  Args:
+    requests_per_second (:obj:`float`): The maximum number of requests sent
+      per second, or :obj:`None` to remove the limit.
+
+  Raises:
+    ValueError: If :code:`requests_per_second` is not positive.
+  """
+  global _rate_limiter
+  if requests_per_second is None:
+    _rate_limiter = None
+    return
+  if requests_per_second <= 0:
+    raise ValueError('The rate limit must be positive.')
+  _rate_limiter = _RateLimiter(requests_per_second)
+
+
+@contextlib.contextmanager
+def _thread_rate_limit(requests_per_second):
+  """ Limits the rate of the requests sent by the calling thread in the
+  enclosed block, and by the threads sending batches for it, on top of any
+  limit set with :any:`set_rate_limit`. Other threads are not limited. If
+  :code:`requests_per_second` is :obj:`None`, no further limit applies.
+
+  Raises:
+    ValueError: If :code:`requests_per_second` is not positive.
+  """
+  if requests_per_second is not None and requests_per_second <= 0:
+    raise ValueError('The rate limit must be positive.')
+  saved = getattr(_local, 'limiter', None)
+  if requests_per_second is not None:
+    _local.limiter = _RateLimiter(requests_per_second)
+  try:
+    yield
+  finally:
+    _local.limiter = saved
+
+
+class _RateLimiter(object):
+  """ Spaces out requests from all threads to a maximum rate. """
+
+  def __init__(self, rate):
+    self.rate = rate
+    self._next = 0.0
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    """ Waits until the next request may be sent. """
+    with self._lock:
+      now = time.time()
+      slot = max(self._next, now)
+      self._next = slot + 1.0 / self.rate
+    if slot > now:
+      time.sleep(slot - now)
+
+
 # ------------------------- INTERNAL HELPER FUNCTIONS -------------------------
 
 
-def _send_request(req_url, req_json={}, compress=False, post=True, use_payload=True):
+def _send_request(req_url, req_json={}, compress=False, post=True,
+                  use_payload=True, stats=None, use_cache=True):
   """ Sends a POST/GET request to req_url with req_json, default to POST.
 
+  If a response cache is installed and :code:`use_cache` is set, the response
+  is served from it when possible and successful responses are added to it.
+  Stale responses are served while the cache refreshes them in the background.
+
+  If a :obj:`dict` is given as :code:`stats`, the number of response bytes is
+  recorded in it under :code:`'bytes'`, whether the response came from the
+  cache under :code:`'cached'`, and the seconds the request took on the
+  network under :code:`'latency'`, see :obj:`_fetch`.
+
   Returns:
     The payload returned by sending the POST/GET request formatted as a dict.
   """
+  cache = _response_cache if use_cache else None
+  res_body = None
+  if cache is not None:
+    cache_key, endpoint = cache.key(req_url, req_json, post)
+    res_body, stale = cache.lookup(cache_key, endpoint)
+    if stale:
+      cache.revalidate(cache_key, endpoint, lambda: _check_response(
+        _fetch(req_url, req_json, post), use_payload),
+        tags=cache.tags(req_url, req_json, post))
+    res_body = _mapped_text(res_body)
+  cached = res_body is not None
+
+  if stats is not None:
+    stats['latency'] = 0.0
+  if not cached:
+    res_body = _fetch(req_url, req_json, post, stats)
+  if stats is not None:
+    stats['bytes'] = 0 if cached else len(res_body)
+    stats['cached'] = cached
+
+  # Get the JSON
+  res_json = _check_response(res_body, use_payload, parse=True)
+  if cache is not None and not cached:
+    cache.set(cache_key, res_body, endpoint,
+              tags=cache.tags(req_url, req_json, post))
+  if not use_payload:
+    return res_json
+
+  # If the payload is compressed, decompress and decode it
+  payload = res_json['payload']
+  if compress:
+    payload = zlib.decompress(
+      base64.b64decode(payload), zlib.MAX_WBITS|32)
+  return json.loads(payload)
+
+
+def _mapped_text(value):
+  """ Returns a memory mapped response decoded straight from its pages as
+  text, without copying it into :obj:`bytes` first, and closes the map.
+  Other values are returned unchanged.
+  """
+  if not isinstance(value, mmap.mmap):
+    return value
+  try:
+    return six.text_type(value, 'utf-8')
+  finally:
+    value.close()
+
+
+def _check_response(res_body, use_payload, parse=False):
+  """ Raises a ValueError if a response body has no payload where expected.
+
+  Returns:
+    The body, or its JSON if :code:`parse` is set.
+  """
+  res_json = json.loads(res_body)
+  if use_payload and 'payload' not in res_json:
+    raise ValueError(
+        'Response error: Payload not found. Printing response\n\n'
+        '{}'.format(res_body))
+  return res_json if parse else res_body
+
+
+def _fetch(req_url, req_json, post, stats=None):
+  """ Sends a POST/GET request to req_url and returns the response body.
+
+  If a cassette is installed, the response is replayed from or recorded to it.
+  If a :obj:`dict` is given as :code:`stats`, the seconds between sending the
+  request and reading its response are recorded in it under
+  :code:`'latency'`, excluding any wait for the rate limit.
+  """
+  cassette = _cassette
+  if cassette is not None:
+    recorded = cassette.play(req_url, req_json, post)
+    if recorded is not None:
+      status, res_body = recorded
+      if status != 200:
+        raise _http_error(status, res_body)
+      return res_body
+
   headers = {
     'Content-Type': 'application/json'
   }
@@ -99,7 +288,12 @@ def _send_request(req_url, req_json={}, compress=False, post=True, use_payload=T
   if os.environ.get(_ENV_VAR_API_KEY):
     headers['x-api-key'] = os.environ[_ENV_VAR_API_KEY]
 
+  for limiter in (_rate_limiter, getattr(_local, 'limiter', None)):
+    if limiter is not None:
+      limiter.acquire()
+
   # Send the request and verify the request succeeded
+  start = time.time()
   if post:
     req = six.moves.urllib.request.Request(
       req_url,
@@ -110,37 +304,50 @@ def _send_request(req_url, req_json={}, compress=False, post=True, use_payload=T
   try:
     res = six.moves.urllib.request.urlopen(req)
   except six.moves.urllib.error.HTTPError as e:
-    raise ValueError(
-        'Response error: An HTTP {} code was returned by the mixer. Printing '
-        'response\n\n{}'.format(e.code, e.read()))
+    res_body = e.read()
+    if cassette is not None:
+      cassette.record(req_url, req_json, post, e.code, res_body)
+    raise _http_error(e.code, res_body)
+  res_body = res.read()
+  if stats is not None:
+    stats['latency'] = time.time() - start
+  if cassette is not None:
+    cassette.record(req_url, req_json, post, 200, res_body)
+  return res_body
 
-  # Get the JSON
-  res_json = json.loads(res.read())
-  if not use_payload:
-    return res_json
-  if 'payload' not in res_json:
-    raise ValueError(
-        'Response error: Payload not found. Printing response\n\n'
-        '{}'.format(res.text))
 
-  # If the payload is compressed, decompress and decode it
-  payload = res_json['payload']
-  if compress:
-    payload = zlib.decompress(
-      base64.b64decode(payload), zlib.MAX_WBITS|32)
-  return json.loads(payload)
+def _http_error(code, res_body):
+  """ Returns the error raised for an HTTP error response. """
+  return ValueError(
+      'Response error: An HTTP {} code was returned by the mixer. Printing '
+      'response\n\n{}'.format(code, res_body))
 
 
-def _format_expand_payload(payload, new_key, must_exist=[]):
-  """ Formats expand type payloads into dicts from dcids to lists of values. """
+def _format_expand_payload(payload, new_key, must_exist=[], sort=True):
+  """ Formats expand type payloads into dicts from dcids to lists of values.
+
+  The values of each dcid are deduplicated and sorted, or kept in the order
+  of the payload if :code:`sort` is unset, see :obj:`_unique`.
+  """
   # Create the results dictionary from payload
-  results = defaultdict(set)
+  results = defaultdict(list)
   for entry in payload:
     if 'dcid' in entry and new_key in entry:
       dcid = entry['dcid']
-      results[dcid].add(entry[new_key])
+      results[dcid].append(entry[new_key])
 
   # Ensure all dcids in must_exist have some entry in results.
   for dcid in must_exist:
     results[dcid]
-  return {k: sorted(list(v)) for k, v in results.items()}
+  return {k: _unique(v, sort) for k, v in results.items()}
+
+
+def _unique(values, sort=True):
+  """ Returns the distinct :code:`values` as a sorted list.
+
+  If :code:`sort` is unset, the values are instead kept in the order they
+  first appear, which avoids the sort.
+  """
+  if sort:
+    return sorted(set(values))
+  return list(_OrderedDict.fromkeys(values))